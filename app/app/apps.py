@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class ProjectConfig(AppConfig):
+    name = 'app'
+
+    def ready(self):
+        from app import dbpool  # noqa: F401  Registers the fork hook and the pool stats logging
@@ -4,6 +4,9 @@ import os
 
 from celery import Celery
 from django.conf import settings
+from lead import lanes
+
+from app import codec, dbpool, tracing  # noqa: F401  codec registers the compact serializer
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
@@ -14,6 +17,10 @@ app.config_from_object(settings, namespace='CELERY')
 
 app.autodiscover_tasks()
 
+tracing.connect_celery_signals()
+dbpool.connect_celery_signals()
+lanes.connect_celery_signals()
+
 
 @app.task(bind=True)
 def debug_task(self):
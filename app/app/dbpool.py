@@ -0,0 +1,124 @@
+'''
+Sizing, fork safety and metrics of the per-process psycopg connection pools (DATABASES[...]['OPTIONS']['pool']).
+
+Django creates a pool per database alias on the first query of a process, from the settings of that moment:
+- Celery workers resize it in ``worker_init``, before the prefork children are forked.
+- A forked child never touches a pool inherited from its parent. Its connections share sockets with the parent's,
+  so they are dropped without being closed, and the child opens its own pool on first use.
+Pool statistics (size, waiting requests, checkout wait time) are logged every DB_POOL_STATS_INTERVAL seconds
+from the end of requests and tasks.
+'''
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import connections
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+_inherited_pools: List[Any] = []  # Kept referenced so garbage collection never closes the parent's sockets
+_stats_lock = threading.Lock()
+_stats_logged_at = time.monotonic()
+
+
+def _pooled_aliases() -> List[str]:
+    return [alias for alias in connections if connections.settings[alias].get('OPTIONS', {}).get('pool')]
+
+
+def worker_pool_size(pool_cls: Any, concurrency: int) -> int:
+    '''Connections a Celery worker process needs: one per task it runs at the same time.'''
+    name = pool_cls if isinstance(pool_cls, str) else f'{pool_cls.__module__}.{pool_cls.__name__}'
+    # Prefork children and the solo pool run one task at a time, thread and green pools run `concurrency`
+    return concurrency if any(kind in name for kind in ('thread', 'gevent', 'eventlet')) else 1
+
+
+def resize(max_size: int):
+    '''Set the pool size of every pooled alias; only pools created afterwards pick it up.'''
+    for alias in _pooled_aliases():
+        options = connections.settings[alias]['OPTIONS']['pool']
+        options['max_size'] = max(max_size, options.get('min_size', 1))
+
+
+def _open_pools() -> Dict[str, Any]:
+    pools = {}
+    for alias in _pooled_aliases():
+        pool = type(connections[alias])._connection_pools.get(alias)
+        if pool is not None:
+            pools[alias] = pool
+    return pools
+
+
+def forget_inherited_pools():
+    '''Run in a freshly forked child: drop the parent's pools so the child opens its own.'''
+    for alias, pool in _open_pools().items():
+        _inherited_pools.append(pool)
+        del type(connections[alias])._connection_pools[alias]
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None  # Shared with the parent as well
+
+
+os.register_at_fork(after_in_child=forget_inherited_pools)
+
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    '''Current sizes and counters of the pools this process has opened, by alias.'''
+    return {alias: pool.get_stats() for alias, pool in _open_pools().items()}
+
+
+def log_pool_stats():
+    '''Log every pool's size and the checkouts since the previous call, then reset the counters.'''
+    for alias, pool in _open_pools().items():
+        stats = pool.pop_stats()
+        requests = stats.get('requests_num', 0)
+        logger.info(
+            'DB pool %s: size=%s/%s available=%s waiting=%s; %s checkouts, %s waited (%.1f ms avg), '
+            '%s new connections (%.1f ms avg), %s lost, %s errors',
+            alias,
+            stats.get('pool_size', 0),
+            stats.get('pool_max', 0),
+            stats.get('pool_available', 0),
+            stats.get('requests_waiting', 0),
+            requests,
+            stats.get('requests_queued', 0),
+            stats.get('requests_wait_ms', 0) / max(requests, 1),
+            stats.get('connections_num', 0),
+            stats.get('connections_ms', 0) / max(stats.get('connections_num', 0), 1),
+            stats.get('connections_lost', 0),
+            stats.get('requests_errors', 0),
+        )
+
+
+def maybe_log_pool_stats(**kwargs):
+    global _stats_logged_at
+    if not settings.DB_POOL_STATS_INTERVAL or time.monotonic() - _stats_logged_at < settings.DB_POOL_STATS_INTERVAL:
+        return
+    with _stats_lock:
+        if time.monotonic() - _stats_logged_at < settings.DB_POOL_STATS_INTERVAL:
+            return  # Another thread just logged
+        _stats_logged_at = time.monotonic()
+    log_pool_stats()
+
+
+@receiver(request_finished)
+def _request_finished(**kwargs):
+    maybe_log_pool_stats()
+
+
+def _size_worker_pool(sender=None, **kwargs):
+    if settings.DB_POOL_MAX_SIZE:
+        return  # Sized explicitly
+    size = worker_pool_size(sender.pool_cls, sender.concurrency)
+    resize(size)
+    logger.info('DB pool sized to %s connections per worker process', size)
+
+
+def connect_celery_signals():
+    from celery.signals import task_postrun, worker_init
+
+    worker_init.connect(_size_worker_pool, weak=False)
+    task_postrun.connect(maybe_log_pool_stats, weak=False)
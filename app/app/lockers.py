@@ -1,11 +1,32 @@
+'''
+Database locks that keep a task from running twice at once.
+
+A lock is a TaskExecutionLock row. On PostgreSQL the holder takes a session-level advisory lock keyed by the row id
+(pg_advisory_lock) and stamps ``locked_at`` for the duration of the task. The task body runs outside of any
+transaction of the lock, so what it commits stays committed when it fails halfway, and a worker that dies releases
+the lock with its connection. Other databases only have the ``locked_at`` stamp, set if it is empty or older than
+the timeout. The lock name of singleton_task() may hold ``{argument}`` fields, filled from the task's call
+arguments, so one task can hold a lock per lead or per shard. Every name gets its own row.
+
+Callers that find the lock held either wait for it (the default) or, with ``coalesce=True``, leave a rerun request
+and return at once: the holder runs once more after its current run, however many requests piled up meanwhile.
+The rerun repeats the holder's own call, so coalescing suits tasks whose calls with the same lock name do the same work.
+
+Outcomes are counted per lock name template in the cache: ``acquired`` (runs, reruns included), ``skipped``
+(a waiter found the lock taken over by another worker after a timeout) and ``coalesced`` (requests folded into a
+rerun). ``manage.py lock_stats`` prints them.
+'''
+import inspect
 import logging
 from contextlib import contextmanager
 from datetime import timedelta
 from functools import wraps
-from typing import Callable, TypeVar
+from typing import Callable, Dict, Iterable, TypeVar
 
 from django.conf import settings
-from django.db import transaction
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
 from django.utils import timezone
 from lead.models import TaskExecutionLock
 
@@ -13,35 +34,127 @@ logger = logging.getLogger(__name__)
 
 T = TypeVar('T')
 
+ACQUIRED = 'acquired'
+SKIPPED = 'skipped'
+COALESCED = 'coalesced'
+OUTCOMES = (ACQUIRED, SKIPPED, COALESCED)
+STATS_CACHE_KEY = 'lock:stats:{}:{}'
+RERUN_CACHE_KEY = 'lock:rerun:{}'
+
+# Lock name templates of the singleton tasks defined in this process, for lock_stats()
+registered_locks = set()
+
+
+def _claim(lock: TaskExecutionLock, timeout: timedelta) -> bool:
+    '''Stamp ``locked_at`` unless another run stamped it less than ``timeout`` ago.'''
+    now = timezone.now()
+    claimed = TaskExecutionLock.objects.filter(
+        Q(locked_at__isnull=True) | Q(locked_at__lt=now - timeout), pk=lock.pk
+    ).update(locked_at=now)
+    return claimed == 1
+
 
 @contextmanager
-def _db_task_lock(name: str, timeout: timedelta):
-    with transaction.atomic():
-        # Grab a row-level lock so concurrent workers serialize on the same TaskExecutionLock record
-        lock, _ = TaskExecutionLock.objects.select_for_update().get_or_create(name=name)
-        now = timezone.now()
-        if lock.locked_at is None or (now - lock.locked_at) > timeout:
-            lock.locked_at = now
-            lock.save(update_fields=['locked_at'])
-            try:
-                yield True
-            finally:
-                lock.locked_at = None
-                lock.save(update_fields=['locked_at'])
+def _db_task_lock(name: str, timeout: timedelta, wait: bool = True):
+    lock, _ = TaskExecutionLock.objects.get_or_create(name=name)
+    advisory = connection.vendor == 'postgresql'
+    if advisory:
+        with connection.cursor() as cursor:
+            # Session-level, so no transaction is held open while the task runs
+            cursor.execute('SELECT pg_advisory_lock(%s)' if wait else 'SELECT pg_try_advisory_lock(%s)', [lock.pk])
+            if not wait and not cursor.fetchone()[0]:
+                yield False
+                return
+    try:
+        # Advisory locks are reentrant within a session: a nested call of the same lock still finds the stamp.
+        # A stamp left behind by a worker that died is honoured until the timeout
+        acquired = _claim(lock, timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                TaskExecutionLock.objects.filter(pk=lock.pk).update(locked_at=None)
+    finally:
+        if advisory:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_unlock(%s)', [lock.pk])
+
+
+def task_lock(name: str, timeout: timedelta | None = None):
+    '''Context manager yielding whether the named lock was acquired, for callers whose lock name is only known at runtime.'''
+    return _db_task_lock(name, timeout or timedelta(seconds=settings.TASK_LOCK_TIMEOUT))
+
+
+def _count(label: str, outcome: str):
+    key = STATS_CACHE_KEY.format(label, outcome)
+    cache.add(key, 0, timeout=None)
+    cache.incr(key)
+
+
+def lock_stats(labels: Iterable[str] | None = None) -> Dict[str, Dict[str, int]]:
+    '''Outcome counters of each lock name template (every registered one by default).'''
+    labels = sorted(registered_locks if labels is None else labels)
+    counts = cache.get_many([STATS_CACHE_KEY.format(label, outcome) for label in labels for outcome in OUTCOMES])
+    return {
+        label: {outcome: counts.get(STATS_CACHE_KEY.format(label, outcome), 0) for outcome in OUTCOMES}
+        for label in labels
+    }
+
+
+def _run_coalesced(name: str, label: str, timeout: timedelta, run: Callable[[], T]) -> T | None:
+    rerun_key = RERUN_CACHE_KEY.format(name)
+    result = None
+    ran = requested = False
+    while True:
+        with _db_task_lock(name, timeout, wait=False) as acquired:
+            if acquired:
+                cache.delete(rerun_key)  # This run starts after every request made so far, so it answers them
+                _count(label, ACQUIRED)
+                result = run()
+                ran = True
+        if acquired:
+            # Checked after the release: a request made before it is seen here, one made after it gets the lock
+            if cache.get(rerun_key) is None:
+                return result
+            logger.debug('Task lock %s: rerun requested while held, running again', name)
+        elif ran:
+            return result  # Another caller took the lock for the rerun
+        elif requested:
+            _count(label, COALESCED)
+            logger.debug('Task lock %s is held: rerun requested', name)
+            return None
         else:
-            yield False
+            # Ask the holder for a rerun, then try once more in case it released before seeing the request.
+            # No expiry: a run may outlast the lock timeout, and the next holder clears the request anyway
+            cache.set(rerun_key, 1, timeout=None)
+            requested = True
 
 
-def singleton_task(lock_name: str, timeout: timedelta | None = None):
+def singleton_task(lock_name: str, timeout: timedelta | None = None, coalesce: bool = False):
+    '''
+    Run the decorated task under the lock ``lock_name``, formatted with the call arguments (``'x.shard-{index}'``).
+    Returns None instead of running when the lock is held, or, with ``coalesce``, when a rerun was requested instead.
+    '''
     timeout = timeout or timedelta(seconds=settings.TASK_LOCK_TIMEOUT)
+    registered_locks.add(lock_name)
 
     def decorator(func: Callable[..., T]) -> Callable[..., T]:
+        signature = inspect.signature(func)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            with _db_task_lock(lock_name, timeout) as acquired:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            name = lock_name.format_map(bound.arguments)
+            if coalesce:
+                return _run_coalesced(name, lock_name, timeout, lambda: func(*args, **kwargs))
+
+            with task_lock(name, timeout) as acquired:
                 if not acquired:
-                    logger.debug('Task %s skipped: lock %s is held', lock_name, lock_name)
+                    _count(lock_name, SKIPPED)
+                    logger.debug('Task %s skipped: lock %s is held', func.__name__, name)
                     return None
+                _count(lock_name, ACQUIRED)
                 # Only the worker that successfully acquired the lock proceeds to execute the task body
                 return func(*args, **kwargs)
 
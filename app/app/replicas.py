@@ -0,0 +1,141 @@
+'''
+Read-replica routing.
+
+Reads go to a replica (REPLICA_ALIASES, see POSTGRES_REPLICA_HOSTS) only inside replica_reads(). Read-only views
+and reporting code opt in this way. Everything else stays on the primary:
+- writes, and reads that lock rows (select_for_update);
+- any query inside a transaction on the primary;
+- reads of a client that wrote less than REPLICA_STICKY_SECONDS ago, pinned by ReplicaPinMiddleware with a cookie;
+- reads while no replica is within REPLICA_MAX_LAG seconds of the primary (checked every REPLICA_LAG_CHECK_INTERVAL).
+'''
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, Iterator, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_primary_pin'
+# As rest_framework.permissions.SAFE_METHODS: this module is loaded by every worker as a database router
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Seconds of lag, 0 when the alias isn't a standby or has replayed everything it received: the replay timestamp
+# alone keeps ageing while the primary is idle
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+'''
+
+
+@dataclass
+class _RequestState:
+    pinned: bool = False  # Reads of this request must see the client's own recent writes
+    wrote: bool = False
+
+
+_replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+_request_state: ContextVar[_RequestState | None] = ContextVar('replica_request_state', default=None)
+_freshness: Dict[str, Tuple[float, bool]] = {}  # alias -> (checked at, lag within REPLICA_MAX_LAG)
+
+
+@contextmanager
+def replica_reads(enabled: bool = True) -> Iterator[None]:
+    '''Let the reads in this block go to a replica (or, with ``enabled=False``, keep them on the primary).'''
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def max_staleness() -> float:
+    '''Upper bound of how far behind the primary a replica read may be.'''
+    return settings.REPLICA_MAX_LAG + settings.REPLICA_LAG_CHECK_INTERVAL
+
+
+def replica_is_fresh(alias: str) -> bool:
+    checked_at, fresh = _freshness.get(alias, (0.0, False))
+    if checked_at and time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return fresh
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            lag = cursor.fetchone()[0]
+        fresh = lag is not None and lag <= settings.REPLICA_MAX_LAG
+        if not fresh:
+            logger.warning('Replica %s lags %ss behind the primary, reading from the primary', alias, lag)
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable, reading from the primary', alias, exc_info=True)
+        fresh = False
+    _freshness[alias] = (time.monotonic(), fresh)
+    return fresh
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not settings.REPLICA_ALIASES or not _replica_reads.get():
+            return None
+        state = _request_state.get()
+        if state is not None and (state.pinned or state.wrote):
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None  # A transaction must see its own writes and a consistent snapshot
+        fresh = [alias for alias in settings.REPLICA_ALIASES if replica_is_fresh(alias)]
+        return random.choice(fresh) if fresh else None
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Replicas hold the same rows as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.REPLICA_ALIASES
+
+
+class ReplicaPinMiddleware:
+    '''Keeps a client's reads on the primary for REPLICA_STICKY_SECONDS after it wrote something.'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        state = _RequestState(pinned=pinned)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+        if state.wrote:
+            response.set_cookie(
+                PIN_COOKIE,
+                str(time.time() + settings.REPLICA_STICKY_SECONDS),
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax'
+            )
+        return response
+
+
+class ReplicaReadMixin:
+    '''Serves the safe methods of a DRF view from a replica.'''
+
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads(request.method in SAFE_METHODS):
+            return super().dispatch(request, *args, **kwargs)
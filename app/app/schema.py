@@ -0,0 +1,36 @@
+'''
+OpenAPI schema served from a file written at build time.
+
+Generating the schema walks every view and serializer, which takes seconds on the first request of each process.
+The Docker image runs ``manage.py spectacular --file`` once while it is built, and PrecomputedSchemaView serves that
+file (OPENAPI_SCHEMA_FILE) as it is. JSON requests, ``?lang=`` and a missing file fall back to generating the schema.
+'''
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+from drf_spectacular.views import SpectacularAPIView
+
+YAML_FORMATS = ('yaml', 'openapi')
+
+
+@lru_cache(maxsize=1)
+def _read(schema_file: str) -> bytes | None:
+    try:
+        return Path(schema_file).read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+class PrecomputedSchemaView(SpectacularAPIView):
+
+    def get(self, request, *args, **kwargs):
+        schema = _read(settings.OPENAPI_SCHEMA_FILE)
+        if schema is None or request.GET or request.accepted_renderer.format not in YAML_FORMATS:
+            return super().get(request, *args, **kwargs)
+        return HttpResponse(
+            schema,
+            content_type=request.accepted_media_type,
+            headers={'Content-Disposition': f'inline; filename="{Path(settings.OPENAPI_SCHEMA_FILE).name}"'}
+        )
@@ -26,9 +26,13 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 # - CORS CONFIGURATION
 # - REST CONFIGURATION
 # - NOTIFICATIONS CONFIGURATION
+# - EVENTS CONFIGURATION
+# - TRACING CONFIGURATION
 # =======================================================
 
+import json
 import sys
+from copy import deepcopy
 from os import environ, getenv, path
 from pathlib import Path
 
@@ -115,6 +119,14 @@ STORAGES = {
 # DATABASE CONFIGURATION
 # =======================================================
 
+# Per-process psycopg connection pool. DB_POOL_MAX_SIZE=0 derives the size from the process: a Celery worker gets its
+# concurrency (1 per prefork child, see app.dbpool), anything else ASGI_THREADS or 10
+DB_POOL_MIN_SIZE = int(environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(environ.get('DB_POOL_MAX_SIZE', 0))
+DB_POOL_TIMEOUT = float(environ.get('DB_POOL_TIMEOUT', 10))  # Seconds a checkout may wait before failing
+DB_POOL_MAX_IDLE = float(environ.get('DB_POOL_MAX_IDLE', 300))  # Seconds before an idle connection above min_size is closed
+DB_POOL_STATS_INTERVAL = int(environ.get('DB_POOL_STATS_INTERVAL', 60))  # Seconds between pool stats log lines, 0 disables
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.postgresql',
@@ -123,9 +135,34 @@ DATABASES = {
         'PASSWORD': getenv('POSTGRES_PASSWORD', 'pass'),
         'HOST': getenv('POSTGRES_HOST', 'localhost'),
         'PORT': getenv('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': 0,  # Closing a pooled connection returns it to the pool; Django refuses anything else with a pool
+        'CONN_HEALTH_CHECKS': True,  # The pool checks every connection on checkout
+        'OPTIONS': {
+            'pool': {
+                'min_size': DB_POOL_MIN_SIZE,
+                'max_size': max(DB_POOL_MAX_SIZE or int(environ.get('ASGI_THREADS', 10)), DB_POOL_MIN_SIZE),
+                'timeout': DB_POOL_TIMEOUT,
+                'max_idle': DB_POOL_MAX_IDLE,
+            },
+        },
     }
 }
 
+# Streaming replicas for read-only views and reports (see app.replicas): ';'-separated host[:port] entries,
+# each one becomes the alias replica_<n> with the credentials of the primary
+for index, replica in enumerate(filter(None, (h.strip() for h in getenv('POSTGRES_REPLICA_HOSTS', '').split(';')))):
+    replica_host, _, replica_port = replica.partition(':')
+    DATABASES[f'replica_{index}'] = deepcopy(DATABASES['default']) | {
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_ALIASES = [alias for alias in DATABASES if alias != 'default']
+REPLICA_MAX_LAG = float(environ.get('REPLICA_MAX_LAG', 5))  # Seconds a replica may be behind before reads fall back to the primary
+REPLICA_LAG_CHECK_INTERVAL = float(environ.get('REPLICA_LAG_CHECK_INTERVAL', 5))  # Seconds between lag checks of a replica
+REPLICA_STICKY_SECONDS = int(environ.get('REPLICA_STICKY_SECONDS', 10))  # Seconds a client's reads stay on the primary after it wrote
+DATABASE_ROUTERS = ['app.replicas.ReplicaRouter']
+
 # =======================================================
 # TEMPLATES CONFIGURATION
 # =======================================================
@@ -149,6 +186,9 @@ TEMPLATES = [
 # APPLICATION DEFINITION
 # =======================================================
 
+# 'web' runs daphne and the migrations; 'worker' is for Celery workers, beat and the background commands
+APP_ROLE = environ.get('APP_ROLE', 'web')
+
 INSTALLED_APPS = [
     'app',
     'lead',
@@ -166,12 +206,27 @@ INSTALLED_APPS = [
     'django_celery_beat',
     'corsheaders'
 ]
+# Admin, browsable API, OpenAPI and CORS tooling only serves HTTP: the other roles skip importing it at startup
+WEB_ONLY_APPS = (
+    'django.contrib.admin',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+    'drf_spectacular',
+    'rest_framework',
+    'rest_framework.authtoken',  # Only the API authenticates with tokens; installed, it would import DRF in workers
+    'corsheaders',
+)
+if APP_ROLE != 'web':
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in WEB_ONLY_APPS]
+    ROOT_URLCONF = 'app.worker_urls'  # The API views would import DRF and the schema tooling back in
 
 # =======================================================
 # MIDDLEWARE CONFIGURATION
 # =======================================================
 
 MIDDLEWARE = [
+    'app.tracing.TracingMiddleware',
+    'app.replicas.ReplicaPinMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -182,6 +237,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+if APP_ROLE != 'web':
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE if not middleware.startswith(tuple(f'{app}.' for app in WEB_ONLY_APPS))]
 
 # =======================================================
 # CELERY & CACHE CONFIGURATION
@@ -189,7 +246,6 @@ MIDDLEWARE = [
 
 broker_url = environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
 result_backend = environ.get('CELERY_RESULT_BACKEND')
-accept_content = ['json']
 task_serializer = 'json'
 result_serializer = 'json'
 result_expires = int(getenv('CELERY_TASK_RESULT_EXPIRES', 3600))
@@ -202,6 +258,9 @@ else:
     broker_connection_max_retries = None
 broker_pool_limit = int(getenv('CELERY_BROKER_POOL_LIMIT', 10))
 broker_heartbeat = int(getenv('CELERY_BROKER_HEARTBEAT', 30))
+# Workers read the compact serializer of app.codec whatever producers use, see FOLLOWUP_SEND_SERIALIZER
+CELERY_ACCEPT_CONTENT = ['json', 'compact']
+MESSAGE_COMPRESS_MIN_BYTES = int(environ.get('MESSAGE_COMPRESS_MIN_BYTES', 2048))  # Compact bodies this long or longer are zlib-compressed
 
 CACHE_URL = environ.get('CACHE_URL', 'redis://localhost:6379/2')
 CACHES = {
@@ -214,6 +273,27 @@ CACHES = {
     }
 }
 
+# The collector and the SMS fan-out run on separate queues so that the I/O-bound senders
+# can be served by a thread-pool worker while the collector stays on prefork
+FOLLOWUP_COLLECT_QUEUE = 'followups.collect'
+FOLLOWUP_SEND_QUEUE = 'followups.send'
+# Priority lanes (lead/lanes.py): each rule priority has its own send queue, all consumed by the sender.
+# The normal lane keeps the original queue, so messages published before the lanes existed are still delivered
+FOLLOWUP_SEND_LANES = {
+    'high': f'{FOLLOWUP_SEND_QUEUE}.high',
+    'normal': FOLLOWUP_SEND_QUEUE,
+    'low': f'{FOLLOWUP_SEND_QUEUE}.low',
+}
+# Share of the sender's pops each lane gets while all of them have a backlog (Redis transport)
+FOLLOWUP_LANE_WEIGHTS = json.loads(environ.get('FOLLOWUP_LANE_WEIGHTS', '{"high": 8, "normal": 3, "low": 1}'))
+CELERY_BROKER_TRANSPORT_OPTIONS = {'queue_order_strategy': 'lead.lanes:WeightedLaneCycle'}
+CELERY_TASK_ROUTES = {
+    'lead.task.task_collect_followups': {'queue': FOLLOWUP_COLLECT_QUEUE},
+    'lead.task.task_collect_followups_shard': {'queue': FOLLOWUP_COLLECT_QUEUE},
+    'lead.task.task_collect_lead_followups': {'queue': FOLLOWUP_COLLECT_QUEUE},
+    'lead.task.task_send_followup': {'queue': FOLLOWUP_SEND_QUEUE},
+}
+
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 CELERY_BEAT_SCHEDULE_FILENAME = environ.get(
     'CELERY_BEAT_SCHEDULE_FILENAME',
@@ -230,6 +310,8 @@ SPECTACULAR_SETTINGS = {
     'VERSION': '1.0.0',
     'SERVE_INCLUDE_SCHEMA': True
 }
+# Written at image build time by `manage.py spectacular --file`, and served by schema/ instead of generating it
+OPENAPI_SCHEMA_FILE = path.join(BASE_DIR, environ.get('OPENAPI_SCHEMA_FILE', 'openapi-schema.yaml'))  # Relative to app/
 
 # =======================================================
 # CORS CONFIGURATION
@@ -272,3 +354,77 @@ REST_FRAMEWORK = {
 # =======================================================
 
 FOLLOWUP_REPEAT_THRESHOLD = int(environ.get('FOLLOWUP_REPEAT_THRESHOLD', 1440))
+# Number of (lead, rule) pairs per send message; small chunks let a thread-pool worker send them in parallel
+FOLLOWUP_SEND_CHUNK_SIZE = int(environ.get('FOLLOWUP_SEND_CHUNK_SIZE', 10))
+# 'json', or 'compact' (app.codec) once every worker runs a release that accepts it
+FOLLOWUP_SEND_SERIALIZER = environ.get('FOLLOWUP_SEND_SERIALIZER', 'json')
+SMS_SEND_DELAY = float(environ.get('SMS_SEND_DELAY', 3))
+# JSON list of SMS providers (lead.sms): name, backend, weight, rate (messages/s across all workers, 0: unlimited), burst
+SMS_GATEWAYS = json.loads(environ.get('SMS_GATEWAYS', '[{"name": "stub", "backend": "lead.sms.StubGateway"}]'))
+# Seconds ahead a sender may reserve a gateway token; a send that would wait longer is retried later instead
+SMS_RATE_MAX_WAIT = float(environ.get('SMS_RATE_MAX_WAIT', 60))
+# Times a failed send is re-published on another gateway before the pair is left to the next collector tick
+SMS_SEND_RETRIES = int(environ.get('SMS_SEND_RETRIES', 2))
+# Circuit breaker: a gateway failing (or answering slower than SMS_GATEWAY_SLOW_SECONDS) this many times within
+# the window is left out for the cooldown
+SMS_GATEWAY_SLOW_SECONDS = float(environ.get('SMS_GATEWAY_SLOW_SECONDS', 10))
+SMS_BREAKER_FAILURES = int(environ.get('SMS_BREAKER_FAILURES', 5))
+SMS_BREAKER_WINDOW = int(environ.get('SMS_BREAKER_WINDOW', 60))
+SMS_BREAKER_COOLDOWN = int(environ.get('SMS_BREAKER_COOLDOWN', 30))
+# Capacity assumed by the SMS forecast: sender threads across all replicas, and the gateway's hourly quota (0: none)
+FOLLOWUP_SEND_CONCURRENCY = int(environ.get('FOLLOWUP_SEND_CONCURRENCY', 64))
+SMS_GATEWAY_HOURLY_QUOTA = int(environ.get('SMS_GATEWAY_HOURLY_QUOTA', 0))
+# Backpressure: pairs enqueued per collector tick, and the backlog (queued + in-flight pairs) above which nothing is enqueued
+FOLLOWUP_MAX_ENQUEUE_PER_TICK = int(environ.get('FOLLOWUP_MAX_ENQUEUE_PER_TICK', 5000))
+FOLLOWUP_QUEUE_HIGH_WATER = int(environ.get('FOLLOWUP_QUEUE_HIGH_WATER', 20000))
+# 'simple' collects each tick in memory, 'streaming' reads server-side cursors and enqueues chunk by chunk,
+# 'vectorized' evaluates a NumPy snapshot of all leads kept in the collector process
+FOLLOWUP_COLLECTOR = environ.get('FOLLOWUP_COLLECTOR', 'simple')
+FOLLOWUP_STREAM_CHUNK_SIZE = int(environ.get('FOLLOWUP_STREAM_CHUNK_SIZE', 1000))
+# Vectorized collector: seconds between full snapshot reloads, and how far behind its watermark each incremental refresh re-reads
+FOLLOWUP_SNAPSHOT_REBUILD_INTERVAL = int(environ.get('FOLLOWUP_SNAPSHOT_REBUILD_INTERVAL', 3600))
+FOLLOWUP_SNAPSHOT_OVERLAP = int(environ.get('FOLLOWUP_SNAPSHOT_OVERLAP', 60))
+# Above 1 the collector tick fans out into this many lead id ranges, each with its own lock
+FOLLOWUP_COLLECTOR_SHARDS = int(environ.get('FOLLOWUP_COLLECTOR_SHARDS', 1))
+# 'interval' runs the collector every FOLLOWUP_COLLECT_INTERVAL seconds; 'adaptive' has every run schedule the next one
+# for when the next follow-up falls due, clamped to [MIN, MAX] seconds, with beat kept as a MAX-interval safety net
+FOLLOWUP_SCHEDULE_MODE = environ.get('FOLLOWUP_SCHEDULE_MODE', 'interval')
+FOLLOWUP_COLLECT_INTERVAL = int(environ.get('FOLLOWUP_COLLECT_INTERVAL', 20))
+FOLLOWUP_SCHEDULE_MIN_INTERVAL = int(environ.get('FOLLOWUP_SCHEDULE_MIN_INTERVAL', 5))
+FOLLOWUP_SCHEDULE_MAX_INTERVAL = int(environ.get('FOLLOWUP_SCHEDULE_MAX_INTERVAL', 600))
+# listen_followup_wakeups tracks the pairs falling due within this many seconds; later ones are left to the collector
+FOLLOWUP_WAKEUP_HORIZON = int(environ.get('FOLLOWUP_WAKEUP_HORIZON', 900))
+# Collector dry runs (manage.py collector_dry_run, rule admin) save the plans of queries at least this slow
+FOLLOWUP_SLOW_QUERY_MS = float(environ.get('FOLLOWUP_SLOW_QUERY_MS', 500))
+
+# =======================================================
+# EVENTS CONFIGURATION
+# =======================================================
+
+# Redis stream (in the CACHE_URL database) the outbox relay publishes LeadEvents to, trimmed to about MAXLEN entries
+LEAD_EVENTS_STREAM = environ.get('LEAD_EVENTS_STREAM', 'lead:events')
+LEAD_EVENTS_STREAM_MAXLEN = int(environ.get('LEAD_EVENTS_STREAM_MAXLEN', 100000))
+OUTBOX_RELAY_BATCH_SIZE = int(environ.get('OUTBOX_RELAY_BATCH_SIZE', 500))
+OUTBOX_RELAY_POLL_INTERVAL = float(environ.get('OUTBOX_RELAY_POLL_INTERVAL', 1))
+# Live feed (lead/live/): pub/sub channel, seconds between keep-alives, messages buffered per connection before
+# a slow client is dropped, rows of each kind replayed to a client resuming with Last-Event-ID, and how many ids
+# below the last one sent a row may still turn up (it committed after rows with higher ids)
+LIVE_FEED_CHANNEL = environ.get('LIVE_FEED_CHANNEL', 'lead:live')
+LIVE_FEED_HEARTBEAT = int(environ.get('LIVE_FEED_HEARTBEAT', 15))
+LIVE_FEED_QUEUE_SIZE = int(environ.get('LIVE_FEED_QUEUE_SIZE', 1000))
+LIVE_FEED_BACKFILL_LIMIT = int(environ.get('LIVE_FEED_BACKFILL_LIMIT', 1000))
+LIVE_FEED_REORDER_MARGIN = int(environ.get('LIVE_FEED_REORDER_MARGIN', 256))
+
+# Funnel statistics (lead/stats/): rows each counter is spread over to keep concurrent transitions off the same
+# row lock, and seconds the endpoint response is cached
+STATS_COUNTER_SLOTS = int(environ.get('STATS_COUNTER_SLOTS', 8))
+STATS_CACHE_TIMEOUT = int(environ.get('STATS_CACHE_TIMEOUT', 60))
+
+# =======================================================
+# TRACING CONFIGURATION
+# =======================================================
+
+# Share of new traces (HTTP requests without an incoming traceparent, beat ticks) that are recorded
+TRACING_SAMPLE_RATE = float(environ.get('TRACING_SAMPLE_RATE', 0))
+TRACING_EXPORTER = environ.get('TRACING_EXPORTER', 'app.tracing.JsonLinesExporter')
+TRACING_FILE = environ.get('TRACING_FILE', str(BASE_DIR / 'logs' / 'traces.jsonl'))
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+import random
+import secrets
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Iterator, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# W3C Trace Context header, reused verbatim as the Celery message header name
+TRACEPARENT_HEADER = 'traceparent'
+_MAX_STATEMENT_LENGTH = 512
+
+
+class SpanContext(NamedTuple):
+    '''Identity of a span that can cross process boundaries.'''
+
+    trace_id: str
+    span_id: str
+    sampled: bool
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-{"01" if self.sampled else "00"}'
+
+
+@dataclass
+class Span:
+    name: str
+    context: SpanContext
+    parent_id: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    start: float = field(default_factory=time.time)
+    duration: Optional[float] = None
+    status: str = 'ok'
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'status': self.status,
+            'attributes': self.attributes,
+            'pid': os.getpid(),
+        }
+
+
+class JsonLinesExporter:
+    '''Appends finished spans to a local file, one JSON document per line.'''
+
+    def __init__(self, path: str | None = None):
+        self.path = path or settings.TRACING_FILE
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            # A single O_APPEND write per span keeps lines intact across prefork workers sharing the file
+            with open(self.path, 'a', encoding='utf-8') as fh:
+                fh.write(line)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+@lru_cache(maxsize=1)
+def get_exporter():
+    return import_string(settings.TRACING_EXPORTER)()
+
+
+@receiver(setting_changed)
+def _reset_exporter(setting, **kwargs):
+    if setting in {'TRACING_EXPORTER', 'TRACING_FILE'}:
+        get_exporter.cache_clear()
+
+
+def parse_traceparent(value: str | None) -> Optional[SpanContext]:
+    '''Decode a ``traceparent`` header, ignoring anything malformed.'''
+    if not value:
+        return None
+    parts = value.strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return SpanContext(trace_id=parts[1], span_id=parts[2], sampled=bool(flags & 0x01))
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any):
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+@contextmanager
+def start_span(name: str, parent: SpanContext | None = None, **attributes) -> Iterator[Span]:
+    '''
+    Open a span as a child of ``parent`` (or of the current span).
+    The sampling decision is taken once for a new root and inherited by every descendant.
+    '''
+    if parent is None:
+        current = _current_span.get()
+        parent = current.context if current is not None else None
+
+    if parent is None:
+        sampled = random.random() < settings.TRACING_SAMPLE_RATE
+        context = SpanContext(trace_id=secrets.token_hex(16), span_id=secrets.token_hex(8), sampled=sampled)
+        parent_id = None
+    else:
+        context = SpanContext(trace_id=parent.trace_id, span_id=secrets.token_hex(8), sampled=parent.sampled)
+        parent_id = parent.span_id
+
+    span = Span(name=name, context=context, parent_id=parent_id, attributes=attributes)
+    token = _current_span.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as exc:
+        span.status = 'error'
+        span.set_attribute('error', repr(exc))
+        raise
+    finally:
+        span.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        if context.sampled:
+            try:
+                get_exporter().export(span)
+            except Exception:
+                logger.exception('Failed to export span %s', span.name)
+
+
+def _trace_query(execute, sql, params, many, context):
+    with start_span(
+        'db.query',
+        db_alias=context['connection'].alias,
+        db_statement=sql[:_MAX_STATEMENT_LENGTH],
+        db_many=many
+    ):
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def trace_queries() -> Iterator[None]:
+    '''Wrap every query on this thread's connections in a ``db.query`` span while a sampled span is active.'''
+    span = _current_span.get()
+    if span is None or not span.context.sampled:
+        yield
+        return
+    with ExitStack() as stack:
+        for conn in connections.all():
+            stack.enter_context(conn.execute_wrapper(_trace_query))
+        yield
+
+
+class TracingMiddleware:
+    '''Starts (or continues, if the caller sent ``traceparent``) a trace for every HTTP request.'''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        parent = parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+        with start_span('http.request', parent=parent, http_method=request.method, http_path=request.path) as span:
+            with trace_queries():
+                response = self.get_response(request)
+            span.set_attribute('http_status', response.status_code)
+            if response.status_code >= 500:
+                span.status = 'error'
+        response[TRACEPARENT_HEADER] = span.context.traceparent
+        return response
+
+
+# Open task scopes keyed by task id: task_prerun enters them and task_postrun closes them
+_task_scopes: Dict[str, ExitStack] = {}
+
+
+def _inject_headers(headers=None, **kwargs):
+    span = _current_span.get()
+    if span is not None and headers is not None:
+        headers.setdefault(TRACEPARENT_HEADER, span.context.traceparent)
+
+
+def _start_task_span(task_id=None, task=None, **kwargs):
+    # Messages carry the context in headers; eager calls simply inherit the caller's current span
+    parent = parse_traceparent(task.request.get(TRACEPARENT_HEADER))
+    stack = ExitStack()
+    stack.enter_context(start_span(f'celery.task {task.name}', parent=parent, task_id=task_id))
+    stack.enter_context(trace_queries())
+    _task_scopes[task_id] = stack
+
+
+def _finish_task_span(task_id=None, state=None, **kwargs):
+    stack = _task_scopes.pop(task_id, None)
+    if stack is None:
+        return
+    span = _current_span.get()
+    if span is not None and state not in (None, 'SUCCESS'):
+        span.status = 'error'
+        span.set_attribute('task_state', state)
+    stack.close()
+
+
+def connect_celery_signals():
+    from celery.signals import (before_task_publish, task_postrun,
+                                task_prerun)
+
+    before_task_publish.connect(_inject_headers, weak=False)
+    task_prerun.connect(_start_task_span, weak=False)
+    task_postrun.connect(_finish_task_span, weak=False)
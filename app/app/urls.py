@@ -2,8 +2,9 @@ from django.conf import settings
 from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import include, path
-from drf_spectacular.views import (SpectacularAPIView, SpectacularRedocView,
-                                   SpectacularSwaggerView)
+from drf_spectacular.views import SpectacularRedocView, SpectacularSwaggerView
+
+from app.schema import PrecomputedSchemaView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -13,7 +14,7 @@ urlpatterns += staticfiles_urlpatterns()
 
 if settings.DEBUG:
     urlpatterns += [
-        path('schema/', SpectacularAPIView.as_view(), name='schema'),
+        path('schema/', PrecomputedSchemaView.as_view(), name='schema'),
         path(
             'schema/swagger/',
             SpectacularSwaggerView.as_view(url_name='schema'),
@@ -0,0 +1,2 @@
+# URL conf of the 'worker' role (APP_ROLE): it serves no HTTP, but Celery's startup checks still load a URL conf
+urlpatterns = []
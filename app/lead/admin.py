@@ -1,6 +1,9 @@
 from django.contrib import admin
-from lead.models import (Lead, LeadEvent, LeadFollowup, LeadFollowupRule,
-                         TaskExecutionLock)
+from lead import collector_report, transitions, wakeup
+from lead.models import (CollectorQueryPlan, FollowupCollectorWatermark, Lead,
+                         LeadEvent, LeadEventOutbox, LeadFollowup,
+                         LeadFollowupRule, LeadStatus, TaskExecutionLock)
+from lead.pagination import EstimatedCountPaginator
 
 
 class ReadOnlyModelAdmin(admin.ModelAdmin):
@@ -14,35 +17,100 @@ class ReadOnlyModelAdmin(admin.ModelAdmin):
         return False
 
 
+class LargeTableAdminMixin:
+    '''
+    Changelist of a table with millions of rows: estimated counts, no per-choice filter counts, and the search box
+    matches a phone number prefix (``phone_field``) with the ``..._like`` (varchar_pattern_ops) index PostgreSQL gets
+    from Django for the unique phone column.
+    '''
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # Would count the whole table next to every filtered result
+    show_facets = admin.ShowFacets.NEVER
+    phone_field = 'phone'
+    search_help_text = 'Phone number prefix, e.g. +7900'
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(**{f'{self.phone_field}__startswith': search_term}), False
+
+
+def _status_action(status: LeadStatus):
+    @admin.action(description=f'Move selected leads to "{status.label}"', permissions=['change'])
+    def action(modeladmin, request, queryset):
+        changed = transitions.bulk_change_status(queryset.values('pk'), status)
+        modeladmin.message_user(request, f'{changed} leads moved to "{status.label}".')
+
+    action.__name__ = f'move_to_{status.value}'
+    return action
+
+
 @admin.register(Lead)
-class LeadAdmin(admin.ModelAdmin):
+class LeadAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('phone', 'status', 'updated_at')
     list_filter = ('status',)
     search_fields = ('phone',)
     ordering = ('-updated_at',)
+    actions = [_status_action(status) for status in LeadStatus]
 
 
 @admin.register(LeadEvent)
-class LeadEventAdmin(admin.ModelAdmin):
+class LeadEventAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('lead', 'status', 'created_at')
+    list_select_related = ('lead',)
     list_filter = ('status',)
     search_fields = ('lead__phone',)
+    phone_field = 'lead__phone'
     ordering = ('-created_at',)
+    raw_id_fields = ('lead',)  # A select box would list every lead
 
 
 @admin.register(LeadFollowupRule)
 class LeadFollowupRuleAdmin(admin.ModelAdmin):
-    list_display = ('status', 'delay', 'is_enabled', 'text')
-    list_filter = ('status', 'is_enabled')
+    list_display = ('status', 'delay', 'priority', 'is_enabled', 'text')
+    list_filter = ('status', 'priority', 'is_enabled')
     search_fields = ('text',)
     ordering = ('status', 'delay')
+    actions = ['dry_run_collector']
+
+    @admin.action(description='Dry-run the collector for selected rules', permissions=['view'])
+    def dry_run_collector(self, request, queryset):
+        report = collector_report.dry_run(queryset.values_list('pk', flat=True))
+        timings = {query.rule_id: query.duration_ms for query in report.queries}
+        for rule in report.rules:
+            self.message_user(
+                request,
+                f'{rule.status} after {rule.delay} min{"" if rule.is_enabled else " (disabled)"}: '
+                f'{rule.candidates} overdue leads, {rule.suppressed} held back by the repeat threshold, '
+                f'{rule.pairs} to send; stalled leads query {timings[rule.rule_id]:.1f} ms'
+            )
+        self.message_user(
+            request,
+            f'Eligible rules query {timings[None]:.1f} ms. {report.saved_plans} slow query plans saved.'
+        )
+
+    # Admin saves run in a transaction, so the wake-up listener rereads the rules only after commit
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        wakeup.notify_rules_changed()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        wakeup.notify_rules_changed()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        wakeup.notify_rules_changed()
 
 
 @admin.register(LeadFollowup)
-class LeadFollowupAdmin(ReadOnlyModelAdmin):
+class LeadFollowupAdmin(LargeTableAdminMixin, ReadOnlyModelAdmin):
     list_display = ('lead', 'rule', 'created_at')
+    list_select_related = ('lead', 'rule')
     list_filter = ('rule__status',)
     search_fields = ('lead__phone',)
+    phone_field = 'lead__phone'
     ordering = ('-created_at',)
     readonly_fields = ('lead', 'rule', 'created_at')
 
@@ -53,3 +121,28 @@ class TaskExecutionLockAdmin(ReadOnlyModelAdmin):
     search_fields = ('name',)
     ordering = ('name',)
     readonly_fields = ('name', 'locked_at')
+
+
+@admin.register(FollowupCollectorWatermark)
+class FollowupCollectorWatermarkAdmin(ReadOnlyModelAdmin):
+    list_display = ('rule', 'shard_index', 'shard_count', 'last_updated_at', 'last_lead_id')
+    list_select_related = ('rule',)
+    ordering = ('rule', 'shard_count', 'shard_index')
+    readonly_fields = ('rule', 'shard_index', 'shard_count', 'last_updated_at', 'last_lead_id')
+
+
+@admin.register(LeadEventOutbox)
+class LeadEventOutboxAdmin(ReadOnlyModelAdmin):
+    list_display = ('event', 'lead', 'created_at')
+    list_select_related = ('event', 'lead')
+    ordering = ('id',)
+    readonly_fields = ('event', 'lead', 'payload', 'created_at')
+
+
+@admin.register(CollectorQueryPlan)
+class CollectorQueryPlanAdmin(ReadOnlyModelAdmin):
+    list_display = ('created_at', 'query', 'rule', 'duration_ms')
+    list_select_related = ('rule',)
+    list_filter = ('query',)
+    ordering = ('-created_at',)
+    readonly_fields = ('query', 'rule', 'duration_ms', 'sql', 'plan', 'created_at')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class LeadConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'lead'
+
+    def ready(self):
+        from lead import conditional  # noqa: F401  Connects the list version signals
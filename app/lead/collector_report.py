@@ -0,0 +1,115 @@
+'''
+Dry run of the simple collector: what a tick would send, and what its queries cost.
+
+dry_run() builds the same queries as _collect_simple_followups: the eligible rules, then the stalled leads of every
+rule capped at FOLLOWUP_MAX_ENQUEUE_PER_TICK. On PostgreSQL each one is run under ``EXPLAIN (ANALYZE, BUFFERS)``,
+and its time is the planning plus execution time the plan reports. Elsewhere the query is run and timed, with the
+plain EXPLAIN output. Every rule also gets the number of leads overdue for it and how many of them the repeat
+threshold holds back.
+
+Everything is read in one read-only transaction that is rolled back, and nothing is enqueued. The only write comes
+after it: plans slower than FOLLOWUP_SLOW_QUERY_MS are saved as CollectorQueryPlan rows, so a plan that changes
+after an index or data change can be compared with earlier ones.
+'''
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from lead import tasks
+from lead.models import CollectorQueryPlan, LeadFollowupRule
+
+ELIGIBLE_RULES = 'eligible_rules'
+STALLED_LEADS = 'stalled_leads'
+
+_PLAN_TIME = re.compile(r'^\s*(?:Planning|Execution) Time: ([\d.]+) ms', re.MULTILINE)
+
+
+@dataclass
+class QueryReport:
+    query: str
+    rule_id: int | None
+    duration_ms: float
+    sql: str
+    plan: str
+
+
+@dataclass
+class RuleReport:
+    rule_id: int
+    status: str
+    delay: int
+    is_enabled: bool
+    candidates: int  # Leads in the status for at least the delay
+    suppressed: int  # Candidates that got the followup within FOLLOWUP_REPEAT_THRESHOLD
+
+    @property
+    def pairs(self) -> int:
+        return self.candidates - self.suppressed
+
+
+@dataclass
+class DryRunReport:
+    generated_at: datetime
+    rules: List[RuleReport] = field(default_factory=list)
+    queries: List[QueryReport] = field(default_factory=list)
+    saved_plans: int = 0
+
+
+def _profile(query: str, queryset, rule_id: int | None = None) -> QueryReport:
+    if connection.vendor == 'postgresql':
+        plan = queryset.explain(analyze=True, buffers=True)
+        duration_ms = sum(float(value) for value in _PLAN_TIME.findall(plan))
+    else:
+        started = time.perf_counter()
+        list(queryset)
+        duration_ms = (time.perf_counter() - started) * 1000
+        plan = queryset.explain()
+    return QueryReport(query, rule_id, duration_ms, str(queryset.query), plan)
+
+
+def dry_run(rule_ids: Iterable[int] | None = None, save: bool = True) -> DryRunReport:
+    '''
+    Report on the enabled rules, or on ``rule_ids`` whether enabled or not, so a rule can be tried before it is
+    switched on. Only enabled rules take part in the eligible-rules query, as in the collector.
+    '''
+    now = timezone.now()
+    repeat_cutoff = now - tasks.FOLLOWUP_REPEAT_THRESHOLD
+    report = DryRunReport(generated_at=now)
+    rules = LeadFollowupRule.objects.order_by('status', 'delay')
+    rules = rules.filter(is_enabled=True) if rule_ids is None else rules.filter(pk__in=list(rule_ids))
+
+    outermost = not connection.in_atomic_block  # Inside a caller's transaction, the savepoint rollback still undoes everything
+    with transaction.atomic():
+        if outermost and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION READ ONLY')  # EXPLAIN ANALYZE runs the statement: make sure it can't write
+        report.queries.append(_profile(ELIGIBLE_RULES, tasks._eligible_rules(repeat_cutoff)))
+        for rule in rules:
+            delay_span = timedelta(minutes=rule.delay)
+            counts = tasks._overdue_leads(rule.status, delay_span).aggregate(
+                candidates=Count('id'),
+                suppressed=Count('id', filter=Q(tasks._recently_followed_up(rule.pk, repeat_cutoff)))
+            )
+            report.rules.append(
+                RuleReport(rule.pk, rule.status, rule.delay, rule.is_enabled, counts['candidates'], counts['suppressed'])
+            )
+            stalled_leads = tasks._stalled_leads(rule.pk, rule.status, delay_span, repeat_cutoff)
+            report.queries.append(
+                _profile(STALLED_LEADS, stalled_leads[:settings.FOLLOWUP_MAX_ENQUEUE_PER_TICK], rule.pk)
+            )
+        transaction.set_rollback(True)
+
+    if save:
+        slow = [
+            CollectorQueryPlan(query=query.query, rule_id=query.rule_id, duration_ms=query.duration_ms, sql=query.sql, plan=query.plan)
+            for query in report.queries
+            if query.duration_ms >= settings.FOLLOWUP_SLOW_QUERY_MS
+        ]
+        report.saved_plans = len(CollectorQueryPlan.objects.bulk_create(slow))
+    return report
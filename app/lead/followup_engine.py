@@ -0,0 +1,262 @@
+'''
+Vectorized in-memory follow-up evaluation, used when FOLLOWUP_COLLECTOR = 'vectorized'.
+
+Leads live in a compact columnar snapshot (id, status code, updated_at in epoch microseconds) that is
+refreshed incrementally from rows changed since the previous tick. Every enabled rule is evaluated in one
+pass: the snapshot is sorted by (status, updated_at), so the overdue leads of a rule are a contiguous slice
+found with a single searchsorted. Recent follow-ups are kept as a sorted set of (rule, lead) keys for the
+FOLLOWUP_REPEAT_THRESHOLD suppression. The result matches _collect_simple_followups pair for pair.
+'''
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+from lead.models import Lead, LeadFollowup, LeadFollowupRule, LeadStatus
+
+logger = logging.getLogger('app')
+
+STATUS_CODES = {status: code for code, status in enumerate(LeadStatus.values)}
+# Composite sort keys: status code in the high bits, epoch microseconds (good until year ~2255) below
+_STATUS_SHIFT = 1 << 53
+_RULE_SHIFT = 1 << 40  # (rule, lead) keys assume lead ids below 2**40
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_LOAD_CHUNK_SIZE = 100_000
+
+
+def to_us(value: datetime) -> int:
+    '''Exact epoch microseconds, so comparisons agree with the database to the microsecond.'''
+    return (value - _EPOCH) // _MICROSECOND
+
+
+class LeadSnapshot:
+    '''Columnar copy of (id, status, updated_at) for every lead.'''
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.status_codes = np.empty(0, dtype=np.int8)
+        self.updated_us = np.empty(0, dtype=np.int64)
+        self.watermark: datetime | None = None  # Highest updated_at seen so far
+        self._dirty = True
+        # Derived view sorted by (status, updated_at)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.sorted_ids = self.ids
+        self.sorted_updated_us = self.updated_us
+        self.status_start = np.zeros(len(STATUS_CODES) + 1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rebuild(self):
+        ids, codes, updated = [], [], []
+        last_id = 0
+        watermark = None
+        while True:
+            # Keyset pages over the primary key keep each round trip bounded
+            rows = list(
+                Lead.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'status', 'updated_at')[:_LOAD_CHUNK_SIZE]
+            )
+            if not rows:
+                break
+            for lead_id, status, updated_at in rows:
+                ids.append(lead_id)
+                codes.append(STATUS_CODES[status])
+                updated.append(to_us(updated_at))
+                if watermark is None or updated_at > watermark:
+                    watermark = updated_at
+            last_id = rows[-1][0]
+
+        self.ids = np.array(ids, dtype=np.int64)
+        self.status_codes = np.array(codes, dtype=np.int8)
+        self.updated_us = np.array(updated, dtype=np.int64)
+        self.watermark = watermark
+        self._dirty = True
+
+    def apply_changes(self):
+        '''Fold in leads created or updated since the watermark.'''
+        if self.watermark is None:
+            self.rebuild()
+            return
+        # Re-read a short overlap: updated_at is assigned before commit, so a slow transaction can land behind the watermark
+        since = self.watermark - timedelta(seconds=settings.FOLLOWUP_SNAPSHOT_OVERLAP)
+        rows = list(Lead.objects.filter(updated_at__gte=since).values_list('id', 'status', 'updated_at'))
+        if not rows:
+            return
+
+        changed_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        changed_codes = np.fromiter((STATUS_CODES[row[1]] for row in rows), dtype=np.int8, count=len(rows))
+        changed_updated = np.fromiter((to_us(row[2]) for row in rows), dtype=np.int64, count=len(rows))
+        self.watermark = max(self.watermark, max(row[2] for row in rows))
+
+        positions = np.searchsorted(self.ids, changed_ids)
+        in_bounds = positions < len(self.ids)
+        known = np.zeros(len(rows), dtype=bool)
+        known[in_bounds] = self.ids[positions[in_bounds]] == changed_ids[in_bounds]
+        self.status_codes[positions[known]] = changed_codes[known]
+        self.updated_us[positions[known]] = changed_updated[known]
+
+        if not known.all():
+            ids = np.concatenate((self.ids, changed_ids[~known]))
+            order = np.argsort(ids, kind='stable')
+            self.ids = ids[order]
+            self.status_codes = np.concatenate((self.status_codes, changed_codes[~known]))[order]
+            self.updated_us = np.concatenate((self.updated_us, changed_updated[~known]))[order]
+        self._dirty = True
+
+    def reindex(self):
+        if not self._dirty:
+            return
+        keys = self.status_codes.astype(np.int64) * _STATUS_SHIFT + self.updated_us
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.sorted_ids = self.ids[order]
+        self.sorted_updated_us = self.updated_us[order]
+        code_bounds = np.arange(len(STATUS_CODES) + 1, dtype=np.int64) * _STATUS_SHIFT
+        self.status_start = np.searchsorted(self.keys, code_bounds, side='left')
+        self._dirty = False
+
+
+class RecentFollowups:
+    '''Latest follow-up per (rule, lead) inside the repeat window, as a sorted key set.'''
+
+    def __init__(self):
+        self.last_id = 0
+        self.pair_keys = np.empty(0, dtype=np.int64)
+        self.created_us = np.empty(0, dtype=np.int64)
+
+    def _merge(self, pair_keys: np.ndarray, created_us: np.ndarray):
+        keys = np.concatenate((self.pair_keys, pair_keys))
+        created = np.concatenate((self.created_us, created_us))
+        if not len(keys):
+            return
+        order = np.lexsort((created, keys))
+        keys, created = keys[order], created[order]
+        # Sorted by key then time: the last row of every key group holds its latest follow-up
+        last_of_group = np.append(keys[1:] != keys[:-1], True)
+        self.pair_keys = keys[last_of_group]
+        self.created_us = created[last_of_group]
+
+    def rebuild(self, repeat_cutoff: datetime):
+        self.pair_keys = np.empty(0, dtype=np.int64)
+        self.created_us = np.empty(0, dtype=np.int64)
+        rows = list(
+            LeadFollowup.objects.filter(
+                created_at__gte=repeat_cutoff
+            ).values('lead_id', 'rule_id').annotate(last=Max('created_at')).values_list('lead_id', 'rule_id', 'last')
+        )
+        self.last_id = LeadFollowup.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        self._merge_rows(rows)
+
+    def apply_changes(self, repeat_cutoff: datetime):
+        # Follow-ups are insert-only, so anything new has a higher primary key
+        rows = list(
+            LeadFollowup.objects.filter(id__gt=self.last_id).order_by('id').values_list('id', 'lead_id', 'rule_id', 'created_at')
+        )
+        if rows:
+            self.last_id = rows[-1][0]
+            self._merge_rows([row[1:] for row in rows])
+        keep = self.created_us >= to_us(repeat_cutoff)
+        self.pair_keys, self.created_us = self.pair_keys[keep], self.created_us[keep]
+
+    def _merge_rows(self, rows):
+        if not rows:
+            return
+        pair_keys = np.fromiter((rule_id * _RULE_SHIFT + lead_id for lead_id, rule_id, _ in rows), dtype=np.int64, count=len(rows))
+        created = np.fromiter((to_us(created_at) for _, _, created_at in rows), dtype=np.int64, count=len(rows))
+        self._merge(pair_keys, created)
+
+    def suppressed(self, lead_ids: np.ndarray, rule_ids: np.ndarray, updated_us: np.ndarray, cutoff_us: int) -> np.ndarray:
+        '''Mask of candidates that already got this rule's follow-up since their last status change.'''
+        if not len(self.pair_keys) or not len(lead_ids):
+            return np.zeros(len(lead_ids), dtype=bool)
+        keys = rule_ids * _RULE_SHIFT + lead_ids
+        positions = np.searchsorted(self.pair_keys, keys)
+        positions[positions == len(self.pair_keys)] = 0
+        found = self.pair_keys[positions] == keys
+        created = self.created_us[positions]
+        return found & (created >= updated_us) & (created >= cutoff_us)
+
+
+class FollowupEngine:
+
+    def __init__(self):
+        self.leads = LeadSnapshot()
+        self.followups = RecentFollowups()
+        self._built_at: float | None = None
+
+    def refresh(self, repeat_cutoff: datetime):
+        if self._built_at is None or time.monotonic() - self._built_at >= settings.FOLLOWUP_SNAPSHOT_REBUILD_INTERVAL:
+            # Periodic full reloads drop deleted leads and anything changed behind the incremental watermarks
+            self.leads.rebuild()
+            self.followups.rebuild(repeat_cutoff)
+            self._built_at = time.monotonic()
+        else:
+            self.leads.apply_changes()
+            self.followups.apply_changes(repeat_cutoff)
+        self.leads.reindex()
+
+    def collect(
+        self,
+        now: datetime,
+        repeat_cutoff: datetime,
+        limit: int | None = None,
+        id_range: Tuple[int | None, int | None] = (None, None)
+    ) -> List[Tuple[int, int]]:
+        '''Same contract as _collect_simple_followups: (lead_id, rule_id) pairs, most overdue first.'''
+        self.refresh(repeat_cutoff)
+        rules = list(LeadFollowupRule.objects.filter(is_enabled=True).values_list('id', 'status', 'delay'))
+        if not rules or not len(self.leads):
+            return []
+
+        rule_ids = np.array([rule[0] for rule in rules], dtype=np.int64)
+        rule_codes = np.array([STATUS_CODES[rule[1]] for rule in rules], dtype=np.int64)
+        delay_us = np.array([rule[2] for rule in rules], dtype=np.int64) * 60_000_000
+
+        # A rule's overdue leads are the front of its status block: updated_at <= now - delay
+        snapshot = self.leads
+        low = snapshot.status_start[rule_codes]
+        high = np.searchsorted(snapshot.keys, rule_codes * _STATUS_SHIFT + (to_us(now) - delay_us), side='right')
+        counts = np.maximum(high - low, 0)
+        if not counts.sum():
+            return []
+
+        rule_index = np.repeat(np.arange(len(rules)), counts)
+        block_offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(low, counts) + block_offsets
+        lead_ids = snapshot.sorted_ids[positions]
+        updated_us = snapshot.sorted_updated_us[positions]
+        candidate_rules = rule_ids[rule_index]
+        due_us = updated_us + delay_us[rule_index]
+
+        keep = ~self.followups.suppressed(lead_ids, candidate_rules, updated_us, to_us(repeat_cutoff))
+        low, high = id_range
+        if low is not None:
+            keep &= lead_ids >= low
+        if high is not None:
+            keep &= lead_ids < high
+        lead_ids, candidate_rules, due_us = lead_ids[keep], candidate_rules[keep], due_us[keep]
+
+        order = np.lexsort((candidate_rules, lead_ids, due_us))
+        if limit is not None:
+            order = order[:limit]
+        return list(zip(lead_ids[order].tolist(), candidate_rules[order].tolist()))
+
+
+_engine: FollowupEngine | None = None
+
+
+def get_engine() -> FollowupEngine:
+    '''The per-process engine; its snapshot survives between collector ticks.'''
+    global _engine
+    if _engine is None:
+        _engine = FollowupEngine()
+    return _engine
+
+
+def reset_engine():
+    global _engine
+    _engine = None
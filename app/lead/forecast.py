@@ -0,0 +1,150 @@
+'''
+Forecast of the follow-up SMS volume of the next hours, for capacity planning.
+
+The forecast assumes no lead changes status during the horizon. A lead in a rule's status then gets that rule's
+follow-up once it falls due (right away when it is overdue already) and again every FOLLOWUP_REPEAT_THRESHOLD
+after that. Pairs that were sent within the threshold are suppressed until it runs out, as in the collector.
+
+The database is read once: a UNION ALL of two per-minute histograms. The first counts leads per
+(status, updated_at minute), clipped at the longest rule delay. The second counts the latest follow-up of each
+suppressed (lead, rule) pair per (rule, created_at minute). Every histogram row is then expanded into its sends
+and binned with NumPy. The cost depends on the number of minutes covered, not on the number of leads.
+'''
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import (CharField, Count, DateTimeField, Exists, F,
+                              IntegerField, OuterRef, Value)
+from django.db.models.functions import Cast, Greatest, TruncMinute
+from django.utils import timezone
+from lead import sms
+from lead.models import Lead, LeadFollowup, LeadFollowupRule
+
+from app.replicas import replica_reads
+
+PROPOSED = 'proposed'  # Key of the unsaved rule in the per-rule totals
+_LEADS = 0
+_FOLLOWUPS = 1
+
+
+class ForecastRule(NamedTuple):
+    key: int | str  # Rule id, or PROPOSED
+    status: str
+    delay: int  # Minutes
+
+
+def _histogram(rules: List[ForecastRule], now: datetime, repeat: int):
+    '''Rows of (kind, key, minute, count): leads per status and suppressed pairs per rule.'''
+    # Anything older than the longest delay is overdue for every rule, so it shares one row per status
+    oldest = now - timedelta(minutes=max(rule.delay for rule in rules) + 1)
+    leads = Lead.objects.filter(
+        status__in={rule.status for rule in rules}
+    ).annotate(
+        kind=Value(_LEADS, output_field=IntegerField()),
+        key=F('status'),
+        minute=TruncMinute(Greatest('updated_at', Value(oldest, output_field=DateTimeField())))
+    ).values('kind', 'key', 'minute').annotate(count=Count('id')).values_list('kind', 'key', 'minute', 'count')
+
+    saved = [rule.key for rule in rules if rule.key != PROPOSED]
+    # Only the latest follow-up of a pair decides when it may be sent again
+    newer = LeadFollowup.objects.filter(
+        lead_id=OuterRef('lead_id'),
+        rule_id=OuterRef('rule_id'),
+        created_at__gt=OuterRef('created_at')
+    )
+    followups = LeadFollowup.objects.filter(
+        rule_id__in=saved,
+        created_at__gte=now - timedelta(minutes=repeat),
+        lead__status=F('rule__status')
+    ).filter(
+        created_at__gte=F('lead__updated_at')  # Same guard as the collector: sent since the last status change
+    ).exclude(
+        Exists(newer)
+    ).annotate(
+        kind=Value(_FOLLOWUPS, output_field=IntegerField()),
+        key=Cast('rule_id', CharField()),
+        minute=TruncMinute('created_at')
+    ).values('kind', 'key', 'minute').annotate(count=Count('id')).values_list('kind', 'key', 'minute', 'count')
+
+    return leads.union(followups, all=True) if saved else leads
+
+
+def _bin(starts: np.ndarray, weights: np.ndarray, repeat: int, horizon: int, bucket: int) -> np.ndarray:
+    '''
+    Sends per bucket of a series of pairs: ``weights[i]`` pairs first sent ``starts[i]`` minutes from now
+    (clipped to now), then again every ``repeat`` minutes.
+    '''
+    starts = np.maximum(starts, 0)
+    in_horizon = starts < horizon
+    starts, weights = starts[in_horizon], weights[in_horizon]
+    # Each series repeats while it stays inside the horizon
+    repeats = (horizon - 1 - starts) // repeat + 1 if repeat > 0 else np.ones(len(starts), dtype=np.int64)
+    offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    minutes = np.repeat(starts, repeats) + offsets * repeat
+    return np.bincount(minutes // bucket, weights=np.repeat(weights, repeats), minlength=-(-horizon // bucket))
+
+
+def forecast(
+    hours: int,
+    bucket_minutes: int,
+    proposed: ForecastRule | None = None,
+    now: datetime | None = None
+) -> Dict[str, Any]:
+    now = now or timezone.now()
+    repeat = settings.FOLLOWUP_REPEAT_THRESHOLD
+    horizon = hours * 60
+    with replica_reads():
+        rules = [
+            ForecastRule(*rule)
+            for rule in LeadFollowupRule.objects.filter(is_enabled=True).values_list('id', 'status', 'delay')
+        ]
+        if proposed is not None:
+            rules.append(proposed)
+        rows = list(_histogram(rules, now, repeat)) if rules else []
+
+    by_rule: Dict[int | str, np.ndarray] = {}
+    if rules:
+        current = timezone.localtime(now).replace(second=0, microsecond=0)  # TruncMinute works in local time
+        kinds = np.array([row[0] for row in rows], dtype=np.int8)
+        keys = np.array([row[1] for row in rows], dtype=object)
+        # Histogram minutes relative to now, <= 0
+        minutes = np.array([(row[2] - current) // timedelta(minutes=1) for row in rows], dtype=np.int64)
+        counts = np.array([row[3] for row in rows], dtype=np.float64)
+
+        for rule in rules:
+            leads = (kinds == _LEADS) & (keys == rule.status)
+            sends = _bin(minutes[leads] + rule.delay, counts[leads], repeat, horizon, bucket_minutes)
+            suppressed = (kinds == _FOLLOWUPS) & (keys == str(rule.key))
+            if suppressed.any():
+                # Counted above as overdue right now, they are actually sent once the threshold runs out
+                sends -= _bin(np.zeros(suppressed.sum(), dtype=np.int64), counts[suppressed], repeat, horizon, bucket_minutes)
+                sends += _bin(minutes[suppressed] + repeat, counts[suppressed], repeat, horizon, bucket_minutes)
+            by_rule[rule.key] = np.maximum(sends, 0)
+
+    totals = sum(by_rule.values(), np.zeros(-(-horizon // bucket_minutes)))
+    # Every sender thread is busy for SMS_SEND_DELAY seconds per SMS; the gateway may cap the rate further
+    capacity = settings.FOLLOWUP_SEND_CONCURRENCY * bucket_minutes * 60 / max(settings.SMS_SEND_DELAY, 0.001)
+    if settings.SMS_GATEWAY_HOURLY_QUOTA:
+        capacity = min(capacity, settings.SMS_GATEWAY_HOURLY_QUOTA * bucket_minutes / 60)
+    gateway_rate = sms.total_rate()
+    if gateway_rate is not None:
+        capacity = min(capacity, gateway_rate * bucket_minutes * 60)
+    capacity = int(capacity)
+
+    return {
+        'generated_at': now,
+        'bucket_minutes': bucket_minutes,
+        'capacity_per_bucket': capacity,
+        'total': int(totals.sum()),
+        'rules': {str(key): int(sends.sum()) for key, sends in by_rule.items()},
+        'buckets': [
+            {
+                'start': now + timedelta(minutes=index * bucket_minutes),
+                'sends': int(sends),
+                'over_capacity': bool(sends > capacity),
+            }
+            for index, sends in enumerate(totals)
+        ],
+    }
@@ -0,0 +1,148 @@
+'''
+Priority lanes for follow-up delivery.
+
+Every LeadFollowupRule has a priority, and the followups of each priority travel on their own send queue
+(FOLLOWUP_SEND_LANES), so a burst of low-value reminders no longer sits in front of the time-critical ones.
+
+The sender consumes all the lanes. With the Redis transport WeightedLaneCycle is its queue order strategy: before
+every BRPOP the lane queues are ordered by weighted sampling (FOLLOWUP_LANE_WEIGHTS), and Redis pops from the first
+non-empty one. While every lane has a backlog each gets a share of the messages in proportion to its weight, so the
+low lane slows down but is never starved, and an idle lane leaves its share to the others.
+
+Queue latency is measured per lane: the publisher stamps the lane and the time the message becomes due (its ETA,
+if any) into the message headers, and the worker counts how long it waited into histogram buckets in the cache.
+``manage.py lane_stats`` prints them with the depth of every lane.
+'''
+import logging
+import random
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from celery import current_app
+from django.conf import settings
+from django.core.cache import cache
+from kombu.exceptions import ChannelError
+from kombu.utils.scheduling import round_robin_cycle
+
+logger = logging.getLogger('app')
+
+LANE_HEADER = 'followup_lane'
+DUE_AT_HEADER = 'followup_due_at'
+STATS_CACHE_KEY = 'lane:stats:{}:{}'
+# Upper bounds (seconds) of the queue latency buckets, the last bucket takes everything slower
+WAIT_BUCKETS = (1, 5, 15, 60, 300, 900, 3600)
+# Seconds a depth probe may spend connecting: the collector reads the depth under its lock, so a broker that is
+# down costs one short attempt instead of the retries and the full connection timeout of a publisher
+DEPTH_PROBE_TIMEOUT = 1
+
+
+def queue_for(priority: str) -> str:
+    return settings.FOLLOWUP_SEND_LANES[priority]
+
+
+def lane_of(queue: str) -> str | None:
+    return next((lane for lane, lane_queue in settings.FOLLOWUP_SEND_LANES.items() if lane_queue == queue), None)
+
+
+class WeightedLaneCycle(round_robin_cycle):
+    '''
+    kombu queue order strategy (``queue_order_strategy`` transport option) ordering the lane queues by weighted sampling.
+    Queues that aren't lanes weigh 1; a consumer without any lane queue keeps kombu's round robin.
+    '''
+
+    def consume(self, n: int) -> List[str]:
+        queues = self.items[:n]
+        if not any(lane_of(queue) for queue in queues):
+            return queues
+        weights = settings.FOLLOWUP_LANE_WEIGHTS
+        # Weighted sampling without replacement (Efraimidis-Spirakis): the first is picked in proportion to its weight
+        return sorted(queues, key=lambda queue: random.random() ** (1 / weights.get(lane_of(queue), 1)), reverse=True)
+
+
+def queue_depths(queues: Iterable[str]) -> Dict[str, int | None]:
+    '''Number of messages waiting on each queue, read over one connection; None when the broker can't be inspected.'''
+    depths = dict.fromkeys(queues)
+    try:
+        with current_app.connection_for_read(connect_timeout=DEPTH_PROBE_TIMEOUT) as conn:
+            conn.ensure_connection(max_retries=0)
+            for queue in depths:
+                try:
+                    _, depths[queue], _ = conn.default_channel.queue_declare(queue=queue, passive=True)
+                except ChannelError:
+                    depths[queue] = 0  # Redis drops empty lists, so a drained queue simply doesn't exist
+    except Exception:
+        logger.warning('Unable to read the depth of %s', ', '.join(depths), exc_info=True)
+    return depths
+
+
+def _bucket(wait: float) -> str:
+    return next((str(bound) for bound in WAIT_BUCKETS if wait <= bound), 'inf')
+
+
+def _incr(lane: str, counter: str, delta: int = 1):
+    key = STATS_CACHE_KEY.format(lane, counter)
+    cache.add(key, 0, timeout=None)
+    cache.incr(key, delta)
+
+
+def record_wait(lane: str, wait: float):
+    _incr(lane, 'messages')
+    _incr(lane, 'wait_ms', round(wait * 1000))
+    _incr(lane, _bucket(wait))
+
+
+def _percentile(buckets: Dict[str, int], messages: int, share: float) -> float | None:
+    '''Upper bound of the bucket holding the ``share`` quantile (inf past the last one).'''
+    seen = 0
+    for bound in [*map(str, WAIT_BUCKETS), 'inf']:
+        seen += buckets[bound]
+        if seen >= messages * share:
+            return float(bound)
+    return None
+
+
+def lane_stats(lanes: Iterable[str] | None = None) -> Dict[str, Dict[str, float | None]]:
+    '''Depth and queue latency of each lane (every lane by default): message count, mean wait and bucketed p50/p95 in seconds.'''
+    lanes = list(settings.FOLLOWUP_SEND_LANES if lanes is None else lanes)
+    counters = ['messages', 'wait_ms', *map(str, WAIT_BUCKETS), 'inf']
+    values = cache.get_many([STATS_CACHE_KEY.format(lane, counter) for lane in lanes for counter in counters])
+    depths = queue_depths(map(queue_for, lanes))
+    stats = {}
+    for lane in lanes:
+        counts = {counter: values.get(STATS_CACHE_KEY.format(lane, counter), 0) for counter in counters}
+        messages = counts['messages']
+        stats[lane] = {
+            'depth': depths[queue_for(lane)],
+            'messages': messages,
+            'mean_wait': counts['wait_ms'] / messages / 1000 if messages else None,
+            'p50_wait': _percentile(counts, messages, 0.5) if messages else None,
+            'p95_wait': _percentile(counts, messages, 0.95) if messages else None,
+        }
+    return stats
+
+
+def _stamp_lane(headers=None, routing_key=None, **kwargs):
+    lane = lane_of(routing_key)
+    if lane is None or headers is None:
+        return
+    eta = headers.get('eta')
+    headers[LANE_HEADER] = lane
+    headers[DUE_AT_HEADER] = datetime.fromisoformat(eta).timestamp() if eta else time.time()
+
+
+def _record_lane_wait(task=None, **kwargs):
+    lane, due_at = task.request.get(LANE_HEADER), task.request.get(DUE_AT_HEADER)
+    if lane is None or due_at is None:
+        return  # Not a lane message, or run eagerly
+    try:
+        record_wait(lane, max(time.time() - due_at, 0))
+    except Exception:
+        logger.warning('Unable to record the queue latency of lane %s', lane, exc_info=True)
+
+
+def connect_celery_signals():
+    from celery.signals import before_task_publish, task_prerun
+
+    before_task_publish.connect(_stamp_lane, weak=False)
+    task_prerun.connect(_record_lane_wait, weak=False)
@@ -0,0 +1,196 @@
+'''
+Live feed of new LeadEvent and LeadFollowup rows, served as Server-Sent Events.
+
+Writers publish every committed row on the Redis pub/sub channel LIVE_FEED_CHANNEL. Each ASGI process holds a
+single subscription (LiveFeedHub) and fans messages out to per-connection queues, so an idle connection costs a
+suspended coroutine and an empty queue. An SSE id is a Cursor: the last LeadEvent and LeadFollowup ids the client
+has seen. A reconnecting client sends it back as Last-Event-ID, and the rows it missed are replayed from the database,
+from a margin below those ids since rows don't commit in id order.
+'''
+import asyncio
+import json
+import logging
+from typing import (Any, Dict, FrozenSet, Iterable, List, NamedTuple, Set,
+                    Tuple)
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django_redis import get_redis_connection
+from lead.models import LeadEvent, LeadFollowup
+from redis import asyncio as aioredis
+
+logger = logging.getLogger('app')
+
+Message = Dict[str, Any]
+EVENT = 'lead_event'
+FOLLOWUP = 'lead_followup'
+
+
+class Cursor(NamedTuple):
+    '''
+    The last LeadEvent and LeadFollowup ids sent. Ids are taken at insert but rows arrive at commit, so a row up to
+    LIVE_FEED_REORDER_MARGIN ids below its mark may still be new: ``recent`` holds the ids sent within that margin.
+    Only the marks go into the SSE id.
+    '''
+    event_id: int
+    followup_id: int
+    recent: FrozenSet[Tuple[str, int]] = frozenset()
+
+    def __str__(self) -> str:
+        return f'{self.event_id}.{self.followup_id}'
+
+    @classmethod
+    def parse(cls, value: str | None) -> 'Cursor | None':
+        event_id, _, followup_id = (value or '').partition('.')
+        if not (event_id.isdigit() and followup_id.isdigit()):
+            return None
+        return cls(int(event_id), int(followup_id))
+
+    def mark(self, kind: str) -> int:
+        return self.event_id if kind == EVENT else self.followup_id
+
+    def seen(self, message: Message) -> bool:
+        return (
+            message['id'] <= self.mark(message['type']) - settings.LIVE_FEED_REORDER_MARGIN
+            or (message['type'], message['id']) in self.recent
+        )
+
+    def advance(self, message: Message) -> 'Cursor':
+        if message['type'] == EVENT:
+            cursor = self._replace(event_id=max(self.event_id, message['id']))
+        else:
+            cursor = self._replace(followup_id=max(self.followup_id, message['id']))
+        recent = self.recent | {(message['type'], message['id'])}
+        return cursor._replace(recent=frozenset(
+            (kind, id_) for kind, id_ in recent if id_ > cursor.mark(kind) - settings.LIVE_FEED_REORDER_MARGIN
+        ))
+
+
+def event_message(event: LeadEvent) -> Message:
+    return {
+        'type': EVENT,
+        'id': event.pk,
+        'lead_id': event.lead_id,
+        'status': event.status,
+        'created_at': event.created_at.isoformat(),
+    }
+
+
+def followup_message(followup: LeadFollowup, status: str) -> Message:
+    '''``status`` is the status of the followup's rule, which the feed filters on.'''
+    return {
+        'type': FOLLOWUP,
+        'id': followup.pk,
+        'lead_id': followup.lead_id,
+        'rule_id': followup.rule_id,
+        'status': status,
+        'created_at': followup.created_at.isoformat(),
+    }
+
+
+def _publish(message: Message):
+    try:
+        get_redis_connection('default').publish(settings.LIVE_FEED_CHANNEL, json.dumps(message))
+    except Exception:
+        # Best effort: a missed message only reaches clients when they reconnect
+        logger.warning('Unable to publish %s %s to the live feed', message['type'], message['id'], exc_info=True)
+
+
+def _publish_all(messages: List[Message]):
+    try:
+        pipeline = get_redis_connection('default').pipeline(transaction=False)
+        for message in messages:
+            pipeline.publish(settings.LIVE_FEED_CHANNEL, json.dumps(message))
+        pipeline.execute()
+    except Exception:
+        logger.warning('Unable to publish %s messages to the live feed', len(messages), exc_info=True)
+
+
+def publish_on_commit(message: Message):
+    transaction.on_commit(lambda: _publish(message))
+
+
+def publish_all_on_commit(messages: List[Message]):
+    '''publish_on_commit() for many messages, sent in one round trip.'''
+    if messages:
+        transaction.on_commit(lambda: _publish_all(messages))
+
+
+def current_cursor() -> Cursor:
+    return Cursor(
+        LeadEvent.objects.aggregate(last=Max('id'))['last'] or 0,
+        LeadFollowup.objects.aggregate(last=Max('id'))['last'] or 0
+    )
+
+
+def backfill(cursor: Cursor, statuses: Iterable[str], limit: int) -> List[Message]:
+    '''
+    Rows ``cursor`` hasn't seen, at most ``limit`` of each kind, oldest first. The replay starts LIVE_FEED_REORDER_MARGIN
+    ids below the marks, so rows that committed after the client got higher ids are replayed too.
+    '''
+    statuses = list(statuses)
+    margin = settings.LIVE_FEED_REORDER_MARGIN
+    events = LeadEvent.objects.filter(id__gt=cursor.event_id - margin).order_by('id')
+    followups = LeadFollowup.objects.filter(id__gt=cursor.followup_id - margin).select_related('rule').order_by('id')
+    if statuses:
+        events = events.filter(status__in=statuses)
+        followups = followups.filter(rule__status__in=statuses)
+    messages = [event_message(event) for event in events[:limit]]
+    messages.extend(followup_message(followup, followup.rule.status) for followup in followups[:limit])
+    return sorted(
+        (message for message in messages if not cursor.seen(message)),
+        key=lambda message: message['created_at']
+    )
+
+
+class LiveFeedHub:
+    '''The process-wide subscription to LIVE_FEED_CHANNEL and the queues of the connections listening to it.'''
+
+    def __init__(self):
+        self._queues: Set[asyncio.Queue] = set()
+        self._listener: asyncio.Task | None = None
+
+    def subscribe(self) -> asyncio.Queue:
+        if self._listener is None or self._listener.done() or self._listener.get_loop() is not asyncio.get_running_loop():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        queue = asyncio.Queue(maxsize=settings.LIVE_FEED_QUEUE_SIZE)
+        self._queues.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._queues.discard(queue)
+
+    def dispatch(self, message: Message):
+        for queue in list(self._queues):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too slow to keep up: drop the connection, the client resumes from its Last-Event-ID
+                self._queues.discard(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def _listen(self):
+        while True:
+            client = aioredis.Redis.from_url(settings.CACHE_URL)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(settings.LIVE_FEED_CHANNEL)
+                    async for item in pubsub.listen():
+                        if item['type'] == 'message':
+                            self.dispatch(json.loads(item['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning('Live feed subscription lost, reconnecting', exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+hub = LiveFeedHub()
+
+
+def format_message(message: Message, cursor: Cursor) -> str:
+    return f'id: {cursor}\nevent: {message["type"]}\ndata: {json.dumps(message)}\n\n'
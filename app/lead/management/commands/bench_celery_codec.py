@@ -0,0 +1,74 @@
+import random
+import time
+from typing import Any, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from kombu.serialization import dumps, loads
+from lead.tasks import task_send_followup
+
+from app import codec
+
+# Protocol 2 message body: (args, kwargs, embed)
+EMBED = {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}
+
+
+def _bodies(pairs: List[Tuple[int, int]], chunk_size: int) -> List[Tuple[Any, Any, Any]]:
+    '''The bodies _enqueue_followups publishes for ``pairs``: one celery.starmap message per chunk.'''
+    return [(tuple(sig.args), dict(sig.kwargs), EMBED) for sig in task_send_followup.chunks(pairs, chunk_size).group().tasks]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare bytes on the wire and encode/decode time of the follow-up send messages with the json and compact '
+        'serializers, without a broker. Times are per 100k pairs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pairs', type=int, default=100_000)
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            nargs='+',
+            default=[settings.FOLLOWUP_SEND_CHUNK_SIZE, 1000],
+            help='Pairs per message; several sizes are measured one after another'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Best of this many runs is reported')
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        pairs = [(rng.randint(1, 5_000_000), rng.randint(1, 20)) for _ in range(options['pairs'])]
+        per_100k = 100_000 / len(pairs)
+        encodings = (
+            ('json', 'json', None),
+            ('compact', codec.SERIALIZER, 2 ** 62),  # Never compressed
+            (f'compact, zlib from {settings.MESSAGE_COMPRESS_MIN_BYTES} B', codec.SERIALIZER, None),
+        )
+
+        self.stdout.write('| Pairs/message | Encoding | Messages | Bytes | Bytes/pair | Encode, ms | Decode, ms |')
+        self.stdout.write('| ------------- | -------- | -------- | ----- | ---------- | ---------- | ---------- |')
+        for chunk_size in options['chunk_size']:
+            bodies = _bodies(pairs, chunk_size)
+            for name, serializer, threshold in encodings:
+                with override_settings(MESSAGE_COMPRESS_MIN_BYTES=threshold or settings.MESSAGE_COMPRESS_MIN_BYTES):
+                    size, encode, decode = self._measure(bodies, serializer, options['repeat'])
+                self.stdout.write(
+                    f'| {chunk_size} | {name} | {len(bodies)} | {size} | {size / len(pairs):.1f} '
+                    f'| {encode * per_100k * 1000:.1f} | {decode * per_100k * 1000:.1f} |'
+                )
+
+    @staticmethod
+    def _measure(bodies, serializer: str, repeat: int) -> Tuple[int, float, float]:
+        best_encode = best_decode = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            messages = [dumps(body, serializer=serializer) for body in bodies]
+            best_encode = min(best_encode, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            for content_type, content_encoding, data in messages:
+                loads(data, content_type, content_encoding, accept=[content_type])
+            best_decode = min(best_decode, time.perf_counter() - started)
+        size = sum(len(data) for _, _, data in messages)
+        return size, best_encode, best_decode
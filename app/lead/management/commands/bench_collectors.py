@@ -0,0 +1,139 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from typing import List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from lead import followup_engine
+from lead import tasks as lead_tasks
+from lead.models import Lead, LeadFollowupRule, LeadStatus
+
+BENCH_PHONE_PREFIX = 'bench:'
+BENCH_DELAYS = (5, 30, 60, 240, 1440)
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the simple (SQL) and vectorized (NumPy) follow-up collectors on the current database and check that '
+        'they return identical pairs. Run it against a development database with beat stopped: '
+        '--rules creates enabled rules for the duration of the benchmark. With --shards it times a sharded tick of '
+        'the simple collector instead, for each shard count.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Create this many synthetic leads first (removed afterwards).')
+        parser.add_argument('--rules', action='store_true', help=f'Create enabled rules with delays {BENCH_DELAYS} for every status.')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--shards', type=int, nargs='+', metavar='K',
+            help='Shard counts to time a tick of the simple collector with (FOLLOWUP_MAX_ENQUEUE_PER_TICK split between the shards).'
+        )
+
+    def handle(self, *args, **options):
+        created_rules = []
+        try:
+            if options['rules']:
+                for status in LeadStatus.values:
+                    for delay in BENCH_DELAYS:
+                        rule, created = LeadFollowupRule.objects.get_or_create(
+                            status=status,
+                            delay=delay,
+                            defaults={'text': 'benchmark', 'is_enabled': True}
+                        )
+                        if created:
+                            created_rules.append(rule.pk)
+            if options['seed']:
+                self._seed(options['seed'])
+            if not LeadFollowupRule.objects.filter(is_enabled=True).exists():
+                raise CommandError('No enabled rules: pass --rules or create some first')
+            if options['shards']:
+                self._run_sharded(options['shards'], options['repeat'])
+            else:
+                self._run(options['repeat'])
+        finally:
+            LeadFollowupRule.objects.filter(pk__in=created_rules).delete()
+            Lead.objects.filter(phone__startswith=BENCH_PHONE_PREFIX).delete()
+
+    def _seed(self, count: int):
+        now = timezone.now()
+        statuses = LeadStatus.values
+        for offset in range(0, count, 10_000):
+            created = Lead.objects.bulk_create(
+                Lead(phone=f'{BENCH_PHONE_PREFIX}{index}', status=random.choice(statuses))
+                for index in range(offset, min(offset + 10_000, count))
+            )
+            # auto_now ignores explicit values on insert, so spread the ages over the last three days afterwards
+            for start in range(0, len(created), 500):
+                Lead.objects.filter(pk__in=[lead.pk for lead in created[start:start + 500]]).update(
+                    updated_at=now - timedelta(minutes=random.uniform(0, 3 * 1440))
+                )
+
+    def _run(self, repeat: int):
+        leads = Lead.objects.count()
+        followup_engine.reset_engine()
+        engine = followup_engine.get_engine()
+
+        simple_times, cold_times, warm_times = [], [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            simple = lead_tasks._collect_simple_followups()
+            simple_times.append(time.perf_counter() - started)
+
+            followup_engine.reset_engine()
+            engine = followup_engine.get_engine()
+            now = timezone.now()
+            started = time.perf_counter()
+            vectorized = engine.collect(now, now - lead_tasks.FOLLOWUP_REPEAT_THRESHOLD)
+            cold_times.append(time.perf_counter() - started)
+
+            now = timezone.now()
+            started = time.perf_counter()
+            warm = engine.collect(now, now - lead_tasks.FOLLOWUP_REPEAT_THRESHOLD)
+            warm_times.append(time.perf_counter() - started)
+
+            if vectorized != simple or warm != simple:
+                raise CommandError(
+                    f'Collectors disagree: simple={len(simple)}, vectorized={len(vectorized)}, warm={len(warm)} pairs'
+                )
+
+        snapshot_bytes = engine.leads.ids.nbytes + engine.leads.status_codes.nbytes + engine.leads.updated_us.nbytes
+        self.stdout.write(
+            f'\n{leads} leads, {LeadFollowupRule.objects.filter(is_enabled=True).count()} enabled rules, '
+            f'{len(simple)} pairs per tick, snapshot {snapshot_bytes / 2 ** 20:.1f} MiB\n'
+        )
+        self.stdout.write('| Collector | Median, ms | Min, ms |')
+        self.stdout.write('| --------- | ---------- | ------- |')
+        for name, timings in (
+            ('simple (SQL)', simple_times),
+            ('vectorized, cold snapshot', cold_times),
+            ('vectorized, incremental refresh', warm_times),
+        ):
+            self.stdout.write(f'| {name} | {statistics.median(timings) * 1000:.1f} | {min(timings) * 1000:.1f} |')
+
+    def _run_sharded(self, shard_counts: List[int], repeat: int):
+        budget = settings.FOLLOWUP_MAX_ENQUEUE_PER_TICK
+        self.stdout.write(
+            f'\n{Lead.objects.count()} leads, {LeadFollowupRule.objects.filter(is_enabled=True).count()} enabled rules, '
+            f'{budget} pairs per tick\n'
+        )
+        self.stdout.write('| Shards | Slowest shard, ms | All shards, ms | Pairs |')
+        self.stdout.write('| ------ | ----------------- | -------------- | ----- |')
+        for shard_count in shard_counts:
+            shard_budget = -(-budget // shard_count)
+            slowest_times, total_times = [], []
+            for _ in range(repeat):
+                timings, pairs = [], 0
+                for id_range in lead_tasks.shard_id_ranges(shard_count):
+                    started = time.perf_counter()
+                    pairs += len(lead_tasks._collect_simple_followups(limit=shard_budget, id_range=id_range))
+                    timings.append(time.perf_counter() - started)
+                # Shards run in parallel on a worker with enough concurrency: the tick lasts as long as its slowest shard
+                slowest_times.append(max(timings))
+                total_times.append(sum(timings))
+            self.stdout.write(
+                f'| {shard_count} | {statistics.median(slowest_times) * 1000:.1f} '
+                f'| {statistics.median(total_times) * 1000:.1f} | {pairs} |'
+            )
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from lead.models import Lead, LeadEvent, LeadStatus
+from lead.views import LeadEventListView, LeadListView
+from rest_framework.test import APIRequestFactory
+
+BENCH_PHONE_PREFIX = 'bench:'
+ENDPOINTS = (
+    ('leads/', LeadListView),
+    ('leads_events/', LeadEventListView),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Time a full page of leads/ and leads_events/ against the revalidation of an unchanged page '
+        '(If-None-Match answered with 304), and count the queries of both.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Create this many synthetic leads, one event each (removed afterwards).')
+        parser.add_argument('--limit', type=int, default=100, help='Page size requested.')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            if options['seed']:
+                leads = Lead.objects.bulk_create(
+                    Lead(phone=f'{BENCH_PHONE_PREFIX}{index}', status=LeadStatus.SUBMITTED)
+                    for index in range(options['seed'])
+                )
+                LeadEvent.objects.bulk_create(LeadEvent(lead=lead, status=lead.status) for lead in leads)
+            self._run(options['limit'], options['repeat'])
+        finally:
+            Lead.objects.filter(phone__startswith=BENCH_PHONE_PREFIX).delete()
+
+    def _run(self, limit: int, repeat: int):
+        factory = APIRequestFactory()
+        self.stdout.write(f'\n{Lead.objects.count()} leads, {LeadEvent.objects.count()} events, pages of {limit}\n')
+        self.stdout.write('| Endpoint | Full page, ms | Queries | Unchanged (304), ms | Queries |')
+        self.stdout.write('| -------- | ------------- | ------- | ------------------- | ------- |')
+        for path, view_class in ENDPOINTS:
+            view = view_class.as_view()
+            full, full_queries = self._time(view, lambda: factory.get(path, {'limit': limit}), repeat)
+            etag = view(factory.get(path, {'limit': limit})).render()['ETag']
+            unchanged, unchanged_queries = self._time(
+                view, lambda: factory.get(path, {'limit': limit}, HTTP_IF_NONE_MATCH=etag), repeat, expected=304
+            )
+            self.stdout.write(
+                f'| {path} | {statistics.median(full) * 1000:.2f} | {full_queries} '
+                f'| {statistics.median(unchanged) * 1000:.2f} | {unchanged_queries} |'
+            )
+
+    def _time(self, view, make_request, repeat: int, expected: int = 200):
+        timings = []
+        for _ in range(repeat):
+            request = make_request()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = view(request)
+                if hasattr(response, 'render'):
+                    response.render()  # Rendering is where the page gets serialized
+                timings.append(time.perf_counter() - started)
+            assert response.status_code == expected, response.status_code
+        return timings, len(queries)
@@ -0,0 +1,68 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from lead.views import LeadListView
+from rest_framework.test import APIRequestFactory
+
+from app.dbpool import pool_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare request latency with a fresh PostgreSQL connection per request against a checkout from the '
+        'connection pool. Every iteration ends with connection.close(), as Django does after each request and task.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        pool_options = connection.settings_dict['OPTIONS'].get('pool')
+        if connection.vendor != 'postgresql' or not pool_options:
+            raise CommandError('Needs PostgreSQL with DATABASES["default"]["OPTIONS"]["pool"] configured')
+
+        factory = APIRequestFactory()
+        view = LeadListView.as_view()
+        scenarios = (
+            ('SELECT 1', self._select_one),
+            ('GET leads/?limit=10', lambda: view(factory.get('/lead/leads/', {'limit': 10})).render()),
+        )
+        self.stdout.write('| Scenario | New connection, ms | Pooled, ms | Saved per request, ms |')
+        self.stdout.write('| -------- | ------------------ | ---------- | --------------------- |')
+        try:
+            for name, run in scenarios:
+                connection.close()
+                connection.settings_dict['OPTIONS'].pop('pool')
+                direct = self._time(run, options['repeat'])
+                connection.settings_dict['OPTIONS']['pool'] = pool_options
+                self._time(run, 1)  # Opens the pool, so its first connection isn't counted
+                pooled = self._time(run, options['repeat'])
+                self.stdout.write(
+                    f'| {name} | {statistics.median(direct):.2f} | {statistics.median(pooled):.2f} '
+                    f'| {statistics.median(direct) - statistics.median(pooled):.2f} |'
+                )
+        finally:
+            connection.settings_dict['OPTIONS']['pool'] = pool_options
+
+        stats = pool_stats().get(connection.alias, {})
+        self.stdout.write(
+            f'\nPool: {stats.get("connections_num", 0)} connections opened for '
+            f'{stats.get("requests_num", 0)} checkouts, {stats.get("requests_wait_ms", 0)} ms spent waiting'
+        )
+
+    @staticmethod
+    def _select_one():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    @staticmethod
+    def _time(run, repeat: int):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            connection.close()  # Back to the pool, or a closed socket without one
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+from lead import phones
+from lead.models import Lead
+
+# +999 is a reserved country code, so synthetic numbers never clash with real leads
+BENCH_PHONE_PREFIX = '+999'
+
+
+class Command(BaseCommand):
+    help = 'Time phone search in each mode and print the query plan of each, optionally on synthetic leads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Create this many synthetic leads (removed afterwards).')
+        parser.add_argument('--limit', type=int, default=10, help='Page size requested.')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            if options['seed']:
+                Lead.objects.bulk_create(
+                    (Lead(phone=f'{BENCH_PHONE_PREFIX}{index:011d}') for index in range(options['seed'])),
+                    batch_size=10_000
+                )
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'ANALYZE {Lead._meta.db_table}')  # Plans should see the new rows
+            self._run(options['limit'], options['repeat'])
+        finally:
+            Lead.objects.filter(phone__startswith=BENCH_PHONE_PREFIX).delete()
+
+    def _run(self, limit: int, repeat: int):
+        rng = random.Random(0)
+        last_id = Lead.objects.aggregate(last=Max('id'))['last']
+        if last_id is None:
+            self.stdout.write('No leads to search, pass --seed')
+            return
+        sample = Lead.objects.filter(pk__gte=rng.randint(1, last_id)).order_by('pk').values_list('phone', flat=True).first()
+        digits = sample.lstrip('+')
+        start = rng.randrange(max(len(digits) - 4, 1))
+        terms = (
+            (phones.EXACT, sample),
+            (phones.PREFIX, sample[:5]),
+            (phones.CONTAINS, digits[start:start + 4]),
+        )
+
+        self.stdout.write(f'\n{Lead.objects.count()} leads, pages of {limit}\n')
+        self.stdout.write('| Mode | Term | First page, ms | Third page, ms |')
+        self.stdout.write('| ---- | ---- | -------------- | -------------- |')
+        plans = []
+        for mode, term in terms:
+            first = self._time(term, mode, limit, None, repeat)
+            _, cursor = phones.search(term, mode, limit)
+            if cursor is not None:
+                _, cursor = phones.search(term, mode, limit, phones.decode_cursor(cursor))
+            third = '-'  # Fewer than three pages
+            if cursor is not None:
+                third = f'{statistics.median(self._time(term, mode, limit, phones.decode_cursor(cursor), repeat)) * 1000:.2f}'
+            self.stdout.write(f'| {mode} | {term} | {statistics.median(first) * 1000:.2f} | {third} |')
+            if connection.vendor == 'postgresql':
+                sql, params = phones.search_queryset(term, mode, limit).query.sql_with_params()
+                with connection.cursor() as db_cursor:
+                    db_cursor.execute(f'EXPLAIN {sql}', params)
+                    plans.append((mode, '\n'.join(row[0] for row in db_cursor.fetchall())))
+
+        for mode, plan in plans:
+            self.stdout.write(f'\n{mode}:\n{plan}')
+
+    @staticmethod
+    def _time(term: str, mode: str, limit: int, after: str | None, repeat: int):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            phones.search(term, mode, limit, after)
+            timings.append(time.perf_counter() - started)
+        return timings
@@ -0,0 +1,145 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lead.models import Lead, LeadFollowup, LeadFollowupRule, LeadStatus
+from lead.tasks import task_send_followup
+
+from app.celery import app as celery_app
+
+BENCH_QUEUE = 'followups.bench'
+BENCH_PHONE_PREFIX = 'bench:'
+
+
+def _children(pid: int) -> List[int]:
+    result = []
+    for task_dir in Path(f'/proc/{pid}/task').glob('*'):
+        try:
+            result.extend(int(child) for child in (task_dir / 'children').read_text().split())
+        except OSError:
+            continue
+    return result
+
+
+def _tree_rss(pid: int) -> Tuple[int, int]:
+    '''Return (total RSS in bytes, process count) for pid and all of its descendants.'''
+    total, count, pending = 0, 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            status = Path(f'/proc/{current}/status').read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith('VmRSS:'):
+                total += int(line.split()[1]) * 1024
+                count += 1
+                break
+        pending.extend(_children(current))
+    return total, count
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare task_send_followup throughput and worker RSS across Celery pool profiles. '
+        'Needs the broker and the database; every profile starts its own worker on a private queue.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Follow-ups to send per profile.')
+        parser.add_argument('--sms-delay', type=float, default=0.2, help='Simulated gateway latency (seconds).')
+        parser.add_argument('--chunk-size', type=int, default=settings.FOLLOWUP_SEND_CHUNK_SIZE)
+        parser.add_argument(
+            '--profile',
+            action='append',
+            dest='profiles',
+            help='pool:concurrency, may be repeated (default: prefork:4 and threads:64).'
+        )
+        parser.add_argument('--timeout', type=float, default=600, help='Give up on a profile after this many seconds.')
+
+    def handle(self, *args, **options):
+        if sys.platform != 'linux':
+            raise CommandError('RSS sampling relies on /proc and only works on Linux')
+
+        profiles = options['profiles'] or ['prefork:4', 'threads:64']
+        messages = options['messages']
+        Lead.objects.filter(phone__startswith=BENCH_PHONE_PREFIX).delete()
+        # Disabled and with an unreachable delay so the real collector never picks the benchmark rows up
+        rule, _ = LeadFollowupRule.objects.get_or_create(
+            status=LeadStatus.LOST,
+            delay=32767,
+            defaults={'text': 'benchmark', 'is_enabled': False}
+        )
+        leads = Lead.objects.bulk_create(
+            Lead(phone=f'{BENCH_PHONE_PREFIX}{index}', status=LeadStatus.LOST) for index in range(messages)
+        )
+        pairs = [(lead.id, rule.id) for lead in leads]
+
+        rows = []
+        try:
+            for profile in profiles:
+                pool, _, concurrency = profile.partition(':')
+                rows.append(self._run_profile(pool, int(concurrency or 1), pairs, rule, options))
+        finally:
+            LeadFollowup.objects.filter(rule=rule).delete()
+            Lead.objects.filter(phone__startswith=BENCH_PHONE_PREFIX).delete()
+            rule.delete()
+
+        self.stdout.write(
+            f'\n{messages} follow-ups, chunk size {options["chunk_size"]}, simulated SMS latency {options["sms_delay"]}s\n'
+        )
+        self.stdout.write('| Profile | Sends/s | Elapsed, s | Peak RSS, MiB | Processes | RSS per process, MiB |')
+        self.stdout.write('| ------- | ------- | ---------- | ------------- | --------- | -------------------- |')
+        for profile, rate, elapsed, rss, processes in rows:
+            self.stdout.write(
+                f'| {profile} | {rate:.1f} | {elapsed:.2f} | {rss / 2 ** 20:.1f} | {processes} | '
+                f'{rss / max(processes, 1) / 2 ** 20:.1f} |'
+            )
+
+    def _run_profile(self, pool: str, concurrency: int, pairs: Iterable[Tuple[int, int]], rule, options):
+        pairs = list(pairs)
+        LeadFollowup.objects.filter(rule=rule).delete()
+        node = f'bench-{pool}-{os.getpid()}@%h'
+        env = dict(os.environ, SMS_SEND_DELAY=str(options['sms_delay']))
+        worker = subprocess.Popen(
+            [
+                sys.executable, '-m', 'celery', '-A', 'app', 'worker',
+                '-Q', BENCH_QUEUE, '-P', pool, '-c', str(concurrency),
+                '-n', node, '--loglevel=warning', '--without-gossip', '--without-mingle'
+            ],
+            cwd=settings.BASE_DIR,
+            env=env
+        )
+        try:
+            hostname = node.replace('%h', os.uname().nodename)
+            deadline = time.monotonic() + 60
+            while not celery_app.control.ping(destination=[hostname], timeout=0.5):
+                if worker.poll() is not None or time.monotonic() > deadline:
+                    raise CommandError(f'Worker for profile {pool}:{concurrency} did not start')
+
+            started = time.perf_counter()
+            task_send_followup.chunks(pairs, options['chunk_size']).apply_async(queue=BENCH_QUEUE)
+            peak_rss, processes = _tree_rss(worker.pid)
+            deadline = time.monotonic() + options['timeout']
+            while LeadFollowup.objects.filter(rule=rule).count() < len(pairs):
+                if time.monotonic() > deadline:
+                    raise CommandError(f'Profile {pool}:{concurrency} did not finish in {options["timeout"]}s')
+                rss, count = _tree_rss(worker.pid)
+                if rss > peak_rss:
+                    peak_rss, processes = rss, count
+                time.sleep(0.2)
+            # The last rows are written before their SMS call returns, so wait for the worker to go idle
+            inspector = celery_app.control.inspect(destination=[hostname], timeout=0.5)
+            while any((inspector.active() or {}).values()):
+                time.sleep(0.1)
+            elapsed = time.perf_counter() - started
+        finally:
+            worker.terminate()
+            worker.wait(timeout=30)
+
+        return f'{pool}:{concurrency}', len(pairs) / elapsed, elapsed, peak_rss, processes
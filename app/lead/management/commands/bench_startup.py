@@ -0,0 +1,124 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What each process imports before it can do its first piece of work, and the APP_ROLE it runs with
+ROLES = {
+    'web': ('web', 'import django; django.setup(); from app.asgi import application; '
+                   'from django.urls import get_resolver; get_resolver().url_patterns'),
+    'worker': ('worker', 'import django; django.setup(); from app.celery import app; app.loader.import_default_modules()'),
+    'beat': ('worker', 'import django; django.setup(); from app.celery import app; app.loader.import_default_modules(); '
+                       'import django_celery_beat.schedulers'),
+}
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def _parse(stderr: str) -> Tuple[float, List[Tuple[str, float]]]:
+    '''Total import time (ms) and the cumulative time of every top-level import, from ``-X importtime`` output.'''
+    total_us = 0
+    top_level = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        self_us, cumulative_us, indent, module = match.groups()
+        total_us += int(self_us)
+        if not indent:
+            top_level.append((module, int(cumulative_us) / 1000))
+    return total_us / 1000, top_level
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the startup import time of each process role in fresh interpreters (python -X importtime). '
+        'Save a baseline with --save and check later runs against it with --compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--role', choices=ROLES, nargs='+', default=list(ROLES))
+        parser.add_argument('--repeat', type=int, default=5, help='Median of this many runs is reported.')
+        parser.add_argument('--top', type=int, default=10, help='Slowest top-level imports listed per role.')
+        parser.add_argument('--save', metavar='FILE', help='Write the results as a JSON baseline.')
+        parser.add_argument('--compare', metavar='FILE', help='JSON baseline to compare with.')
+        parser.add_argument(
+            '--max-regression',
+            type=float,
+            default=20,
+            help='With --compare, fail when a role imports this many percent slower than its baseline.'
+        )
+
+    def handle(self, *args, **options):
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        results: Dict[str, Dict[str, float]] = {}
+        slowest = {}
+        for role in options['role']:
+            results[role], slowest[role] = self._measure(role, options['repeat'])
+
+        self.stdout.write('| Role | Wall, ms | Imports, ms | Modules | Baseline, ms | Change |')
+        self.stdout.write('| ---- | -------- | ----------- | ------- | ------------ | ------ |')
+        regressions = []
+        for role, result in results.items():
+            before = baseline.get(role, {}).get('imports_ms')
+            change = ''
+            if before:
+                percent = (result['imports_ms'] / before - 1) * 100
+                change = f'{percent:+.1f}%'
+                if percent > options['max_regression']:
+                    regressions.append(f'{role} {change}')
+            self.stdout.write(
+                f'| {role} | {result["wall_ms"]:.0f} | {result["imports_ms"]:.0f} | {result["modules"]:.0f} '
+                f'| {f"{before:.0f}" if before else "-"} | {change} |'
+            )
+        for role, modules in slowest.items():
+            self.stdout.write(f'\n{role}, slowest top-level imports:')
+            for module, cumulative_ms in modules[:options['top']]:
+                self.stdout.write(f'  {cumulative_ms:8.1f} ms  {module}')
+
+        if options['save']:
+            with open(options['save'], 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+        if regressions:
+            raise CommandError(f'Startup regressed beyond {options["max_regression"]}%: {", ".join(regressions)}')
+
+    @staticmethod
+    def _measure(role: str, repeat: int) -> Tuple[Dict[str, float], List[Tuple[str, float]]]:
+        app_role, code = ROLES[role]
+        env = dict(os.environ, APP_ROLE=app_role)
+        walls, totals, modules, runs = [], [], [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            process = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', code],
+                cwd=settings.BASE_DIR,
+                env=env,
+                capture_output=True,
+                text=True
+            )
+            walls.append((time.perf_counter() - started) * 1000)
+            if process.returncode:
+                raise CommandError(f'{role} failed to start:\n{process.stderr[-2000:]}')
+            total_ms, top_level = _parse(process.stderr)
+            totals.append(total_ms)
+            modules.append(process.stderr.count('\nimport time:') - 1)  # Minus the header line
+            runs.append(top_level)
+
+        # Slowest imports of the median run
+        median_run = runs[totals.index(statistics.median_low(totals))]
+        result = {
+            'wall_ms': statistics.median(walls),
+            'imports_ms': statistics.median(totals),
+            'modules': statistics.median(modules),
+        }
+        return result, sorted(median_run, key=lambda item: item[1], reverse=True)
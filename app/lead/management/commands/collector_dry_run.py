@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from lead.collector_report import dry_run
+
+
+class Command(BaseCommand):
+    help = (
+        'Show what the next collector tick would send and what each of its queries costs, without enqueuing or '
+        f'changing anything. Plans of queries slower than FOLLOWUP_SLOW_QUERY_MS ({settings.FOLLOWUP_SLOW_QUERY_MS} ms) '
+        'are saved for comparison (admin: Collector query plans).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rule',
+            type=int,
+            action='append',
+            dest='rules',
+            help='Report on this rule id, enabled or not (repeatable). Every enabled rule by default.'
+        )
+        parser.add_argument('--plans', action='store_true', help='Print the plan of every query.')
+        parser.add_argument('--no-save', action='store_false', dest='save', help="Don't save the slow plans.")
+
+    def handle(self, *args, **options):
+        report = dry_run(options['rules'], save=options['save'])
+        timings = {query.rule_id: query.duration_ms for query in report.queries}
+
+        self.stdout.write('| Rule | Status | Delay, min | Overdue leads | Held back | To send | Query, ms |')
+        self.stdout.write('| ---- | ------ | ---------- | ------------- | --------- | ------- | --------- |')
+        for rule in report.rules:
+            name = rule.rule_id if rule.is_enabled else f'{rule.rule_id} (disabled)'
+            self.stdout.write(
+                f'| {name} | {rule.status} | {rule.delay} | {rule.candidates} | {rule.suppressed} | {rule.pairs} '
+                f'| {timings[rule.rule_id]:.1f} |'
+            )
+        self.stdout.write(f'\nEligible rules query: {timings[None]:.1f} ms')
+        if options['save']:
+            self.stdout.write(f'Slow query plans saved: {report.saved_plans}')
+
+        if options['plans']:
+            for query in report.queries:
+                rule = '' if query.rule_id is None else f' (rule {query.rule_id})'
+                self.stdout.write(f'\n{query.query}{rule}, {query.duration_ms:.1f} ms:\n{query.plan}')
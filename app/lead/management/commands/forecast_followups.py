@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from lead.forecast import PROPOSED, ForecastRule, forecast
+from lead.serializers import ForecastValidator
+
+
+class Command(BaseCommand):
+    help = (
+        'Forecast the follow-up SMS sent per time bucket over the next hours and flag the buckets above the sending '
+        'capacity. Pass --status and --delay to include a rule that is not saved yet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=24, help='Forecast horizon.')
+        parser.add_argument('--bucket', type=int, default=60, help='Bucket width in minutes.')
+        parser.add_argument('--status', help='Status of the proposed rule.')
+        parser.add_argument('--delay', type=int, help='Delay of the proposed rule in minutes.')
+
+    def handle(self, *args, **options):
+        params = ForecastValidator(data={key: options[key] for key in ('hours', 'bucket', 'status', 'delay') if options[key] is not None})
+        if not params.is_valid():
+            raise CommandError(params.errors)
+        data = params.validated_data
+        proposed = ForecastRule(PROPOSED, data['status'], data['delay']) if 'status' in data else None
+
+        result = forecast(data['hours'], data['bucket'], proposed)
+        self.stdout.write(f'Capacity: {result["capacity_per_bucket"]} SMS per {data["bucket"]} min bucket\n')
+        self.stdout.write('| Bucket start | SMS | Over capacity |')
+        self.stdout.write('| ------------ | --- | ------------- |')
+        for bucket in result['buckets']:
+            start = timezone.localtime(bucket['start']).strftime('%Y-%m-%d %H:%M')
+            self.stdout.write(f'| {start} | {bucket["sends"]} | {"yes" if bucket["over_capacity"] else ""} |')
+        rules = ', '.join(f'{key}: {sends}' for key, sends in result['rules'].items())
+        self.stdout.write(f'\nTotal: {result["total"]} ({rules or "no enabled rules"})')
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lead.lanes import lane_stats
+
+
+def _seconds(value: float | None) -> str:
+    return '-' if value is None else f'{value:g}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Print the depth of each follow-up send lane and how long its messages waited in the queue: mean, and the '
+        'upper bound of the latency bucket holding the median and the 95th percentile (seconds).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('lanes', nargs='*', help=f'Any of {", ".join(settings.FOLLOWUP_SEND_LANES)}; every lane by default.')
+
+    def handle(self, *args, **options):
+        unknown = set(options['lanes']) - set(settings.FOLLOWUP_SEND_LANES)
+        if unknown:
+            raise CommandError(f'Unknown lanes: {", ".join(sorted(unknown))}')
+        self.stdout.write('| Lane | Weight | Queued | Delivered | Mean wait | p50 wait | p95 wait |')
+        self.stdout.write('| ---- | ------ | ------ | --------- | --------- | -------- | -------- |')
+        for lane, stats in lane_stats(options['lanes'] or None).items():
+            mean_wait = '-' if stats['mean_wait'] is None else f'{stats["mean_wait"]:.2f}'
+            self.stdout.write(
+                f'| {lane} | {settings.FOLLOWUP_LANE_WEIGHTS.get(lane, 1)} | {_seconds(stats["depth"])} '
+                f'| {stats["messages"]} | {mean_wait} | {_seconds(stats["p50_wait"])} | {_seconds(stats["p95_wait"])} |'
+            )
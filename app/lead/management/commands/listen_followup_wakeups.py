@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+import psycopg
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from lead.tasks import task_collect_lead_followups
+from lead.wakeup import WAKEUP_CHANNEL, WakeupScheduler
+
+
+class Command(BaseCommand):
+    help = (
+        f'Listen on the PostgreSQL channel "{WAKEUP_CHANNEL}" and run the follow-up collector for individual '
+        'leads the moment they fall due. Runs until interrupted; start a single instance.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Wake-ups rely on PostgreSQL LISTEN/NOTIFY')
+
+        # A dedicated connection: a pooled one would carry the LISTEN back into the pool
+        listener = psycopg.connect(**connection.get_connection_params(), autocommit=True)
+        listener.execute(f'LISTEN {WAKEUP_CHANNEL}')
+
+        scheduler = WakeupScheduler()
+        # Periodic reloads pull in pairs that have moved into the horizon since the last one
+        reload_every = timedelta(seconds=settings.FOLLOWUP_WAKEUP_HORIZON / 2)
+        next_reload = timezone.now()
+        self.stdout.write(f'Listening on {WAKEUP_CHANNEL}')
+
+        with listener:
+            while True:
+                now = timezone.now()
+                if now >= next_reload:
+                    scheduler.reload(now)
+                    next_reload = now + reload_every
+                    self.stdout.write(f'Tracking {len(scheduler)} pairs due within {settings.FOLLOWUP_WAKEUP_HORIZON}s')
+
+                lead_ids = scheduler.pop_due(now)
+                if lead_ids:
+                    task_collect_lead_followups.delay(lead_ids)
+
+                due_at = scheduler.next_due_at()
+                wake_at = next_reload if due_at is None else min(due_at, next_reload)
+                timeout = max((wake_at - timezone.now()).total_seconds(), 0)
+                # Block until the first notification or the next deadline, then take whatever else has arrived
+                payloads = [notify.payload for notify in listener.notifies(timeout=timeout, stop_after=1)]
+                if payloads:
+                    payloads.extend(notify.payload for notify in listener.notifies(timeout=0))
+                    scheduler.handle(payloads, timezone.now())
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app.celery import app
+from app.lockers import OUTCOMES, lock_stats
+
+
+class Command(BaseCommand):
+    help = 'Print how often each singleton task got its lock, was skipped, or had its run folded into a rerun.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('locks', nargs='*', help='Lock name templates; every singleton task by default.')
+
+    def handle(self, *args, **options):
+        app.loader.import_default_modules()  # Defining the tasks registers their locks
+        stats = lock_stats(options['locks'] or None)
+        self.stdout.write(f'| Lock | {" | ".join(OUTCOMES)} |')
+        self.stdout.write(f'| ---- |{" ---- |" * len(OUTCOMES)}')
+        for label, counts in stats.items():
+            self.stdout.write(f'| {label} | {" | ".join(str(counts[outcome]) for outcome in OUTCOMES)} |')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from lead.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recompute the lead funnel and time-in-status statistics from the full event history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of lead id ranges aggregated in parallel.')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Number of lead ids per range.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive')
+        transitions, _ = rebuild(workers=options['workers'], batch_size=options['batch_size'])
+        self.stdout.write(f'Rebuilt {sum(transitions.values())} transitions over {len(transitions)} status pairs')
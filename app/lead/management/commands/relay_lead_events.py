@@ -0,0 +1,47 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lead.models import LeadEventOutbox
+from lead.outbox import relay_batch
+
+STATS_INTERVAL = 60  # Seconds between throughput/lag reports
+
+
+class Command(BaseCommand):
+    help = (
+        'Relay committed lead events from the outbox to the Redis stream LEAD_EVENTS_STREAM. Runs until interrupted. '
+        'Several relays may run side by side, on the same or different partitions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partition', type=int, default=0, help='Index of the lead partition to relay.')
+        parser.add_argument('--partitions', type=int, default=1, help='Total number of lead partitions (lead_id %% N).')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox and exit instead of polling.')
+
+    def handle(self, *args, **options):
+        partition = (options['partition'], options['partitions'])
+        if not 0 <= partition[0] < partition[1]:
+            raise CommandError('--partition must be in [0, --partitions)')
+
+        window_started = time.monotonic()
+        window_published, window_lag = 0, 0.0
+        while True:
+            published, lag = relay_batch(partition)
+            window_published += published
+            window_lag = max(window_lag, lag or 0.0)
+            drained = published < settings.OUTBOX_RELAY_BATCH_SIZE  # A full batch means more is waiting
+
+            elapsed = time.monotonic() - window_started
+            if elapsed >= STATS_INTERVAL or (options['once'] and drained):
+                self.stdout.write(
+                    f'Relayed {window_published} events ({window_published / max(elapsed, 0.001):.1f}/s), '
+                    f'max lag {window_lag:.3f}s, {LeadEventOutbox.objects.count()} pending'
+                )
+                window_started = time.monotonic()
+                window_published, window_lag = 0, 0.0
+
+            if drained:
+                if options['once']:
+                    return
+                time.sleep(settings.OUTBOX_RELAY_POLL_INTERVAL)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0002_create_followup_schedule'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['status', 'updated_at'], name='lead_status_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0003_lead_status_updated_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowupCollectorWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_updated_at', models.DateTimeField()),
+                ('last_lead_id', models.BigIntegerField()),
+                ('rule', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='collector_watermark', to='lead.leadfollowuprule')),
+            ],
+        ),
+    ]
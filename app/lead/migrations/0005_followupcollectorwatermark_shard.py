@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0004_followupcollectorwatermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='followupcollectorwatermark',
+            name='shard_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='followupcollectorwatermark',
+            name='shard_index',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='followupcollectorwatermark',
+            name='rule',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='collector_watermarks', to='lead.leadfollowuprule'),
+        ),
+        migrations.AddConstraint(
+            model_name='followupcollectorwatermark',
+            constraint=models.UniqueConstraint(fields=('rule', 'shard_index', 'shard_count'), name='lead_watermark_rule_shard_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0005_followupcollectorwatermark_shard'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['updated_at'], name='lead_updated_idx'),
+        ),
+    ]
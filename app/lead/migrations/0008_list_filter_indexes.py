@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0007_leadeventoutbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leadevent',
+            index=models.Index(fields=['status', 'created_at'], name='lead_event_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leadevent',
+            index=models.Index(fields=['created_at'], name='lead_event_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leadfollowup',
+            index=models.Index(fields=['created_at'], name='lead_followup_created_idx'),
+        ),
+    ]
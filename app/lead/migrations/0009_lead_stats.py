@@ -0,0 +1,40 @@
+# Generated by Django 5.2.6 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0008_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeadStatusDurationStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('new', 'New'), ('submitted', 'Submitted'), ('verified', 'Verified'), ('paid', 'Paid'), ('lost', 'Lost')], max_length=16)),
+                ('bucket', models.PositiveSmallIntegerField()),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.BigIntegerField(default=0)),
+                ('total_seconds', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('status', 'bucket', 'slot'), name='lead_duration_stat_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LeadTransitionStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('new', 'New'), ('submitted', 'Submitted'), ('verified', 'Verified'), ('paid', 'Paid'), ('lost', 'Lost')], max_length=16)),
+                ('to_status', models.CharField(choices=[('new', 'New'), ('submitted', 'Submitted'), ('verified', 'Verified'), ('paid', 'Paid'), ('lost', 'Lost')], max_length=16)),
+                ('slot', models.PositiveSmallIntegerField(default=0)),
+                ('count', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('from_status', 'to_status', 'slot'), name='lead_transition_stat_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:14
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+
+class AddPostgresIndex(migrations.AddIndex):
+    '''AddIndex for index kinds other databases lack (collations, GIN); a no-op elsewhere.'''
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0009_lead_stats'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        AddPostgresIndex(
+            model_name='lead',
+            index=models.Index(django.db.models.functions.comparison.Collate('phone', 'C'), name='lead_phone_c_idx'),
+        ),
+        AddPostgresIndex(
+            model_name='lead',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['phone'], name='lead_phone_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
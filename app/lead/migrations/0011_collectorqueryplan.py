@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0010_lead_phone_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectorQueryPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query', models.CharField(max_length=32)),
+                ('duration_ms', models.FloatField()),
+                ('sql', models.TextField()),
+                ('plan', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rule', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='query_plans', to='lead.leadfollowuprule')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['query', '-created_at'], name='lead_plan_query_created_idx')],
+            },
+        ),
+    ]
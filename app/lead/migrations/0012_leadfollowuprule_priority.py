@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lead', '0011_collectorqueryplan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='leadfollowuprule',
+            name='priority',
+            field=models.CharField(choices=[('high', 'High'), ('normal', 'Normal'), ('low', 'Low')], default='normal', max_length=8),
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
+from django.db.models.functions import Collate
 
 
 class LeadStatus(models.TextChoices):
@@ -11,6 +13,14 @@ class LeadStatus(models.TextChoices):
     LOST = 'lost'
 
 
+class FollowupPriority(models.TextChoices):
+    '''Delivery lanes of followups, each with its own send queue (FOLLOWUP_SEND_LANES).'''
+
+    HIGH = 'high'
+    NORMAL = 'normal'
+    LOW = 'low'
+
+
 class Lead(models.Model):
     '''
     Current status of the lead with their details
@@ -26,7 +36,24 @@ class Lead(models.Model):
             models.Index(
                 fields=['status'],
                 name='lead_status_idx'
-            )  # Accelerate queries that fetch all leads in a particular pipeline step
+            ),  # Accelerate queries that fetch all leads in a particular pipeline step
+            models.Index(
+                fields=['status', 'updated_at'],
+                name='lead_status_updated_idx'
+            ),  # Walk the leads of a status oldest-first, e.g. the most overdue follow-up candidates
+            models.Index(
+                fields=['updated_at'],
+                name='lead_updated_idx'
+            ),  # Fetch leads changed since a point in time, e.g. incremental snapshot refreshes
+            models.Index(
+                Collate('phone', 'C'),
+                name='lead_phone_c_idx'
+            ),  # Phone prefix ranges and keyset pages in byte order (lead.phones)
+            GinIndex(
+                fields=['phone'],
+                name='lead_phone_trgm_idx',
+                opclasses=['gin_trgm_ops']
+            )  # Phone substring search (lead.phones); needs the pg_trgm extension
         ]
 
     def __str__(self) -> str:
@@ -46,13 +73,34 @@ class LeadEvent(models.Model):
             models.Index(
                 fields=['lead', '-created_at'],
                 name='lead_event_latest_idx'
-            )  # Support queries that grab 'latest event per lead' without table scans
+            ),  # Support queries that grab 'latest event per lead' without table scans
+            models.Index(
+                fields=['status', 'created_at'],
+                name='lead_event_status_created_idx'
+            ),  # Events of a status in time order, e.g. the status filter of the events list
+            models.Index(
+                fields=['created_at'],
+                name='lead_event_created_idx'
+            )  # Events in a time range
         ]
 
     def __str__(self) -> str:
         return f'{self.__class__.__name__}({self.pk}, {self.status})'
 
 
+class LeadEventOutbox(models.Model):
+    '''
+    LeadEvent waiting to be published to the lead events stream; written in the same transaction as the event
+    '''
+    event = models.ForeignKey(LeadEvent, on_delete=models.CASCADE, related_name='+')
+    lead = models.ForeignKey(Lead, on_delete=models.CASCADE, related_name='+')  # Relays partition by lead to keep per-lead order
+    payload = models.JSONField()  # Message body as published, so the relay never joins back to the event
+    created_at = models.DateTimeField(auto_now_add=True)  # Relay lag is measured from here
+
+    def __str__(self) -> str:
+        return f'{self.__class__.__name__}({self.pk}, {self.event_id})'
+
+
 class LeadFollowupRule(models.Model):
     '''
     Send text as a SMS followup to a lead's phone number
@@ -64,6 +112,9 @@ class LeadFollowupRule(models.Model):
     status = models.CharField(max_length=16, choices=LeadStatus.choices)
     delay = models.PositiveSmallIntegerField()  # Minutes the lead may stay on the status before this followup is triggered
     is_enabled = models.BooleanField(default=True)  # Toggle to disable followups without deleting the rule
+    priority = models.CharField(
+        max_length=8, choices=FollowupPriority.choices, default=FollowupPriority.NORMAL
+    )  # Send lane: higher lanes get a larger share of the sender while the queues are backed up
 
     class Meta:
         indexes = [
@@ -96,7 +147,67 @@ class LeadFollowup(models.Model):
             models.Index(
                 fields=['lead', '-created_at'],
                 name='lead_followup_history_idx'
-            )  # Speed timeline queries for followups per lead
+            ),  # Speed timeline queries for followups per lead
+            models.Index(
+                fields=['created_at'],
+                name='lead_followup_created_idx'
+            )  # Followups in a time range
+        ]
+
+
+class FollowupCollectorWatermark(models.Model):
+    '''
+    Keyset position of an unfinished streaming collector run for a rule within a collector shard
+    '''
+    rule = models.ForeignKey(LeadFollowupRule, on_delete=models.CASCADE, related_name='collector_watermarks')
+    shard_index = models.PositiveIntegerField(default=0)
+    shard_count = models.PositiveIntegerField(default=1)  # Positions are only meaningful for the partitioning they were taken in
+    last_updated_at = models.DateTimeField()  # Lead.updated_at of the last enqueued candidate
+    last_lead_id = models.BigIntegerField()  # Tie-breaker for candidates sharing the same updated_at
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['rule', 'shard_index', 'shard_count'],
+                name='lead_watermark_rule_shard_uniq'
+            )
+        ]
+
+
+class LeadTransitionStat(models.Model):
+    '''
+    Number of status transitions from one status to another, kept up to date on every transition
+    '''
+    from_status = models.CharField(max_length=16, choices=LeadStatus.choices)
+    to_status = models.CharField(max_length=16, choices=LeadStatus.choices)
+    slot = models.PositiveSmallIntegerField(default=0)  # Counters are spread over slots so concurrent transitions don't queue on one row
+    count = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['from_status', 'to_status', 'slot'],
+                name='lead_transition_stat_uniq'
+            )
+        ]
+
+
+class LeadStatusDurationStat(models.Model):
+    '''
+    Histogram of the time leads spent in a status before leaving it
+    '''
+    status = models.CharField(max_length=16, choices=LeadStatus.choices)
+    bucket = models.PositiveSmallIntegerField()  # Index into lead.stats.DURATION_BUCKETS
+    slot = models.PositiveSmallIntegerField(default=0)
+    count = models.BigIntegerField(default=0)
+    total_seconds = models.FloatField(default=0)  # Sum of the durations, for the mean
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['status', 'bucket', 'slot'],
+                name='lead_duration_stat_uniq'
+            )
         ]
 
 
@@ -108,3 +219,29 @@ class TaskExecutionLock(models.Model):
         indexes = [
             models.Index(fields=['name'])
         ]
+
+
+class CollectorQueryPlan(models.Model):
+    '''
+    Query plan of a slow collector query, saved by a collector dry run for comparison across releases
+    '''
+    query = models.CharField(max_length=32)  # lead.collector_report.ELIGIBLE_RULES or STALLED_LEADS
+    rule = models.ForeignKey(
+        LeadFollowupRule,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='query_plans'
+    )  # The rule a stalled-leads query was generated for
+    duration_ms = models.FloatField()
+    sql = models.TextField()
+    plan = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['query', '-created_at'],
+                name='lead_plan_query_created_idx'
+            )  # Latest plans of a query, to compare with earlier ones
+        ]
@@ -0,0 +1,97 @@
+'''
+Transactional outbox for lead events.
+
+record_event() stores the outgoing message in the same transaction as its LeadEvent. relay_batch() moves committed
+rows, oldest first, to the Redis stream LEAD_EVENTS_STREAM and then deletes them. If a relay dies between the two
+steps, the batch is published again. Delivery is therefore at-least-once, and consumers deduplicate on ``outbox_id``.
+Each relay batch runs under the task lock of its lead partition (lead_id % partitions). Batches of a partition
+therefore never interleave, and the events of a lead are published in the order they were committed.
+'''
+import logging
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField
+from django.db.models.functions import Mod
+from django.utils import timezone
+from django_redis import get_redis_connection
+from lead.models import LeadEvent, LeadEventOutbox
+
+from app import tracing
+from app.lockers import task_lock
+
+logger = logging.getLogger('app')
+
+Partition = Tuple[int, int]  # (index, count): the relay owns leads with id % count == index
+
+
+def record_event(event: LeadEvent):
+    '''Queue ``event`` for publishing; call inside the transaction that created it.'''
+    record_events([event])
+
+
+def record_events(events: Iterable[LeadEvent]):
+    '''record_event() for many events, in one INSERT per batch.'''
+    LeadEventOutbox.objects.bulk_create(
+        (
+            LeadEventOutbox(
+                event=event,
+                lead_id=event.lead_id,
+                payload={
+                    'event_id': event.pk,
+                    'lead_id': event.lead_id,
+                    'status': event.status,
+                    'created_at': event.created_at.isoformat(),
+                }
+            )
+            for event in events
+        ),
+        batch_size=1000
+    )
+
+
+def _publish(messages: List[Dict[str, str]]):
+    redis = get_redis_connection('default')
+    with redis.pipeline(transaction=False) as pipe:
+        for message in messages:
+            pipe.xadd(
+                settings.LEAD_EVENTS_STREAM,
+                message,
+                maxlen=settings.LEAD_EVENTS_STREAM_MAXLEN,
+                approximate=True
+            )
+        pipe.execute()
+
+
+def relay_batch(partition: Partition = (0, 1)) -> Tuple[int, float | None]:
+    '''
+    Publish and delete up to OUTBOX_RELAY_BATCH_SIZE of the oldest rows of ``partition``.
+    Returns the number published and the lag of the oldest one in seconds (None when nothing was pending).
+    '''
+    index, count = partition
+    with task_lock(f'lead.outbox.relay-{index}-of-{count}') as acquired:
+        if not acquired:
+            return 0, None
+        with transaction.atomic():
+            rows = LeadEventOutbox.objects.order_by('id')
+            if count > 1:
+                rows = rows.alias(
+                    partition=Mod('lead_id', count, output_field=BigIntegerField())
+                ).filter(partition=index)
+            # SKIP LOCKED keeps the relay moving past rows a concurrent transaction (e.g. a cascading delete) holds
+            batch = list(
+                rows.select_for_update(skip_locked=True).values_list('id', 'payload', 'created_at')[:settings.OUTBOX_RELAY_BATCH_SIZE]
+            )
+            if not batch:
+                return 0, None
+
+            lag = (timezone.now() - batch[0][2]).total_seconds()
+            with tracing.start_span('outbox.relay', partition=f'{index}/{count}', published=len(batch), lag_ms=round(lag * 1000, 1)):
+                _publish([
+                    {'outbox_id': str(outbox_id), **{key: str(value) for key, value in payload.items()}}
+                    for outbox_id, payload, _ in batch
+                ])
+                # Deleted in the same transaction: a crash before commit leaves the rows to be published again
+                LeadEventOutbox.objects.filter(pk__in=[outbox_id for outbox_id, _, _ in batch]).delete()
+            return len(batch), lag
@@ -1,5 +1,8 @@
 from typing import Any, List
 
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.response import Response
 
@@ -22,3 +25,23 @@ def limit_offset_pagination(items: List[Any], offset: int, limit: int = 10, max_
         limit = max_limit
     end = offset + limit
     return items[offset:end]
+
+
+class EstimatedCountPaginator(Paginator):
+    '''
+    Django paginator for the admin that never counts a large table exactly. An unfiltered PostgreSQL table reports
+    the planner's row estimate, anything else is counted up to ``count_limit`` rows; pages past it aren't listed.
+    '''
+    count_limit = 10_000
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > self.count_limit:  # -1 until the table is first analyzed
+                return int(row[0])
+        return queryset.order_by()[:self.count_limit].count()
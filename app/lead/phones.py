@@ -0,0 +1,95 @@
+'''
+Phone number lookup and search over Lead.phone, which holds numbers in E.164 form (``+`` and 7 to 15 digits).
+
+- ``exact``: the normalized number, by the unique index.
+- ``prefix``: a range over ``phone COLLATE "C"``, where byte order makes every number with the prefix one
+  contiguous run of lead_phone_c_idx.
+- ``contains``: ``LIKE '%digits%'`` served by the pg_trgm index lead_phone_trgm_idx. It needs at least
+  MIN_CONTAINS_LENGTH digits, because shorter terms have no trigram to look up.
+Results are keyset-paginated in byte order of the number: the cursor is the last number returned, so a page
+costs the same at any depth.
+'''
+import base64
+import binascii
+import re
+from typing import List, Tuple
+
+from django.db import connection
+from django.db.models import F
+from django.db.models.functions import Collate
+from lead.models import Lead
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+CONTAINS = 'contains'
+MODES = (EXACT, PREFIX, CONTAINS)
+MIN_CONTAINS_LENGTH = 3
+
+_SEPARATORS = re.compile(r'[\s\-./()]')
+_E164 = re.compile(r'\+[1-9]\d{6,14}')
+_PARTIAL = re.compile(r'\+?\d*')
+
+
+def normalize(value: str, mode: str = EXACT) -> str:
+    '''
+    Bring user input to the stored form: ``exact`` needs a whole E.164 number, ``prefix`` its beginning and
+    ``contains`` any run of its digits. Separators are dropped and a leading ``00`` counts as ``+``.
+    Raises ValueError for anything else.
+    '''
+    value = _SEPARATORS.sub('', value)
+    if value.startswith('00'):
+        value = f'+{value[2:]}'
+    if not _PARTIAL.fullmatch(value) or not value.strip('+'):
+        raise ValueError('Expected a phone number')
+    if mode == CONTAINS:
+        value = value.lstrip('+')
+        if len(value) < MIN_CONTAINS_LENGTH:
+            raise ValueError(f'Expected at least {MIN_CONTAINS_LENGTH} digits')
+        return value
+    value = f'+{value.lstrip("+")}'  # Every stored number starts with +
+    if mode == EXACT and not _E164.fullmatch(value):
+        raise ValueError('Expected an E.164 number: + and 7 to 15 digits')
+    return value
+
+
+def encode_cursor(phone: str) -> str:
+    return base64.urlsafe_b64encode(phone.encode()).decode()
+
+
+def decode_cursor(value: str) -> str:
+    '''Raises ValueError for anything that isn't a cursor produced by encode_cursor().'''
+    try:
+        phone = base64.b64decode(value.encode(), altchars=b'-_', validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError('Malformed cursor') from exc
+    if not phone:
+        raise ValueError('Malformed cursor')
+    return phone
+
+
+def _byte_ordered():
+    # SQLite compares text bytewise already and has no "C" collation
+    return Collate('phone', 'C') if connection.vendor == 'postgresql' else F('phone')
+
+
+def search_queryset(term: str, mode: str, limit: int, after: str | None = None):
+    '''The leads matching the normalized ``term`` after the number ``after``, in byte order: one page and one more.'''
+    leads = Lead.objects.alias(phone_key=_byte_ordered())
+    if mode == EXACT:
+        leads = leads.filter(phone=term)
+    elif mode == PREFIX:
+        # Every string with the prefix sorts between it and the prefix with its last character incremented
+        leads = leads.filter(phone_key__gte=term, phone_key__lt=term[:-1] + chr(ord(term[-1]) + 1))
+    else:
+        leads = leads.filter(phone__contains=term)
+    if after is not None:
+        leads = leads.filter(phone_key__gt=after)
+    return leads.order_by('phone_key')[:limit + 1]
+
+
+def search(term: str, mode: str, limit: int, after: str | None = None) -> Tuple[List[Lead], str | None]:
+    '''A page of the leads matching the normalized ``term``, and the cursor of the next page (None on the last).'''
+    page = list(search_queryset(term, mode, limit, after))
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1].phone)
+    return page, None
@@ -0,0 +1,76 @@
+import logging
+from datetime import datetime, timedelta
+
+from celery import current_app
+from celery.signals import beat_init
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Min
+from django.utils import timezone
+from lead.models import Lead, LeadFollowupRule
+
+logger = logging.getLogger('app')
+
+COLLECT_TASK_NAME = 'lead.task.task_collect_followups'
+NEXT_RUN_CACHE_KEY = 'lead:followups:next_run_at'
+
+
+def next_due_at(now: datetime) -> datetime | None:
+    '''Earliest moment a lead that is not overdue yet crosses the delay of an enabled rule.'''
+    earliest = None
+    for status, delay in LeadFollowupRule.objects.filter(is_enabled=True).values_list('status', 'delay'):
+        span = timedelta(minutes=delay)
+        # Served by lead_status_updated_idx: the first index entry past the cutoff
+        oldest_waiting = Lead.objects.filter(
+            status=status,
+            updated_at__gt=now - span
+        ).aggregate(oldest=Min('updated_at'))['oldest']
+        if oldest_waiting is not None and (earliest is None or oldest_waiting + span < earliest):
+            earliest = oldest_waiting + span
+    return earliest
+
+
+def schedule_next_run(saturated: bool):
+    '''
+    Queue the next collector run for the moment the next follow-up falls due, clamped to
+    [FOLLOWUP_SCHEDULE_MIN_INTERVAL, FOLLOWUP_SCHEDULE_MAX_INTERVAL]. A saturated run (work was deferred
+    by backpressure) comes back after the minimum interval.
+    '''
+    now = timezone.now()
+    min_interval = settings.FOLLOWUP_SCHEDULE_MIN_INTERVAL
+    max_interval = settings.FOLLOWUP_SCHEDULE_MAX_INTERVAL
+    if saturated:
+        countdown = min_interval
+    else:
+        due = next_due_at(now)
+        countdown = max_interval if due is None else (due - now).total_seconds()
+        countdown = min(max(countdown, min_interval), max_interval)
+
+    run_at = now.timestamp() + countdown
+    pending = cache.get(NEXT_RUN_CACHE_KEY)
+    if pending is not None and now.timestamp() < pending <= run_at:
+        # A run at least as early is already waiting: scheduling another would fork the chain
+        return
+    cache.set(NEXT_RUN_CACHE_KEY, run_at, timeout=int(countdown) + 60)
+    current_app.send_task(COLLECT_TASK_NAME, countdown=countdown)
+    logger.debug('Next followup collection in %.1fs', countdown)
+
+
+@beat_init.connect
+def sync_collect_schedule(**kwargs):
+    '''
+    Align the beat entry with FOLLOWUP_SCHEDULE_MODE: a fixed FOLLOWUP_COLLECT_INTERVAL in 'interval' mode,
+    or only a FOLLOWUP_SCHEDULE_MAX_INTERVAL safety net in 'adaptive' mode, where every run schedules the next one.
+    '''
+    from django_celery_beat.models import IntervalSchedule, PeriodicTask
+
+    every = (
+        settings.FOLLOWUP_SCHEDULE_MAX_INTERVAL
+        if settings.FOLLOWUP_SCHEDULE_MODE == 'adaptive'
+        else settings.FOLLOWUP_COLLECT_INTERVAL
+    )
+    interval, _ = IntervalSchedule.objects.get_or_create(every=every, period=IntervalSchedule.SECONDS)
+    for task in PeriodicTask.objects.filter(task=COLLECT_TASK_NAME).exclude(interval=interval):
+        task.interval = interval
+        task.save()  # save() rather than update() so DatabaseScheduler notices the change
+        logger.info('Collector beat entry %s now runs every %ss', task.name, every)
@@ -1,5 +1,7 @@
+from lead import phones
 from lead.models import (Lead, LeadEvent, LeadFollowup, LeadFollowupRule,
                          LeadStatus)
+from lead.pagination import CommonPagination
 from rest_framework import serializers, status
 
 
@@ -21,7 +23,7 @@ class LeadFollowupRuleSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = LeadFollowupRule
-        fields = ('text', 'status', 'delay', 'is_enabled')
+        fields = ('text', 'status', 'delay', 'priority', 'is_enabled')
 
 
 class LeadFollowupSerializer(serializers.ModelSerializer):
@@ -40,9 +42,86 @@ class LeadEventSerializer(serializers.ModelSerializer):
         fields = ('lead', 'status', 'created_at')
 
 
+class LeadTimelineEntrySerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=('event', 'followup'))
+    id = serializers.IntegerField()
+    created_at = serializers.DateTimeField()
+    status = serializers.ChoiceField(choices=LeadStatus.choices)  # Of the event, or of the followup's rule
+    rule_id = serializers.IntegerField(required=False)  # Followups only
+    text = serializers.CharField(required=False)  # Followups only
+
+
+class LeadTimelinePageSerializer(serializers.Serializer):
+    results = LeadTimelineEntrySerializer(many=True)
+    next = serializers.CharField(allow_null=True)  # Cursor of the following page, null on the last one
+
+
 class NewLeadStatusValidator(serializers.Serializer):
     '''
     Validation of arguments for Lead's status updating
     '''
     lead_id = serializers.IntegerField(validators=[validate_lead])
     status = serializers.ChoiceField(choices=LeadStatus.choices)
+
+
+class PhoneSearchValidator(serializers.Serializer):
+    '''
+    Validation of the phone search arguments; ``q`` comes back normalized for ``mode`` and ``cursor`` decoded
+    '''
+    q = serializers.CharField(max_length=64)
+    mode = serializers.ChoiceField(choices=phones.MODES, default=phones.EXACT)
+    limit = serializers.IntegerField(
+        min_value=1,
+        max_value=CommonPagination.max_limit,
+        default=CommonPagination.default_limit
+    )
+    cursor = serializers.CharField(required=False)
+
+    def validate(self, attrs):
+        try:
+            attrs['q'] = phones.normalize(attrs['q'], attrs['mode'])
+        except ValueError as exc:
+            raise serializers.ValidationError({'q': str(exc)})
+        if 'cursor' in attrs:
+            try:
+                attrs['cursor'] = phones.decode_cursor(attrs['cursor'])
+            except ValueError:
+                raise serializers.ValidationError({'cursor': 'Invalid cursor'})
+        return attrs
+
+
+class LeadPhoneSearchPageSerializer(serializers.Serializer):
+    results = LeadSerializer(many=True)
+    next = serializers.CharField(allow_null=True)  # Cursor of the following page, null on the last one
+
+
+class ListFilterValidator(serializers.Serializer):
+    '''
+    Validation of the filters accepted by list endpoints; ``since``/``until`` bound the view's time field
+    '''
+    status = serializers.ChoiceField(choices=LeadStatus.choices, required=False)
+    lead_id = serializers.IntegerField(min_value=1, required=False)
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, attrs):
+        if 'since' in attrs and 'until' in attrs and attrs['since'] >= attrs['until']:
+            raise serializers.ValidationError('since must be earlier than until')
+        return attrs
+
+
+class ForecastValidator(serializers.Serializer):
+    '''
+    Validation of the SMS forecast arguments; ``status``/``delay`` describe an optional rule that isn't saved yet
+    '''
+    hours = serializers.IntegerField(min_value=1, max_value=7 * 24, default=24)
+    bucket = serializers.IntegerField(min_value=1, max_value=24 * 60, default=60)  # Minutes
+    status = serializers.ChoiceField(choices=LeadStatus.choices, required=False)
+    delay = serializers.IntegerField(min_value=0, max_value=32767, required=False)  # Minutes, as LeadFollowupRule.delay
+
+    def validate(self, attrs):
+        if ('status' in attrs) != ('delay' in attrs):
+            raise serializers.ValidationError('status and delay describe the proposed rule together')
+        if 'status' in attrs and LeadFollowupRule.objects.filter(status=attrs['status'], delay=attrs['delay']).exists():
+            raise serializers.ValidationError('A rule with this status and delay already exists')
+        return attrs
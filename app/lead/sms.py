@@ -0,0 +1,232 @@
+'''
+SMS gateways: the providers follow-ups are sent through, weighted, rate-limited and guarded by a circuit breaker.
+
+SMS_GATEWAYS lists the providers, each entry a dict with:
+- ``name``: unique, keys the rate limiter and breaker state;
+- ``backend``: dotted path of a Gateway subclass;
+- ``weight``: share of the traffic relative to the other gateways (1);
+- ``rate``: messages per second the account may send, across every worker (0: unlimited);
+- ``burst``: tokens the bucket holds, sent at once after a quiet period (``rate``, at least 1);
+- any other key is passed to the backend as an option.
+
+The rate limit is a token bucket per gateway in Redis (the CACHE_URL database), refilled and taken in one Lua script
+on Redis' own clock, so every worker shares it. When no gateway has a token, the script reserves the earliest one
+up to SMS_RATE_MAX_WAIT seconds ahead, and the caller comes back for it then instead of blocking a sender thread.
+
+A gateway that fails, or takes longer than SMS_GATEWAY_SLOW_SECONDS to answer, SMS_BREAKER_FAILURES times within
+SMS_BREAKER_WINDOW seconds is left out for SMS_BREAKER_COOLDOWN seconds and its traffic goes to the others.
+If every gateway is out, all of them are used anyway: a message sent late beats no message.
+'''
+import logging
+import random
+from dataclasses import dataclass, field
+from time import monotonic, sleep
+from typing import Any, Dict, List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+
+from app import tracing
+
+logger = logging.getLogger('app')
+
+BUCKET_KEY = 'sms:bucket:{}'
+FAILURES_CACHE_KEY = 'sms:breaker:{}:failures'
+OPEN_CACHE_KEY = 'sms:breaker:{}:open'
+
+# KEYS: buckets in order of preference. ARGV: reserve (0/1), max wait, then rate and burst of each bucket.
+# Returns {1-based index of the bucket taken from or 0, seconds until its token (or until a retry) as a string}.
+_TAKE_TOKEN = '''
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local max_wait = tonumber(ARGV[2])
+local buckets = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[1 + 2 * i])
+    local burst = tonumber(ARGV[2 + 2 * i])
+    local state = redis.call('HMGET', key, 'tokens', 'at')
+    local tokens = tonumber(state[1]) or burst
+    local at = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(now - at, 0) * rate)
+    buckets[i] = {key, rate, burst, tokens}
+end
+
+local function take(i, tokens)
+    local key, rate, burst = buckets[i][1], buckets[i][2], buckets[i][3]
+    redis.call('HSET', key, 'tokens', tokens, 'at', now)
+    -- A bucket left alone long enough is full again, which is what a missing key reads as
+    redis.call('EXPIRE', key, math.ceil((burst - tokens) / rate) + 1)
+end
+
+for i, bucket in ipairs(buckets) do
+    if bucket[4] >= 1 then
+        take(i, bucket[4] - 1)
+        return {i, '0'}
+    end
+end
+
+local best, best_wait = 0, nil
+for i, bucket in ipairs(buckets) do
+    local wait = (1 - bucket[4]) / bucket[2]
+    if best_wait == nil or wait < best_wait then
+        best, best_wait = i, wait
+    end
+end
+if ARGV[1] == '1' and best_wait <= max_wait then
+    take(best, buckets[best][4] - 1)  -- Negative: the tokens already promised to earlier callers
+    return {best, tostring(best_wait)}
+end
+-- Reservations run max_wait ahead already: come back when there is room for one more
+return {0, tostring(math.max(best_wait - max_wait, 0))}
+'''
+
+
+@dataclass
+class Gateway:
+    '''An SMS provider. Subclasses implement send() and raise on failure.'''
+    name: str
+    weight: float = 1
+    rate: float = 0
+    burst: float | None = None
+    options: Dict[str, Any] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.burst is None:
+            self.burst = max(self.rate, 1)
+
+    def send(self, phone: str, text: str):
+        raise NotImplementedError
+
+
+class StubGateway(Gateway):
+    '''
+    Sends nothing: waits ``delay`` seconds (SMS_SEND_DELAY by default) and logs the message.
+    With ``failure_rate`` it fails that share of the sends, to try the circuit breaker locally.
+    '''
+
+    def send(self, phone: str, text: str):
+        sleep(self.options.get('delay', settings.SMS_SEND_DELAY))
+        if random.random() < self.options.get('failure_rate', 0):
+            raise ConnectionError(f'{self.name} refused the message')
+        logger.debug(f'[===================== {self.name}: {phone}: {text} =====================]')
+
+
+_registry: Tuple[Any, Dict[str, Gateway]] | None = None
+
+
+def gateways() -> Dict[str, Gateway]:
+    '''The gateways of SMS_GATEWAYS by name, built once per value of the setting.'''
+    global _registry
+    config = settings.SMS_GATEWAYS
+    if _registry is None or _registry[0] is not config:
+        built = {}
+        for entry in config:
+            options = dict(entry)
+            backend = import_string(options.pop('backend'))
+            name = options.pop('name')
+            fields = {key: options.pop(key) for key in ('weight', 'rate', 'burst') if key in options}
+            built[name] = backend(name=name, options=options, **fields)
+        _registry = (config, built)
+    return _registry[1]
+
+
+def total_rate() -> float | None:
+    '''Messages per second all gateways together may send, or None if any of them is unlimited.'''
+    rates = [gateway.rate for gateway in gateways().values()]
+    if not rates or not all(rates):
+        return None
+    return sum(rates)
+
+
+def is_open(candidates: List[Gateway]) -> Dict[str, bool]:
+    '''Whether the breaker of each gateway is open, by name.'''
+    opened = cache.get_many([OPEN_CACHE_KEY.format(gateway.name) for gateway in candidates])
+    return {gateway.name: OPEN_CACHE_KEY.format(gateway.name) in opened for gateway in candidates}
+
+
+def record_failure(gateway: Gateway):
+    key = FAILURES_CACHE_KEY.format(gateway.name)
+    cache.add(key, 0, timeout=settings.SMS_BREAKER_WINDOW)  # The window starts with its first failure
+    try:
+        failures = cache.incr(key)
+    except ValueError:
+        return  # The window just ran out
+    if failures >= settings.SMS_BREAKER_FAILURES:
+        logger.warning(
+            'SMS gateway %s failed %s times within %ss, leaving it out for %ss',
+            gateway.name,
+            failures,
+            settings.SMS_BREAKER_WINDOW,
+            settings.SMS_BREAKER_COOLDOWN
+        )
+        cache.set(OPEN_CACHE_KEY.format(gateway.name), 1, timeout=settings.SMS_BREAKER_COOLDOWN)
+        cache.delete(key)
+
+
+def _weighted_order(candidates: List[Gateway]) -> List[Gateway]:
+    # Weighted sampling without replacement (Efraimidis-Spirakis): the first is picked in proportion to its weight
+    return sorted(candidates, key=lambda gateway: random.random() ** (1 / gateway.weight), reverse=True)
+
+
+def _take_token(order: List[Gateway], reserve: bool) -> Tuple[Gateway | None, float]:
+    arguments = ['1' if reserve else '0', settings.SMS_RATE_MAX_WAIT]
+    for gateway in order:
+        arguments.extend((gateway.rate, gateway.burst))
+    index, wait = get_redis_connection('default').eval(
+        _TAKE_TOKEN,
+        len(order),
+        *[BUCKET_KEY.format(gateway.name) for gateway in order],
+        *arguments
+    )
+    return (order[index - 1] if index else None), float(wait)
+
+
+def acquire(exclude: Gateway | None = None) -> Tuple[Gateway | None, float]:
+    '''
+    Pick a gateway for one SMS and take a token from its bucket, passing over ``exclude`` (one that just failed
+    the message) unless it is the only gateway. Returns:
+    - (gateway, 0): send through it now;
+    - (gateway, wait): a token of the gateway is reserved ``wait`` seconds from now, send through it then;
+    - (None, wait): every bucket is drained and reserved ahead, try again in ``wait`` seconds.
+    '''
+    available = [gateway for gateway in gateways().values() if gateway is not exclude] or list(gateways().values())
+    opened = is_open(available)
+    closed = [gateway for gateway in available if not opened[gateway.name]]
+    order = _weighted_order(closed or available)
+
+    # An unlimited gateway always has a token: the ones preferred over it are tried, but none is waited for
+    limited = []
+    for gateway in order:
+        if not gateway.rate:
+            break
+        limited.append(gateway)
+    if not limited:
+        return order[0], 0
+    unlimited = order[len(limited)] if len(limited) < len(order) else None
+    try:
+        gateway, wait = _take_token(limited, reserve=unlimited is None)
+    except Exception:
+        # Fail open: the providers' own quotas still apply, a throttled send fails and trips the breaker
+        logger.warning('Unable to reach the SMS rate limiter, sending without it', exc_info=True)
+        return order[0], 0
+    if gateway is None and unlimited is not None:
+        return unlimited, 0
+    return gateway, wait
+
+
+def send(gateway: Gateway, phone: str, text: str):
+    '''Send through ``gateway``; a failure or a slow answer counts against its breaker, and failures are re-raised.'''
+    started = monotonic()
+    # No phone number on the span: traces are exported as they are, and the parent span carries the lead id
+    with tracing.start_span('sms.send', gateway=gateway.name):
+        try:
+            gateway.send(phone, text)
+        except Exception:
+            record_failure(gateway)
+            raise
+    elapsed = monotonic() - started
+    if elapsed > settings.SMS_GATEWAY_SLOW_SECONDS:
+        logger.info('SMS gateway %s took %.1fs to answer', gateway.name, elapsed)
+        record_failure(gateway)
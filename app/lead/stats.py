@@ -0,0 +1,248 @@
+'''
+Funnel and time-in-status statistics kept in summary tables.
+
+LeadEventCreateView calls record_transition() inside its transaction, so the counters move together with the
+status and never need a GROUP BY over lead_leadevent to be read. Each counter is spread over
+STATS_COUNTER_SLOTS rows, picked at random, so concurrent transitions rarely wait on the same row lock.
+Readers sum the slots. ``manage.py rebuild_lead_stats`` recomputes both tables from the event history.
+'''
+import random
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Exists, F, Max, OuterRef, Q, Sum
+from lead.models import (LeadEvent, LeadStatus, LeadStatusDurationStat,
+                         LeadTransitionStat)
+
+from app.replicas import replica_reads
+
+STATS_CACHE_KEY = 'lead:stats'
+# Upper bounds (seconds) of the time-in-status buckets; one more bucket holds everything longer
+DURATION_BUCKETS = (60, 300, 900, 3600, 4 * 3600, 86400, 3 * 86400, 7 * 86400, 30 * 86400)
+
+Transitions = Counter  # (from_status, to_status) -> count
+Durations = Dict[Tuple[str, int], list]  # (status, bucket) -> [count, total_seconds]
+
+
+def _increment(model, keys: Dict[str, Any], **deltas):
+    increments = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**keys).update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**increments)  # Another transaction created the row first
+
+
+def status_entered_at(lead, status):
+    '''
+    ``created_at`` of the first event of the lead's current run of ``status``, as a one-column queryset (``lead`` and
+    ``status`` may be OuterRefs). Events that repeat the status don't restart the clock: the run starts with the
+    earliest event after the last one with another status, as in aggregate_events().
+    '''
+    changed_since = LeadEvent.objects.filter(
+        lead=OuterRef('lead')
+    ).exclude(
+        status=OuterRef('status')
+    ).filter(
+        Q(created_at__gt=OuterRef('created_at')) | Q(created_at=OuterRef('created_at'), id__gt=OuterRef('id'))
+    )
+    return LeadEvent.objects.filter(lead=lead, status=status).exclude(
+        Exists(changed_since)
+    ).order_by('created_at', 'id').values('created_at')
+
+
+def record_transition(from_status: str, to_status: str, entered_at: datetime | None, left_at: datetime):
+    '''
+    Count one transition and the time spent in ``from_status``; call inside the transaction that changes the status.
+    ``entered_at`` is None when the lead has no events yet: the transition counts, its duration is unknown.
+    '''
+    record_transitions([(from_status, to_status, entered_at, left_at)])
+
+
+def record_transitions(changes: Iterable[Tuple[str, str, datetime | None, datetime]]):
+    '''record_transition() for many leads, with one counter update per distinct key.'''
+    transitions: Transitions = Counter()
+    durations: Durations = {}
+    for from_status, to_status, entered_at, left_at in changes:
+        transitions[from_status, to_status] += 1
+        if entered_at is None:
+            continue
+        seconds = max((left_at - entered_at).total_seconds(), 0)
+        bucket = durations.setdefault((from_status, bisect_left(DURATION_BUCKETS, seconds)), [0, 0.0])
+        bucket[0] += 1
+        bucket[1] += seconds
+
+    slot = random.randrange(settings.STATS_COUNTER_SLOTS)
+    for (from_status, to_status), count in transitions.items():
+        _increment(LeadTransitionStat, {'from_status': from_status, 'to_status': to_status, 'slot': slot}, count=count)
+    for (status, bucket), (count, seconds) in durations.items():
+        _increment(
+            LeadStatusDurationStat,
+            {'status': status, 'bucket': bucket, 'slot': slot},
+            count=count,
+            total_seconds=seconds
+        )
+
+
+def aggregate_events(events) -> Tuple[Transitions, Durations]:
+    '''
+    Count the transitions found in a LeadEvent queryset that holds whole lead histories.
+    The first event of a lead is counted as a transition out of NEW, without a duration: leads don't record when they were created.
+    '''
+    rows = events.order_by('lead_id', 'created_at', 'id').values_list('lead_id', 'status', 'created_at')
+
+    transitions: Transitions = Counter()
+    durations: Durations = {}
+    current_lead = run_status = run_started_at = None
+    for lead_id, status, created_at in rows.iterator(chunk_size=10_000):
+        if lead_id != current_lead:
+            current_lead, run_status, run_started_at = lead_id, status, created_at
+            if status != LeadStatus.NEW:
+                transitions[LeadStatus.NEW, status] += 1
+            continue
+        if status == run_status:
+            continue  # Repeated status, nothing changed: the time in it still runs from the first event of the run
+        transitions[run_status, status] += 1
+        seconds = max((created_at - run_started_at).total_seconds(), 0)
+        bucket = durations.setdefault((run_status, bisect_left(DURATION_BUCKETS, seconds)), [0, 0.0])
+        bucket[0] += 1
+        bucket[1] += seconds
+        run_status, run_started_at = status, created_at
+    return transitions, durations
+
+
+def _add(total: Tuple[Transitions, Durations], part: Tuple[Transitions, Durations], sign: int = 1):
+    transitions, durations = total
+    for key, count in part[0].items():
+        transitions[key] += sign * count
+    for key, (count, seconds) in part[1].items():
+        bucket = durations.setdefault(key, [0, 0.0])
+        bucket[0] += sign * count
+        bucket[1] += sign * seconds
+
+
+def _history(lead_ids: Tuple[int, int], cutoff: int):
+    '''Events up to ``cutoff`` of the leads in the inclusive id range ``lead_ids``.'''
+    return LeadEvent.objects.filter(lead_id__gte=lead_ids[0], lead_id__lte=lead_ids[1], id__lte=cutoff)
+
+
+def _aggregate_leads_in_thread(lead_ids: Tuple[int, int], cutoff: int) -> Tuple[Transitions, Durations]:
+    try:
+        return aggregate_events(_history(lead_ids, cutoff))
+    finally:
+        connection.close()  # The worker thread would otherwise leak its connection
+
+
+def rebuild(workers: int = 4, batch_size: int = 10_000) -> Tuple[Transitions, Durations]:
+    '''
+    Recompute both tables from the event history and swap them in.
+    Lead id ranges are aggregated in parallel up to the last event id seen at the start. Only the leads that got
+    events after it are recounted while the tables are locked, so live transitions wait for that part alone.
+    '''
+    cutoff = LeadEvent.objects.aggregate(last=Max('id'))['last'] or 0
+    last_lead = LeadEvent.objects.aggregate(last=Max('lead_id'))['last'] or 0
+    ranges = [(start, start + batch_size - 1) for start in range(0, last_lead + 1, batch_size)]
+    total: Tuple[Transitions, Durations] = (Counter(), {})
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for part in executor.map(lambda lead_ids: _aggregate_leads_in_thread(lead_ids, cutoff), ranges):
+                _add(total, part)
+    else:
+        for lead_ids in ranges:
+            _add(total, aggregate_events(_history(lead_ids, cutoff)))
+
+    with transaction.atomic():
+        lock_tables()
+        tail = LeadEvent.objects.filter(
+            lead_id__in=LeadEvent.objects.filter(id__gt=cutoff).values('lead_id')
+        )
+        _add(total, aggregate_events(tail.filter(id__lte=cutoff)), sign=-1)
+        _add(total, aggregate_events(tail))
+        transitions, durations = total
+        transitions = Counter({key: count for key, count in transitions.items() if count})
+        durations = {key: bucket for key, bucket in durations.items() if bucket[0]}
+        replace_all(transitions, durations)
+    return transitions, durations
+
+
+def replace_all(transitions: Transitions, durations: Durations):
+    '''Swap in rebuilt counters; call inside a transaction.'''
+    LeadTransitionStat.objects.all().delete()
+    LeadStatusDurationStat.objects.all().delete()
+    LeadTransitionStat.objects.bulk_create(
+        LeadTransitionStat(from_status=from_status, to_status=to_status, count=count)
+        for (from_status, to_status), count in transitions.items()
+    )
+    LeadStatusDurationStat.objects.bulk_create(
+        LeadStatusDurationStat(status=status, bucket=bucket, count=count, total_seconds=seconds)
+        for (status, bucket), (count, seconds) in durations.items()
+    )
+    cache.delete(STATS_CACHE_KEY)
+
+
+def lock_tables():
+    '''Hold off record_transition() until the surrounding transaction ends (PostgreSQL only).'''
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'LOCK TABLE {LeadTransitionStat._meta.db_table}, {LeadStatusDurationStat._meta.db_table} IN EXCLUSIVE MODE'
+            )
+
+
+def _compute() -> Dict[str, Any]:
+    transitions = LeadTransitionStat.objects.values('from_status', 'to_status').annotate(total=Sum('count'))
+    durations = LeadStatusDurationStat.objects.values('status', 'bucket').annotate(
+        total=Sum('count'),
+        seconds=Sum('total_seconds')
+    )
+
+    statuses = {
+        status: {'exited': 0, 'conversion': {}, 'time_in_status': {'mean_seconds': None, 'buckets': []}}
+        for status in LeadStatus.values
+    }
+    for row in transitions:
+        statuses[row['from_status']]['exited'] += row['total']
+        statuses[row['from_status']]['conversion'][row['to_status']] = row['total']
+    for summary in statuses.values():
+        # Share of the leads that left the status going to each next one
+        summary['conversion'] = {
+            to_status: round(count / summary['exited'], 4) for to_status, count in summary['conversion'].items()
+        }
+
+    counts: Dict[str, list] = {status: [0] * (len(DURATION_BUCKETS) + 1) for status in LeadStatus.values}
+    seconds: Counter = Counter()
+    for row in durations:
+        counts[row['status']][row['bucket']] = row['total']
+        seconds[row['status']] += row['seconds']
+    for status, bucket_counts in counts.items():
+        histogram = statuses[status]['time_in_status']
+        histogram['buckets'] = [
+            {'le': bound, 'count': count}
+            for bound, count in zip((*DURATION_BUCKETS, None), bucket_counts)
+        ]
+        if sum(bucket_counts):
+            histogram['mean_seconds'] = round(seconds[status] / sum(bucket_counts), 1)
+
+    return {
+        'transitions': [
+            {'from': row['from_status'], 'to': row['to_status'], 'count': row['total']} for row in transitions
+        ],
+        'statuses': statuses,
+    }
+
+
+def _compute_on_replica() -> Dict[str, Any]:
+    with replica_reads():
+        return _compute()
+
+
+def get_stats() -> Dict[str, Any]:
+    return cache.get_or_set(STATS_CACHE_KEY, _compute_on_replica, timeout=settings.STATS_CACHE_TIMEOUT)
@@ -1,40 +1,82 @@
+import heapq
 import logging
-from datetime import timedelta
-from time import sleep
-from typing import List, Tuple
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Tuple
 
-from celery import shared_task
+from celery import group, shared_task
 from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.db.models import (DurationField, Exists, ExpressionWrapper, F,
-                              OuterRef, Q, Value)
+                              Max, Min, OuterRef, Q, Value)
 from django.db.models.functions import Now
 from django.utils import timezone
-from lead import models
+from django_redis import get_redis_connection
+from lead import lanes, live, models, scheduling, sms
 
+from app import tracing
 from app.lockers import singleton_task
 
 logger = logging.getLogger('app')
 
 FOLLOWUP_REPEAT_THRESHOLD = timedelta(minutes=settings.FOLLOWUP_REPEAT_THRESHOLD)
+# Redis hash of the sends in flight: one field per sender process, "<count> <expires at>", rewritten on every change.
+# A process that dies leaves a field that stops counting once it expires instead of a counter that never goes down
+IN_FLIGHT_KEY = 'lead:followups:in_flight'
+IN_FLIGHT_TTL = 60  # Seconds; well above a normal send, a process idle for longer has nothing in flight anyway
+COLLECT_TASK_NAME = scheduling.COLLECT_TASK_NAME
+# A pair being sent is reserved in the cache, so redelivered or overlapping sends of it skip it meanwhile
+SENDING_CACHE_KEY = 'lead:followup:sending:{}:{}'
+SENDING_TTL = 600  # Seconds; far above a gateway's answer time, it only runs out for a sender that died mid-send
 
+Shard = Tuple[int, int]  # (index, count): names the shard's lock and watermarks
+IdRange = Tuple[int | None, int | None]  # Lead ids low <= id < high owned by a shard, None for an open end
+WHOLE_LEAD_SPACE: Shard = (0, 1)
+ALL_LEAD_IDS: IdRange = (None, None)
 
-def send_sms(phone: str, text: str):
-    '''Sends an SMS to a phone number'''
-    sleep(3)
-    logger.debug(f'[===================== send_sms: {phone}: {text} =====================]')
 
+def shard_id_ranges(shard_count: int) -> List[IdRange]:
+    '''
+    Split the current lead ids into ``shard_count`` contiguous ranges of equal width, one per shard.
+    The first and the last range are open-ended, so leads created during the tick still land in a shard.
+    '''
+    bounds = models.Lead.objects.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return [ALL_LEAD_IDS] + [(0, 0)] * (shard_count - 1)
+    width = -(-(bounds['high'] - bounds['low'] + 1) // shard_count)
+    cuts = [bounds['low'] + width * index for index in range(1, shard_count)]
+    return list(zip([None, *cuts], [*cuts, None]))
 
-def _collect_simple_followups() -> List[Tuple[int, int]]:
-    '''Find leads stalled in a status beyond rule delays and enqueue followups.'''
+
+def _in_id_range(leads, id_range: IdRange):
+    # A range of ids, unlike id % count, is something the primary key index can serve
+    low, high = id_range
+    if low is not None:
+        leads = leads.filter(id__gte=low)
+    if high is not None:
+        leads = leads.filter(id__lt=high)
+    return leads
+
+
+def _recent_followup_guard(repeat_cutoff: datetime) -> Q:
+    return Q(created_at__gte=OuterRef('updated_at')) & Q(created_at__gte=repeat_cutoff)
+
+
+def _eligible_rules(repeat_cutoff: datetime, id_range: IdRange = ALL_LEAD_IDS):
+    '''Rules that are currently active and have at least one matching lead in ``id_range``, as (id, status, delay_interval).'''
     # Translate rule.delay minutes into a database-level timedelta for filtering
     # Can't use timedelta(minutes=F('delay')): F('delay') is a database reference, while timedelta expects a plain number :(
     delay_interval = ExpressionWrapper(F('delay') * Value(timedelta(minutes=1)), output_field=DurationField())
-    repeat_cutoff = timezone.now() - FOLLOWUP_REPEAT_THRESHOLD
-    recent_followup_guard = Q(created_at__gte=OuterRef('updated_at')) & Q(created_at__gte=repeat_cutoff)
 
     # Build a subquery that returns ids of leads whose updated_at exceeds the rule delay
     # and that have not already received a follow-up for the same rule since the last status change
-    lead_candidates = models.Lead.objects.annotate(
+    lead_candidates = _in_id_range(models.Lead.objects.all(), id_range).annotate(
         elapsed=ExpressionWrapper(
             Now() - F('updated_at'),
             output_field=DurationField()
@@ -47,13 +89,11 @@ def _collect_simple_followups() -> List[Tuple[int, int]]:
             models.LeadFollowup.objects.filter(
                 lead_id=OuterRef('id'),
                 rule_id=OuterRef('pk')
-            ).filter(recent_followup_guard)
+            ).filter(_recent_followup_guard(repeat_cutoff))
         )
     ).values_list('id', flat=True)
 
-    payload: List[Tuple[int, int]] = []  # Accumulate (lead_id, rule_id) pairs for Celery starmap
-    # Iterate over rules that are currently active and have at least one matching lead
-    eligible_rules = models.LeadFollowupRule.objects.filter(
+    return models.LeadFollowupRule.objects.filter(
         is_enabled=True
     ).annotate(
         delay_interval=delay_interval
@@ -61,60 +101,428 @@ def _collect_simple_followups() -> List[Tuple[int, int]]:
         Exists(lead_candidates)  # Keep only rules that actually have pending leads
     ).values_list('id', 'status', 'delay_interval')
 
-    for rule_id, status, delay_span in eligible_rules:
-        # Recompute stalled leads with the resolved delay to avoid reusing an outdated annotated value
-        stalled_leads = models.Lead.objects.annotate(
-            elapsed=ExpressionWrapper(
-                Now() - F('updated_at'),
-                output_field=DurationField()
-            )
-        ).filter(
-            status=status,
-            elapsed__gte=delay_span
-        ).exclude(
-            Exists(
-                models.LeadFollowup.objects.filter(
-                    lead_id=OuterRef('id'),
-                    rule_id=rule_id
-                ).filter(recent_followup_guard)
+
+def _overdue_leads(
+    status: str,
+    delay_span: timedelta,
+    id_range: IdRange = ALL_LEAD_IDS,
+    lead_ids: List[int] | None = None
+):
+    '''Leads of ``status`` in ``id_range`` (and ``lead_ids``, if given) that have stayed in it for ``delay_span`` or longer.'''
+    leads = models.Lead.objects.all()
+    if lead_ids is not None:
+        leads = leads.filter(pk__in=lead_ids)
+    leads = _in_id_range(leads, id_range)
+    # Recompute stalled leads with the resolved delay to avoid reusing an outdated annotated value
+    return leads.annotate(
+        elapsed=ExpressionWrapper(
+            Now() - F('updated_at'),
+            output_field=DurationField()
+        )
+    ).filter(
+        status=status,
+        elapsed__gte=delay_span
+    )
+
+
+def _recently_followed_up(rule_id: int, repeat_cutoff: datetime) -> Exists:
+    '''Whether the outer lead got the rule's followup since its last status change and within the repeat threshold.'''
+    return Exists(
+        models.LeadFollowup.objects.filter(
+            lead_id=OuterRef('id'),
+            rule_id=rule_id
+        ).filter(_recent_followup_guard(repeat_cutoff))
+    )
+
+
+def _stalled_leads(
+    rule_id: int,
+    status: str,
+    delay_span: timedelta,
+    repeat_cutoff: datetime,
+    id_range: IdRange = ALL_LEAD_IDS,
+    lead_ids: List[int] | None = None
+):
+    '''Leads of ``status`` in ``id_range`` (and ``lead_ids``, if given) overdue for the rule, oldest first, as (id, updated_at).'''
+    return _overdue_leads(status, delay_span, id_range, lead_ids).exclude(
+        _recently_followed_up(rule_id, repeat_cutoff)
+    ).order_by('updated_at', 'id').values_list('id', 'updated_at')
+
+
+def _collect_simple_followups(
+    limit: int | None = None,
+    id_range: IdRange = ALL_LEAD_IDS,
+    lead_ids: List[int] | None = None
+) -> List[Tuple[int, int]]:
+    '''
+    Find leads stalled in a status beyond rule delays and enqueue followups.
+    Pairs come back oldest-overdue first; with ``limit`` only that many of the most overdue are returned.
+    '''
+    repeat_cutoff = timezone.now() - FOLLOWUP_REPEAT_THRESHOLD
+    candidates: List[Tuple[datetime, int, int]] = []  # Accumulate (due_at, lead_id, rule_id) to hand out the most overdue pairs first
+
+    for rule_id, status, delay_span in _eligible_rules(repeat_cutoff, id_range):
+        stalled_leads = _stalled_leads(rule_id, status, delay_span, repeat_cutoff, id_range, lead_ids)
+        if limit is not None:
+            stalled_leads = stalled_leads[:limit]  # No rule can contribute more than the whole budget
+
+        candidates.extend((updated_at + delay_span, lead_id, rule_id) for lead_id, updated_at in stalled_leads)
+
+    # Most overdue first, so a capped tick never starves the leads that have waited longest
+    candidates.sort()
+    if limit is not None:
+        candidates = candidates[:limit]
+    return [(lead_id, rule_id) for _, lead_id, rule_id in candidates]
+
+
+def _rule_stream(stalled_leads, rule_id: int, delay_span: timedelta) -> Iterator[Tuple[datetime, int, int, datetime]]:
+    for lead_id, updated_at in stalled_leads.iterator(chunk_size=settings.FOLLOWUP_STREAM_CHUNK_SIZE):
+        yield updated_at + delay_span, lead_id, rule_id, updated_at
+
+
+def _save_watermarks(progress: Dict[int, Tuple[datetime, int]], shard: Shard):
+    shard_index, shard_count = shard
+    for rule_id, (updated_at, lead_id) in progress.items():
+        models.FollowupCollectorWatermark.objects.update_or_create(
+            rule_id=rule_id,
+            shard_index=shard_index,
+            shard_count=shard_count,
+            defaults={'last_updated_at': updated_at, 'last_lead_id': lead_id}
+        )
+
+
+def _stream_simple_followups(
+    limit: int,
+    enqueue: Callable[[List[Tuple[int, int]]], None],
+    shard: Shard = WHOLE_LEAD_SPACE,
+    id_range: IdRange = ALL_LEAD_IDS
+) -> int:
+    '''
+    Memory-bounded variant of _collect_simple_followups for very large overdue sets.
+    Every rule is read through its own server-side cursor, the cursors are merged oldest-overdue first,
+    and each chunk is enqueued as soon as it fills up. After every chunk the per-rule keyset position is
+    saved (per shard), so a run that is interrupted or stopped by ``limit`` continues from there on the next tick.
+    Returns the number of enqueued pairs.
+    '''
+    repeat_cutoff = timezone.now() - FOLLOWUP_REPEAT_THRESHOLD
+    chunk_size = settings.FOLLOWUP_STREAM_CHUNK_SIZE
+    shard_watermarks = models.FollowupCollectorWatermark.objects.filter(shard_index=shard[0], shard_count=shard[1])
+    watermarks = {watermark.rule_id: watermark for watermark in shard_watermarks}
+
+    streams = []
+    for rule_id, status, delay_span in _eligible_rules(repeat_cutoff, id_range):
+        stalled_leads = _stalled_leads(rule_id, status, delay_span, repeat_cutoff, id_range)
+        watermark = watermarks.get(rule_id)
+        if watermark is not None:
+            # Keyset continuation: skip everything up to and including the last enqueued lead
+            stalled_leads = stalled_leads.filter(
+                Q(updated_at__gt=watermark.last_updated_at)
+                | Q(updated_at=watermark.last_updated_at, id__gt=watermark.last_lead_id)
             )
-        ).values_list('id', flat=True)
+        streams.append(_rule_stream(stalled_leads, rule_id, delay_span))
+
+    enqueued = 0
+    chunk: List[Tuple[int, int]] = []
+    progress: Dict[int, Tuple[datetime, int]] = {}
+    try:
+        for _, lead_id, rule_id, updated_at in heapq.merge(*streams):
+            chunk.append((lead_id, rule_id))
+            progress[rule_id] = (updated_at, lead_id)
+            enqueued += 1
+            if len(chunk) >= chunk_size or enqueued >= limit:
+                enqueue(chunk)
+                _save_watermarks(progress, shard)
+                chunk = []
+                if enqueued >= limit:
+                    return enqueued
+    finally:
+        for stream in streams:
+            stream.close()  # Release the server-side cursors of streams we stopped reading
+
+    if chunk:
+        enqueue(chunk)
+    # Every cursor ran dry, so the next run scans from the beginning again
+    shard_watermarks.delete()
+    return enqueued
+
+
+def _send_queue_depth() -> int | None:
+    '''Number of messages waiting on the send lanes, or None when the broker can't be inspected.'''
+    depths = lanes.queue_depths(settings.FOLLOWUP_SEND_LANES.values()).values()
+    return None if None in depths else sum(depths)
+
+
+def _enqueue_budget() -> int:
+    '''How many (lead, rule) pairs this tick may enqueue without pushing the backlog past the high-water mark.'''
+    depth = _send_queue_depth()
+    in_flight = _in_flight_count()
+    if depth is None:
+        # Fail open, but the per-tick cap still bounds how fast an invisible backlog can grow
+        return settings.FOLLOWUP_MAX_ENQUEUE_PER_TICK
+
+    backlog = depth * settings.FOLLOWUP_SEND_CHUNK_SIZE + in_flight
+    if backlog >= settings.FOLLOWUP_QUEUE_HIGH_WATER:
+        logger.info(
+            'Followup backlog %s (queued messages=%s, in flight=%s) is above the high-water mark %s, deferring',
+            backlog,
+            depth,
+            in_flight,
+            settings.FOLLOWUP_QUEUE_HIGH_WATER
+        )
+        return 0
+    return min(settings.FOLLOWUP_MAX_ENQUEUE_PER_TICK, settings.FOLLOWUP_QUEUE_HIGH_WATER - backlog)
 
-        payload.extend((lead_id, rule_id) for lead_id in stalled_leads)
 
-    return payload
+_in_flight = 0
+_in_flight_lock = threading.Lock()
 
 
-@shared_task(name='lead.task.task_collect_followups')
-@singleton_task('lead.task.task_collect_followups')
+def _publish_in_flight(count: int):
+    # Called under _in_flight_lock, so the process' writes land in order
+    try:
+        get_redis_connection('default').hset(
+            IN_FLIGHT_KEY,
+            f'{socket.gethostname()}:{os.getpid()}',
+            f'{count} {time.time() + IN_FLIGHT_TTL}'
+        )
+    except Exception:
+        logger.warning('Unable to publish the in-flight followup count', exc_info=True)
+
+
+def _in_flight_count() -> int:
+    '''Sends in flight across every live sender process; 0 when Redis can't be read (backpressure fails open).'''
+    try:
+        redis = get_redis_connection('default')
+        now, total, expired = time.time(), 0, []
+        for process, value in redis.hgetall(IN_FLIGHT_KEY).items():
+            count, expires_at = value.split()
+            if float(expires_at) < now:
+                expired.append(process)
+            else:
+                total += int(count)
+        if expired:
+            redis.hdel(IN_FLIGHT_KEY, *expired)
+        return total
+    except Exception:
+        logger.warning('Unable to read the in-flight followup count', exc_info=True)
+        return 0
+
+
+@contextmanager
+def _track_in_flight():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+        _publish_in_flight(_in_flight)
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+            _publish_in_flight(_in_flight)
+
+
+@shared_task(name=COLLECT_TASK_NAME)
+@singleton_task(COLLECT_TASK_NAME, coalesce=True)  # Ticks that find a run in progress fold into one rerun
 def task_collect_followups():
     '''Find leads stalled in a status beyond rule delays and enqueue followups'''
-    payload = _collect_simple_followups()
+    budget = _enqueue_budget()
+    shard_count = settings.FOLLOWUP_COLLECTOR_SHARDS
+    saturated = False
+    if not budget:
+        saturated = True  # Backpressure deferred the work, come back soon
+    elif shard_count <= 1:
+        # Filling the whole budget means more overdue work is likely waiting behind it
+        saturated = _collect_shard(budget, WHOLE_LEAD_SPACE, ALL_LEAD_IDS) >= budget
+    else:
+        # Watermarks of a previous shard count describe other partitions: those shards rescan from the start.
+        # The ranges also shift a little as leads are added: a lead that moves into a shard behind its watermark
+        # is picked up when that shard's scan finishes and starts over
+        models.FollowupCollectorWatermark.objects.exclude(shard_count=shard_count).delete()
+        shard_budget = -(-budget // shard_count)
+        group(
+            task_collect_followups_shard.s(shard_index, shard_count, shard_budget, low, high)
+            for shard_index, (low, high) in enumerate(shard_id_ranges(shard_count))
+        ).apply_async()
+
+    if settings.FOLLOWUP_SCHEDULE_MODE == 'adaptive':
+        scheduling.schedule_next_run(saturated)
+
+
+@shared_task(name='lead.task.task_collect_followups_shard')
+@singleton_task(COLLECT_TASK_NAME + '.shard-{shard_index}-of-{shard_count}', coalesce=True)
+def task_collect_followups_shard(
+    shard_index: int,
+    shard_count: int,
+    limit: int,
+    id_low: int | None = None,
+    id_high: int | None = None
+):
+    '''Collect and enqueue followups for the leads with id_low <= id < id_high'''
+    _collect_shard(limit, (shard_index, shard_count), (id_low, id_high))
+
+
+def _collect_shard(limit: int, shard: Shard, id_range: IdRange) -> int:
+    '''Collect and enqueue at most ``limit`` pairs of the leads in ``id_range``, returning how many were enqueued.'''
+    if settings.FOLLOWUP_COLLECTOR == 'streaming':
+        return _stream_simple_followups(limit=limit, enqueue=_enqueue_followups, shard=shard, id_range=id_range)
+    if settings.FOLLOWUP_COLLECTOR == 'vectorized':
+        from lead.followup_engine import get_engine  # NumPy is only needed by this backend
+
+        now = timezone.now()
+        payload = get_engine().collect(now, now - FOLLOWUP_REPEAT_THRESHOLD, limit=limit, id_range=id_range)
+    else:
+        payload = _collect_simple_followups(limit=limit, id_range=id_range)
+    if payload:
+        _enqueue_followups(payload)
+    return len(payload)
+
+
+@shared_task(name='lead.task.task_collect_lead_followups')
+def task_collect_lead_followups(lead_ids: List[int]):
+    '''Collect and enqueue followups for the given leads only, as woken up by listen_followup_wakeups'''
+    budget = _enqueue_budget()
+    if not budget:
+        return  # The regular collector picks these up once the backlog drains
+    payload = _collect_simple_followups(limit=budget, lead_ids=lead_ids)
     if payload:
-        # More convenient than delay for every task
-        task_send_followup.starmap(payload).apply_async()
+        _enqueue_followups(payload)
+
+
+def _enqueue_followups(payload: List[Tuple[int, int]]):
+    # Every pair goes to the lane of its rule, in the collector's order within the lane
+    priorities = dict(models.LeadFollowupRule.objects.filter(
+        pk__in={rule_id for _, rule_id in payload}
+    ).values_list('id', 'priority'))
+    by_lane: Dict[str, List[Tuple[int, int]]] = {}
+    for lead_id, rule_id in payload:
+        by_lane.setdefault(priorities.get(rule_id, models.FollowupPriority.NORMAL), []).append((lead_id, rule_id))
+
+    for priority, pairs in by_lane.items():
+        # Chunks travel as celery.starmap messages, which task_routes can't tell apart, so name the queue explicitly
+        task_send_followup.chunks(
+            pairs,
+            settings.FOLLOWUP_SEND_CHUNK_SIZE
+        ).apply_async(queue=lanes.queue_for(priority), serializer=settings.FOLLOWUP_SEND_SERIALIZER)
 
 
 @shared_task(name='lead.task.task_send_followup')
-def task_send_followup(lead_id: int, rule_id: int):
-    '''Sends a followup to a lead'''
+def task_send_followup(lead_id: int, rule_id: int, gateway: str | None = None, attempt: int = 0):
+    '''
+    Sends a followup to a lead, through ``gateway`` if a token of it was reserved for this send.
+    ``attempt`` counts the gateways that already failed to send it.
+    '''
     logger.debug(f'task_send_followup: {lead_id}; {rule_id}')
-    cutoff = timezone.now() - FOLLOWUP_REPEAT_THRESHOLD
-    if models.LeadFollowup.objects.filter(
-        lead_id=lead_id,
-        rule_id=rule_id,
-        created_at__gte=cutoff
-    ).exists():
-        logger.debug(
-            'Skip followup (lead=%s, rule=%s): recently sent within %s',
-            lead_id,
-            rule_id,
-            FOLLOWUP_REPEAT_THRESHOLD
-        )
-        return
+    # starmap batches call this body directly, so every pair gets its own span under the batch task span
+    with tracing.start_span('lead.send_followup', lead_id=lead_id, rule_id=rule_id), _track_in_flight():
+        _send_followup(lead_id, rule_id, gateway, attempt)
+
 
-    lead_followup_payload = models.LeadFollowup.objects.create(
-        lead_id=lead_id,
-        rule_id=rule_id
+def _send_followup_later(lead_id: int, rule_id: int, gateway: sms.Gateway | None, wait: float, attempt: int = 0):
+    '''Come back for the pair once its token is due, leaving the sender thread to pairs that can go now.'''
+    if gateway is None:
+        # Nothing reserved: spread the retries, so they don't all race for the same token
+        wait += random.uniform(0, settings.SMS_RATE_MAX_WAIT)
+    options = {'gateway': gateway.name if gateway is not None else None}
+    if attempt:
+        options['attempt'] = attempt
+    priority = models.LeadFollowupRule.objects.filter(pk=rule_id).values_list('priority', flat=True).first()
+    task_send_followup.apply_async(
+        (lead_id, rule_id),
+        options,
+        countdown=wait,
+        queue=lanes.queue_for(priority or models.FollowupPriority.NORMAL),
+        serializer=settings.FOLLOWUP_SEND_SERIALIZER
     )
-    send_sms(phone=lead_followup_payload.lead.phone, text=lead_followup_payload.rule.text)
+
+
+def _reserve_send(lead_id: int, rule_id: int) -> bool:
+    '''Claim the pair for this sender until it is recorded or released; False if another sender holds it.'''
+    try:
+        return cache.add(SENDING_CACHE_KEY.format(lead_id, rule_id), 1, timeout=SENDING_TTL)
+    except Exception:
+        # Fail open: the repeat check still stops every send but the ones racing this one
+        logger.warning('Unable to reserve followup (lead=%s, rule=%s), sending anyway', lead_id, rule_id, exc_info=True)
+        return True
+
+
+def _release_send(lead_id: int, rule_id: int):
+    try:
+        cache.delete(SENDING_CACHE_KEY.format(lead_id, rule_id))
+    except Exception:
+        logger.warning('Unable to release followup (lead=%s, rule=%s)', lead_id, rule_id, exc_info=True)
+
+
+def _send_followup(lead_id: int, rule_id: int, gateway_name: str | None = None, attempt: int = 0):
+    # Reserved before the repeat check: a sender that records the pair releases it only afterwards, so whoever
+    # gets the reservation next sees the record
+    if not _reserve_send(lead_id, rule_id):
+        logger.debug('Skip followup (lead=%s, rule=%s): another worker is sending it', lead_id, rule_id)
+        return
+    try:
+        sent = _send_reserved_followup(lead_id, rule_id, gateway_name)
+    except BaseException:
+        _release_send(lead_id, rule_id)
+        raise
+    _release_send(lead_id, rule_id)  # Before a retry is published, which may run right away
+    if sent is not None:
+        _retry_followup(lead_id, rule_id, sent, attempt)
+
+
+def _send_reserved_followup(lead_id: int, rule_id: int, gateway_name: str | None) -> sms.Gateway | None:
+    '''Send the reserved pair and record it; returns the gateway that failed the send, if it failed.'''
+    cutoff = timezone.now() - FOLLOWUP_REPEAT_THRESHOLD
+    # A short transaction for the checks only: the lead row is not locked while the gateway answers
+    with transaction.atomic():
+        lead = models.Lead.objects.filter(pk=lead_id).first()
+        if lead is None:
+            logger.debug('Skip followup (lead=%s, rule=%s): lead no longer exists', lead_id, rule_id)
+            return None
+        if models.LeadFollowup.objects.filter(
+            lead_id=lead_id,
+            rule_id=rule_id,
+            created_at__gte=cutoff
+        ).exists():
+            logger.debug(
+                'Skip followup (lead=%s, rule=%s): recently sent within %s',
+                lead_id,
+                rule_id,
+                FOLLOWUP_REPEAT_THRESHOLD
+            )
+            return None
+        rule = models.LeadFollowupRule.objects.get(pk=rule_id)
+
+    # The token is taken once the pair is known to need a send, so skipped pairs don't spend any
+    gateway = sms.gateways().get(gateway_name)
+    if gateway is None or sms.is_open([gateway])[gateway.name]:
+        gateway, wait = sms.acquire()
+        if wait:
+            _send_followup_later(lead_id, rule_id, gateway, wait)
+            return None
+
+    # Recorded only once the gateway accepted the message: a failed send leaves no record behind
+    try:
+        sms.send(gateway, phone=lead.phone, text=rule.text)
+    except Exception:
+        logger.warning('Followup (lead=%s, rule=%s) failed on %s', lead_id, rule_id, gateway.name, exc_info=True)
+        return gateway
+
+    try:
+        with transaction.atomic():
+            lead_followup_payload = models.LeadFollowup.objects.create(
+                lead_id=lead_id,
+                rule=rule
+            )
+            live.publish_on_commit(live.followup_message(lead_followup_payload, rule.status))
+    except IntegrityError:
+        logger.debug('Followup (lead=%s, rule=%s) sent, but the lead was deleted meanwhile', lead_id, rule_id)
+    return None
+
+
+def _retry_followup(lead_id: int, rule_id: int, failed: sms.Gateway, attempt: int):
+    '''Publish a failed pair again on another gateway, or leave it to the collector once the retries run out.'''
+    if attempt >= settings.SMS_SEND_RETRIES:
+        logger.warning('Followup (lead=%s, rule=%s) out of retries, leaving it to the collector', lead_id, rule_id)
+        return
+    retry_gateway, wait = sms.acquire(exclude=failed)
+    _send_followup_later(lead_id, rule_id, retry_gateway, wait, attempt + 1)
@@ -1,19 +1,67 @@
+import asyncio
+import json
+import os
 import random
+import subprocess
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import replace
 from datetime import timedelta
-from threading import Event, Thread
+from io import StringIO
+from threading import Event, Lock, Thread
+from types import SimpleNamespace
+from unittest import skipUnless
 from unittest.mock import patch
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
-from lead.models import (Lead, LeadFollowup, LeadFollowupRule, LeadStatus,
+from django_celery_beat.models import PeriodicTask
+from django_redis import get_redis_connection
+from kombu.serialization import dumps, loads, prepare_accept_content
+from lead import (collector_report, followup_engine, forecast, lanes, live,
+                  outbox, phones, scheduling, sms, stats, wakeup)
+from lead import tasks as lead_tasks
+from lead.models import (CollectorQueryPlan, FollowupCollectorWatermark,
+                         FollowupPriority, Lead, LeadEvent, LeadEventOutbox,
+                         LeadFollowup, LeadFollowupRule, LeadStatus,
+                         LeadStatusDurationStat, LeadTransitionStat,
                          TaskExecutionLock)
-from lead.tasks import task_collect_followups, task_send_followup
+from lead.pagination import EstimatedCountPaginator
+from lead.tasks import (task_collect_followups, task_collect_lead_followups,
+                        task_send_followup)
+from lead.views import (LeadEventListView, LeadFollowupListView,
+                        LeadListView)
+from rest_framework.test import APIRequestFactory
+
+from app import codec, dbpool, replicas, schema, tracing
+from app.celery import app as celery_app
+from app.lockers import lock_stats, singleton_task
 
 
 def _get_random_phone_number() -> str:
     return f'+{str(random.randint(10_000_000, 99_999_999))}'
 
 
+class _CollectingExporter:
+    '''Keeps exported spans in memory so tests can inspect them.'''
+
+    spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
 class CollectFollowupsTaskTest(TestCase):
 
     # Enables Celery's eager mode: tasks launched via task.delay() are executed immediately
@@ -86,7 +134,7 @@ class CollectFollowupsTaskTest(TestCase):
         second_entered_event = Event()
         call_counter = {'value': 0}
 
-        def blocking_collect():
+        def blocking_collect(*args, **kwargs):
             call_counter['value'] += 1
             if call_counter['value'] == 1:
                 entered_event.set()
@@ -95,7 +143,8 @@ class CollectFollowupsTaskTest(TestCase):
                 second_entered_event.set()  # The contender should only reach here after the lock is released
             return []
 
-        with patch('lead.tasks._collect_simple_followups', side_effect=blocking_collect):
+        with patch('lead.tasks._collect_simple_followups', side_effect=blocking_collect), \
+                patch('lead.tasks._send_queue_depth', return_value=0):
             worker = Thread(target=task_collect_followups)
             contender = None
             worker.start()
@@ -120,3 +169,1368 @@ class CollectFollowupsTaskTest(TestCase):
         lock = TaskExecutionLock.objects.get(name='lead.task.task_collect_followups')
         self.assertIsNone(lock.locked_at)
         print(f'TaskExecutionLock used for blocking: id={lock.id}, name={lock.name}')
+
+
+class CollectFollowupsBackpressureTest(TestCase):
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, FOLLOWUP_QUEUE_HIGH_WATER=100)
+    def test_high_water_mark_defers_enqueue(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        Lead.objects.filter(pk=lead.pk).update(updated_at=timezone.now() - timedelta(minutes=2))
+
+        # The send queue already holds more than the high-water mark
+        with patch('lead.tasks._send_queue_depth', return_value=100):
+            task_collect_followups.delay().get(timeout=2)
+
+        self.assertFalse(LeadFollowup.objects.filter(lead=lead, rule=rule).exists())
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, FOLLOWUP_MAX_ENQUEUE_PER_TICK=1)
+    def test_capped_tick_sends_most_overdue_first(self):
+        now = timezone.now()
+        rule_new = LeadFollowupRule.objects.create(text='new', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        rule_verified = LeadFollowupRule.objects.create(text='verified', status=LeadStatus.VERIFIED, delay=30, is_enabled=True)
+        recent = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        oldest = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.VERIFIED)
+        Lead.objects.filter(pk=recent.pk).update(updated_at=now - timedelta(minutes=10))  # Due 9 minutes ago
+        Lead.objects.filter(pk=oldest.pk).update(updated_at=now - timedelta(minutes=60))  # Due 30 minutes ago
+
+        with patch('lead.tasks._send_queue_depth', return_value=0), patch('lead.sms.sleep'):
+            task_collect_followups.delay().get(timeout=2)
+            self.assertEqual(
+                list(LeadFollowup.objects.values_list('lead_id', 'rule_id')),
+                [(oldest.id, rule_verified.id)]
+            )
+
+            # The deferred pair goes out on the next tick
+            task_collect_followups.delay().get(timeout=2)
+            self.assertTrue(LeadFollowup.objects.filter(lead=recent, rule=rule_new).exists())
+
+    def test_in_flight_entries_of_dead_processes_expire(self):
+        redis = get_redis_connection('default')
+        redis.delete(lead_tasks.IN_FLIGHT_KEY)
+        redis.hset(lead_tasks.IN_FLIGHT_KEY, mapping={
+            'live:1': f'3 {time.time() + 30}',
+            'killed:2': f'50 {time.time() - 1}',  # Never got to decrement
+        })
+        with lead_tasks._track_in_flight():
+            self.assertEqual(lead_tasks._in_flight_count(), 4)
+
+        self.assertEqual(lead_tasks._in_flight_count(), 3)
+        self.assertFalse(redis.hexists(lead_tasks.IN_FLIGHT_KEY, 'killed:2'))
+        redis.delete(lead_tasks.IN_FLIGHT_KEY)
+
+    def test_send_survives_a_redis_outage(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+
+        with patch('lead.tasks.get_redis_connection', side_effect=ConnectionError('down')), \
+                patch('lead.sms.sleep'), self.assertLogs('app', level='WARNING'):
+            task_send_followup(lead.id, rule.id)
+            self.assertEqual(lead_tasks._in_flight_count(), 0)  # Fails open
+
+        self.assertTrue(LeadFollowup.objects.filter(lead=lead, rule=rule).exists())
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CELERY_TASK_EAGER_PROPAGATES=True,
+    FOLLOWUP_COLLECTOR='streaming',
+    FOLLOWUP_STREAM_CHUNK_SIZE=2
+)
+class StreamingCollectFollowupsTest(TestCase):
+
+    def _overdue_leads(self, count: int, rule: LeadFollowupRule):
+        leads = []
+        for minutes_ago in range(count + 1, 1, -1):
+            lead = Lead.objects.create(phone=_get_random_phone_number(), status=rule.status)
+            Lead.objects.filter(pk=lead.pk).update(updated_at=timezone.now() - timedelta(minutes=minutes_ago))
+            leads.append(lead)
+        return leads  # Oldest first
+
+    def test_streams_all_candidates_in_chunks(self):
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        leads = self._overdue_leads(5, rule)
+
+        with patch('lead.tasks._send_queue_depth', return_value=0), \
+                patch('lead.tasks._enqueue_followups', wraps=lead_tasks._enqueue_followups) as enqueue, \
+                patch('lead.sms.sleep'):
+            task_collect_followups.delay().get(timeout=2)
+
+        self.assertEqual([len(call.args[0]) for call in enqueue.call_args_list], [2, 2, 1])
+        self.assertEqual(
+            set(LeadFollowup.objects.values_list('lead_id', flat=True)),
+            {lead.id for lead in leads}
+        )
+        self.assertFalse(FollowupCollectorWatermark.objects.exists())  # A finished scan leaves no watermark behind
+
+    @override_settings(FOLLOWUP_MAX_ENQUEUE_PER_TICK=3)
+    def test_capped_run_resumes_from_watermark(self):
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        leads = self._overdue_leads(5, rule)
+
+        with patch('lead.tasks._send_queue_depth', return_value=0), \
+                patch('lead.tasks._enqueue_followups') as enqueue:
+            task_collect_followups.delay().get(timeout=2)
+            first_run = [pair for call in enqueue.call_args_list for pair in call.args[0]]
+            watermark = FollowupCollectorWatermark.objects.get(rule=rule)
+            self.assertEqual(watermark.last_lead_id, leads[2].id)
+
+            enqueue.reset_mock()
+            task_collect_followups.delay().get(timeout=2)
+            second_run = [pair for call in enqueue.call_args_list for pair in call.args[0]]
+
+        self.assertEqual(first_run, [(lead.id, rule.id) for lead in leads[:3]])
+        self.assertEqual(second_run, [(lead.id, rule.id) for lead in leads[3:]])
+        self.assertFalse(FollowupCollectorWatermark.objects.exists())
+
+    def test_interrupted_run_resumes_after_last_committed_chunk(self):
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        leads = self._overdue_leads(5, rule)
+        enqueued = []
+
+        def enqueue_then_fail(pairs):
+            if enqueued:
+                raise RuntimeError('worker lost')
+            enqueued.extend(pairs)
+
+        with patch('lead.tasks._send_queue_depth', return_value=0), \
+                patch('lead.tasks._enqueue_followups', side_effect=enqueue_then_fail):
+            with self.assertRaises(RuntimeError):
+                task_collect_followups.delay().get(timeout=2)
+        self.assertEqual(FollowupCollectorWatermark.objects.get(rule=rule).last_lead_id, leads[1].id)
+
+        with patch('lead.tasks._send_queue_depth', return_value=0), \
+                patch('lead.tasks._enqueue_followups') as enqueue:
+            task_collect_followups.delay().get(timeout=2)
+
+        self.assertEqual(enqueued, [(lead.id, rule.id) for lead in leads[:2]])
+        self.assertEqual(
+            [pair for call in enqueue.call_args_list for pair in call.args[0]],
+            [(lead.id, rule.id) for lead in leads[2:]]
+        )
+        self.assertFalse(FollowupCollectorWatermark.objects.exists())
+        self.assertIsNone(TaskExecutionLock.objects.get(name=lead_tasks.COLLECT_TASK_NAME).locked_at)
+
+
+class ShardedCollectFollowupsTest(TestCase):
+
+    def setUp(self):
+        self.rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        self.leads = [
+            Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+            for _ in range(4)
+        ]
+        Lead.objects.update(updated_at=timezone.now() - timedelta(minutes=2))
+
+    def test_shards_partition_lead_space(self):
+        id_ranges = lead_tasks.shard_id_ranges(3)
+        shard_pairs = [set(lead_tasks._collect_simple_followups(id_range=id_range)) for id_range in id_ranges]
+
+        self.assertEqual(set().union(*shard_pairs), {(lead.id, self.rule.id) for lead in self.leads})
+        self.assertEqual(sum(len(pairs) for pairs in shard_pairs), len(self.leads))  # No lead lands in two shards
+        self.assertEqual((id_ranges[0][0], id_ranges[-1][1]), (None, None))  # Leads outside the current span still belong to a shard
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True, FOLLOWUP_COLLECTOR_SHARDS=2)
+    def test_sharded_tick_covers_every_lead_once(self):
+        with patch('lead.tasks._send_queue_depth', return_value=0), patch('lead.sms.sleep'):
+            task_collect_followups.delay().get(timeout=2)
+            task_collect_followups.delay().get(timeout=2)
+
+        self.assertEqual(LeadFollowup.objects.filter(rule=self.rule).count(), len(self.leads))
+        self.assertEqual(
+            set(TaskExecutionLock.objects.filter(name__contains='.shard-').values_list('name', flat=True)),
+            {f'lead.task.task_collect_followups.shard-{index}-of-2' for index in range(2)}
+        )
+
+    def test_duplicate_send_is_suppressed(self):
+        lead = self.leads[0]
+
+        with patch('lead.sms.sleep'):
+            task_send_followup(lead_id=lead.id, rule_id=self.rule.id)
+            task_send_followup(lead_id=lead.id, rule_id=self.rule.id)  # e.g. delivered again by an overlapping shard
+
+        self.assertEqual(LeadFollowup.objects.filter(lead=lead, rule=self.rule).count(), 1)
+
+
+@override_settings(FOLLOWUP_SNAPSHOT_REBUILD_INTERVAL=3600)
+class VectorizedCollectFollowupsTest(TestCase):
+
+    def setUp(self):
+        followup_engine.reset_engine()
+        self.addCleanup(followup_engine.reset_engine)
+        now = timezone.now()
+        self.rules = [
+            LeadFollowupRule.objects.create(text='new 1', status=LeadStatus.NEW, delay=1, is_enabled=True),
+            LeadFollowupRule.objects.create(text='new 30', status=LeadStatus.NEW, delay=30, is_enabled=True),
+            LeadFollowupRule.objects.create(text='verified 5', status=LeadStatus.VERIFIED, delay=5, is_enabled=True),
+            LeadFollowupRule.objects.create(text='paid 1', status=LeadStatus.PAID, delay=1, is_enabled=False),
+        ]
+        statuses = [LeadStatus.NEW, LeadStatus.VERIFIED, LeadStatus.PAID, LeadStatus.LOST]
+        for index in range(40):
+            lead = Lead.objects.create(phone=_get_random_phone_number(), status=statuses[index % len(statuses)])
+            Lead.objects.filter(pk=lead.pk).update(updated_at=now - timedelta(minutes=index * 3 + 0.5))
+        # Suppressed: followed up after the last status change
+        for lead in Lead.objects.filter(status=LeadStatus.NEW)[:3]:
+            LeadFollowup.objects.create(lead=lead, rule=self.rules[0])
+        # Not suppressed: the follow-up predates the current status
+        stale = Lead.objects.filter(status=LeadStatus.VERIFIED).order_by('updated_at').first()
+        followup = LeadFollowup.objects.create(lead=stale, rule=self.rules[2])
+        LeadFollowup.objects.filter(pk=followup.pk).update(created_at=stale.updated_at - timedelta(minutes=1))
+
+    def _vectorized(self, **kwargs):
+        now = timezone.now()
+        return followup_engine.get_engine().collect(now, now - lead_tasks.FOLLOWUP_REPEAT_THRESHOLD, **kwargs)
+
+    def test_matches_simple_collector(self):
+        self.assertEqual(self._vectorized(), lead_tasks._collect_simple_followups())
+        self.assertEqual(self._vectorized(limit=5), lead_tasks._collect_simple_followups(limit=5))
+        id_range = lead_tasks.shard_id_ranges(3)[1]
+        self.assertEqual(self._vectorized(id_range=id_range), lead_tasks._collect_simple_followups(id_range=id_range))
+
+    def test_incremental_refresh_tracks_changes(self):
+        immediate = LeadFollowupRule.objects.create(text='submitted 0', status=LeadStatus.SUBMITTED, delay=0, is_enabled=True)
+        self._vectorized()  # Build the snapshot
+        moved = Lead.objects.filter(status=LeadStatus.NEW).order_by('updated_at').last()
+        moved.status = LeadStatus.SUBMITTED
+        moved.save(update_fields=['status', 'updated_at'])
+        created = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.SUBMITTED)
+        LeadFollowup.objects.create(lead=created, rule=immediate)  # Sent right away: must be suppressed
+
+        pairs = self._vectorized()
+
+        self.assertEqual(pairs, lead_tasks._collect_simple_followups())
+        self.assertIn((moved.id, immediate.id), pairs)
+        self.assertNotIn((created.id, immediate.id), pairs)
+        self.assertFalse(any(lead_id == moved.id and rule_id != immediate.id for lead_id, rule_id in pairs))
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    CELERY_TASK_EAGER_PROPAGATES=True,
+    FOLLOWUP_SCHEDULE_MODE='adaptive',
+    FOLLOWUP_SCHEDULE_MIN_INTERVAL=5,
+    FOLLOWUP_SCHEDULE_MAX_INTERVAL=600
+)
+class AdaptiveScheduleTest(TestCase):
+
+    def setUp(self):
+        cache.delete(scheduling.NEXT_RUN_CACHE_KEY)
+        self.rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=5, is_enabled=True)
+
+    def _run_collector(self, queue_depth: int = 0):
+        with patch('lead.tasks._send_queue_depth', return_value=queue_depth), patch('lead.sms.sleep'), \
+                patch('lead.scheduling.current_app') as celery_app:
+            task_collect_followups.delay().get(timeout=2)
+        return [call.kwargs['countdown'] for call in celery_app.send_task.call_args_list]
+
+    def test_next_run_follows_earliest_due_lead(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        Lead.objects.filter(pk=lead.pk).update(updated_at=timezone.now() - timedelta(minutes=3))  # Due in ~2 minutes
+
+        countdowns = self._run_collector()
+
+        self.assertEqual(len(countdowns), 1)
+        self.assertAlmostEqual(countdowns[0], 120, delta=5)
+
+    def test_idle_and_saturated_runs_use_the_bounds(self):
+        self.assertEqual(self._run_collector(), [600])  # Nothing pending: only the safety-net delay
+        cache.delete(scheduling.NEXT_RUN_CACHE_KEY)
+        with override_settings(FOLLOWUP_QUEUE_HIGH_WATER=100):
+            self.assertEqual(self._run_collector(queue_depth=100), [5])  # Deferred by backpressure
+
+    def test_earlier_pending_run_is_not_duplicated(self):
+        self.assertEqual(self._run_collector(), [600])
+        self.assertEqual(self._run_collector(), [])
+
+    def test_beat_start_applies_schedule_mode(self):
+        scheduling.sync_collect_schedule()
+        self.assertEqual(PeriodicTask.objects.get(task=scheduling.COLLECT_TASK_NAME).interval.every, 600)
+
+        with override_settings(FOLLOWUP_SCHEDULE_MODE='interval', FOLLOWUP_COLLECT_INTERVAL=20):
+            scheduling.sync_collect_schedule()
+        self.assertEqual(PeriodicTask.objects.get(task=scheduling.COLLECT_TASK_NAME).interval.every, 20)
+
+
+@override_settings(FOLLOWUP_WAKEUP_HORIZON=600)
+class WakeupSchedulerTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=2, is_enabled=True)
+        self.soon = self._lead(LeadStatus.NEW, minutes_ago=1)  # Due in a minute
+        self._lead(LeadStatus.NEW, minutes_ago=5)  # Already overdue: the regular collector's job
+        self._lead(LeadStatus.VERIFIED, minutes_ago=1)  # No rule for this status
+        self.scheduler = wakeup.WakeupScheduler()
+        self.scheduler.reload(self.now)
+
+    def _lead(self, status: str, minutes_ago: float) -> Lead:
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=status)
+        Lead.objects.filter(pk=lead.pk).update(updated_at=self.now - timedelta(minutes=minutes_ago))
+        return lead
+
+    def test_reload_tracks_pairs_due_within_horizon(self):
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.next_due_at(), self.now + timedelta(minutes=1) + wakeup.FIRE_LAG)
+        self.assertEqual(self.scheduler.pop_due(self.now), [])
+        self.assertEqual(self.scheduler.pop_due(self.now + timedelta(minutes=2)), [self.soon.id])
+        self.assertIsNone(self.scheduler.next_due_at())
+
+    def test_notifications_are_coalesced(self):
+        moved = self._lead(LeadStatus.VERIFIED, minutes_ago=0)
+        LeadFollowupRule.objects.create(text='verified', status=LeadStatus.VERIFIED, delay=1, is_enabled=True)
+        self.scheduler.handle([f'lead:{moved.id}'], self.now)
+        self.assertEqual(len(self.scheduler), 1)  # The rule isn't known until the rules are reloaded
+
+        self.scheduler.handle([f'lead:{moved.id}', wakeup.RULES_CHANGED, f'lead:{moved.id}'], self.now)
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.pop_due(self.now + timedelta(minutes=5)), sorted([self.soon.id, moved.id]))
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_lead_collection_is_targeted(self):
+        overdue = [self._lead(LeadStatus.NEW, minutes_ago=3) for _ in range(2)]
+
+        with patch('lead.tasks._send_queue_depth', return_value=0), patch('lead.sms.sleep'):
+            task_collect_lead_followups.delay([overdue[0].id, self.soon.id]).get(timeout=2)
+
+        self.assertEqual(list(LeadFollowup.objects.values_list('lead_id', 'rule_id')), [(overdue[0].id, self.rule.id)])
+
+
+class LeadEventOutboxTest(TestCase):
+
+    def _event(self, lead: Lead, status: str) -> LeadEvent:
+        event = LeadEvent.objects.create(lead=lead, status=status)
+        outbox.record_event(event)
+        return event
+
+    def _published(self, publish) -> list:
+        return [int(message['event_id']) for call in publish.call_args_list for message in call.args[0]]
+
+    def test_status_change_is_recorded_in_outbox(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+
+        response = self.client.post(
+            reverse('lead:lead-event-create'),
+            {'lead_id': lead.id, 'status': LeadStatus.SUBMITTED},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        entry = LeadEventOutbox.objects.get()
+        self.assertEqual(entry.payload['event_id'], LeadEvent.objects.get(lead=lead).id)
+        self.assertEqual(entry.payload['status'], LeadStatus.SUBMITTED)
+
+    @override_settings(OUTBOX_RELAY_BATCH_SIZE=2)
+    def test_relay_publishes_in_commit_order(self):
+        leads = [Lead.objects.create(phone=_get_random_phone_number()) for _ in range(2)]
+        events = [
+            self._event(leads[0], LeadStatus.SUBMITTED),
+            self._event(leads[1], LeadStatus.SUBMITTED),
+            self._event(leads[0], LeadStatus.VERIFIED),
+        ]
+
+        with patch('lead.outbox._publish') as publish:
+            self.assertEqual(outbox.relay_batch()[0], 2)
+            self.assertEqual(outbox.relay_batch()[0], 1)
+            self.assertEqual(outbox.relay_batch(), (0, None))
+
+        self.assertEqual(self._published(publish), [event.id for event in events])
+        self.assertFalse(LeadEventOutbox.objects.exists())
+
+    def test_partitions_split_leads(self):
+        leads = [Lead.objects.create(phone=_get_random_phone_number()) for _ in range(4)]
+        events = [self._event(lead, LeadStatus.SUBMITTED) for lead in leads]
+
+        with patch('lead.outbox._publish') as publish:
+            outbox.relay_batch((1, 2))
+
+        self.assertEqual(self._published(publish), [event.id for event in events if event.lead_id % 2 == 1])
+
+    def test_failed_publish_keeps_rows(self):
+        self._event(Lead.objects.create(phone=_get_random_phone_number()), LeadStatus.SUBMITTED)
+
+        with patch('lead.outbox._publish', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                outbox.relay_batch()
+
+        self.assertEqual(LeadEventOutbox.objects.count(), 1)  # Published again by the next batch
+
+
+@override_settings(LIVE_FEED_QUEUE_SIZE=2)
+class LiveFeedTest(TestCase):
+
+    def setUp(self):
+        self.lead = Lead.objects.create(phone=_get_random_phone_number())
+        self.submitted = LeadEvent.objects.create(lead=self.lead, status=LeadStatus.SUBMITTED)
+        self.lost = LeadEvent.objects.create(lead=self.lead, status=LeadStatus.LOST)
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.SUBMITTED, delay=1, is_enabled=True)
+        self.followup = LeadFollowup.objects.create(lead=self.lead, rule=rule)
+        # No Redis subscription in tests: messages are handed to the hub directly
+        listen = patch.object(live.LiveFeedHub, '_listen', new=lambda hub: asyncio.sleep(0))
+        listen.start()
+        self.addCleanup(listen.stop)
+
+    @override_settings(LIVE_FEED_REORDER_MARGIN=0)
+    def test_backfill_resumes_after_cursor(self):
+        cursor = live.Cursor.parse(f'{self.submitted.id}.0')
+
+        messages = live.backfill(cursor, [LeadStatus.SUBMITTED, LeadStatus.LOST], limit=10)
+
+        self.assertEqual([(message['type'], message['id']) for message in messages], [
+            (live.EVENT, self.lost.id),
+            (live.FOLLOWUP, self.followup.id),
+        ])
+        self.assertIsNone(live.Cursor.parse('garbage'))
+
+    @override_settings(LIVE_FEED_REORDER_MARGIN=2)
+    def test_rows_committed_out_of_id_order_are_not_lost(self):
+        cursor = live.Cursor(0, 0)
+        for event_id in (10, 8):
+            cursor = cursor.advance({'type': live.EVENT, 'id': event_id})
+
+        # 9 took its id before 10 but committed after it; 7 is further back than the margin
+        self.assertEqual(
+            [cursor.seen({'type': live.EVENT, 'id': event_id}) for event_id in (7, 8, 9, 10)],
+            [True, True, False, True]
+        )
+        self.assertFalse(cursor.seen({'type': live.FOLLOWUP, 'id': 9}))
+        self.assertEqual(str(cursor), '10.0')
+
+        # A resuming client only has the marks: the replay starts below them
+        late = live.Cursor.parse(f'{self.lost.id}.{self.followup.id}')
+        self.assertEqual(
+            [(message['type'], message['id']) for message in live.backfill(late, [], limit=10)],
+            [(live.EVENT, self.submitted.id), (live.EVENT, self.lost.id), (live.FOLLOWUP, self.followup.id)]
+        )
+        late = late.advance(live.event_message(self.submitted))
+        self.assertNotIn(self.submitted.id, [message['id'] for message in live.backfill(late, [], limit=10)])
+
+    async def test_stream_replays_then_follows_live_messages(self):
+        response = await self.async_client.get(
+            reverse('lead:lead-live-feed'),
+            {'status': LeadStatus.SUBMITTED},
+            headers={'Last-Event-ID': '0.0'}
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        replayed = [await anext(stream), await anext(stream)]
+        self.assertIn(f'"id": {self.submitted.id}', replayed[0].decode())
+        self.assertTrue(replayed[1].decode().startswith(f'id: {self.submitted.id}.{self.followup.id}\nevent: lead_followup'))
+
+        live_event = {'type': live.EVENT, 'id': self.lost.id + 1, 'lead_id': self.lead.id, 'status': LeadStatus.SUBMITTED}
+        live.hub.dispatch({**live_event, 'id': self.submitted.id})  # Already replayed: skipped
+        live.hub.dispatch(live_event)
+        self.assertIn(f'id: {self.lost.id + 1}.{self.followup.id}', (await anext(stream)).decode())
+        await stream.aclose()
+
+    async def test_slow_consumer_is_dropped(self):
+        queue = live.hub.subscribe()
+        for event_id in range(3):
+            live.hub.dispatch({'type': live.EVENT, 'id': event_id})
+
+        # The oldest message makes room for the end-of-stream marker
+        self.assertEqual([queue.get_nowait(), queue.get_nowait()], [{'type': live.EVENT, 'id': 1}, None])
+        live.hub.dispatch({'type': live.EVENT, 'id': 3})
+        self.assertTrue(queue.empty())
+
+    def test_unknown_status_is_rejected(self):
+        response = self.client.get(reverse('lead:lead-live-feed'), {'status': 'bogus'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ListFilterTest(TestCase):
+    # Every filter combination the list views accept, as (view, url name, query params)
+    INDEXED_COMBINATIONS = [
+        (LeadListView, 'lead:lead-list', {'status': LeadStatus.NEW}),
+        (LeadListView, 'lead:lead-list', {'status': LeadStatus.NEW, 'since': '2025-01-01T00:00:00Z'}),
+        (LeadListView, 'lead:lead-list', {'since': '2025-01-01T00:00:00Z', 'until': '2026-01-01T00:00:00Z'}),
+        (LeadEventListView, 'lead:lead-event-list', {'lead_id': 1}),
+        (LeadEventListView, 'lead:lead-event-list', {'lead_id': 1, 'since': '2025-01-01T00:00:00Z'}),
+        (LeadEventListView, 'lead:lead-event-list', {'lead_id': 1, 'status': LeadStatus.NEW}),
+        (LeadEventListView, 'lead:lead-event-list', {'status': LeadStatus.NEW, 'until': '2026-01-01T00:00:00Z'}),
+        (LeadEventListView, 'lead:lead-event-list', {'since': '2025-01-01T00:00:00Z'}),
+        (LeadFollowupListView, 'lead:lead-followup-list', {'lead_id': 1, 'since': '2025-01-01T00:00:00Z'}),
+        (LeadFollowupListView, 'lead:lead-followup-list', {'until': '2026-01-01T00:00:00Z'}),
+    ]
+
+    def test_filters_narrow_results(self):
+        now = timezone.now()
+        stale, fresh = [Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.VERIFIED) for _ in range(2)]
+        Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        Lead.objects.filter(pk=stale.pk).update(updated_at=now - timedelta(hours=2))
+        LeadEvent.objects.create(lead=fresh, status=LeadStatus.VERIFIED)
+        LeadEvent.objects.create(lead=stale, status=LeadStatus.VERIFIED)
+
+        response = self.client.get(reverse('lead:lead-list'), {
+            'status': LeadStatus.VERIFIED,
+            'since': (now - timedelta(hours=1)).isoformat(),
+            'order_by': 'phone',  # Not index-backed with filters: falls back to updated_at
+        })
+        self.assertEqual([lead['id'] for lead in response.json()['results']], [fresh.id])
+
+        response = self.client.get(reverse('lead:lead-event-list'), {'lead_id': stale.id})
+        self.assertEqual([event['lead']['id'] for event in response.json()['results']], [stale.id])
+
+    def test_invalid_filters_are_rejected(self):
+        for params in ({'status': 'bogus'}, {'lead_id': 'x'}, {'since': '2026-01-02', 'until': '2026-01-01'}):
+            self.assertEqual(self.client.get(reverse('lead:lead-event-list'), params).status_code, 400)
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN output format is PostgreSQL-specific')
+    def test_indexed_combinations_use_index_scans(self):
+        factory = APIRequestFactory()
+        with connection.cursor() as cursor:
+            # Tiny test tables would otherwise be scanned; bitmap scans would hide whether the index also orders the rows
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+        for view_class, url_name, params in self.INDEXED_COMBINATIONS:
+            for order_dir in ('asc', 'desc'):
+                with self.subTest(view=view_class.__name__, params=params, order_dir=order_dir):
+                    view = view_class()
+                    view.request = view.initialize_request(factory.get(reverse(url_name), {**params, 'order_dir': order_dir}))
+                    plan = view.get_queryset().explain()
+                    self.assertIn('Index', plan)
+                    self.assertNotIn('Seq Scan', plan)
+                    self.assertNotIn('Sort', plan)  # The index delivers the rows already ordered
+
+
+class LeadTimelineTest(TestCase):
+
+    def setUp(self):
+        self.lead = Lead.objects.create(phone=_get_random_phone_number())
+        other = Lead.objects.create(phone=_get_random_phone_number())
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        moment = timezone.now() - timedelta(hours=1)
+        for index in range(5):
+            event = LeadEvent.objects.create(lead=self.lead, status=LeadStatus.SUBMITTED)
+            followup = LeadFollowup.objects.create(lead=self.lead, rule=rule)
+            # Pairs share a timestamp, so pages have to split ties consistently
+            at = moment + timedelta(minutes=index // 2)
+            LeadEvent.objects.filter(pk=event.pk).update(created_at=at)
+            LeadFollowup.objects.filter(pk=followup.pk).update(created_at=at)
+        LeadEvent.objects.create(lead=other, status=LeadStatus.SUBMITTED)
+
+        keys = [(event.created_at, 'event', event.id) for event in LeadEvent.objects.filter(lead=self.lead)]
+        keys += [(followup.created_at, 'followup', followup.id) for followup in LeadFollowup.objects.filter(lead=self.lead)]
+        self.expected = [(kind, entry_id) for _, kind, entry_id in sorted(keys, reverse=True)]
+
+    def test_pages_merge_both_histories(self):
+        url = reverse('lead:lead-timeline', args=[self.lead.id])
+        entries, params = [], {'limit': 3}
+        while True:
+            with self.assertNumQueries(3):  # Lead lookup plus one indexed read per history, however long it is
+                page = self.client.get(url, params).json()
+            entries += page['results']
+            if page['next'] is None:
+                break
+            params['cursor'] = page['next']
+
+        self.assertEqual([(entry['type'], entry['id']) for entry in entries], self.expected)
+        followup = next(entry for entry in entries if entry['type'] == 'followup')
+        self.assertEqual((followup['status'], followup['text']), (LeadStatus.NEW, 'ping'))
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.get(reverse('lead:lead-timeline', args=[self.lead.id + 100])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('lead:lead-timeline', args=[self.lead.id]), {'cursor': 'nope'}).status_code, 400)
+
+
+class LeadStatsTest(TestCase):
+
+    def setUp(self):
+        cache.delete(stats.STATS_CACHE_KEY)
+        self.url = reverse('lead:lead-event-create')
+
+    def _move(self, lead, status):
+        response = self.client.post(self.url, {'lead_id': lead.id, 'status': status}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def _snapshot(self):
+        transitions = {
+            (row['from_status'], row['to_status']): row['total']
+            for row in LeadTransitionStat.objects.values('from_status', 'to_status').annotate(total=Sum('count'))
+        }
+        durations = {
+            (row['status'], row['bucket']): row['total']
+            for row in LeadStatusDurationStat.objects.values('status', 'bucket').annotate(total=Sum('count'))
+        }
+        return transitions, durations
+
+    def test_status_changes_update_counters(self):
+        leads = [Lead.objects.create(phone=_get_random_phone_number()) for _ in range(3)]
+        for lead in leads:
+            self._move(lead, LeadStatus.SUBMITTED)
+        self._move(leads[0], LeadStatus.SUBMITTED)  # Not a status change
+        self._move(leads[0], LeadStatus.VERIFIED)
+        self._move(leads[1], LeadStatus.LOST)
+
+        data = self.client.get(reverse('lead:lead-stats')).json()
+
+        submitted = data['statuses'][LeadStatus.SUBMITTED]
+        self.assertEqual(data['statuses'][LeadStatus.NEW]['exited'], 3)
+        self.assertEqual(submitted['exited'], 2)
+        self.assertEqual(submitted['conversion'], {LeadStatus.VERIFIED: 0.5, LeadStatus.LOST: 0.5})
+        # The first event of a lead has no previous one to measure the time in NEW from
+        self.assertEqual(sum(bucket['count'] for bucket in submitted['time_in_status']['buckets']), 2)
+        self.assertEqual(submitted['time_in_status']['buckets'][0]['le'], stats.DURATION_BUCKETS[0])
+        self.assertIsNone(data['statuses'][LeadStatus.NEW]['time_in_status']['mean_seconds'])
+
+    def test_rebuild_reproduces_live_counters(self):
+        for _ in range(5):
+            lead = Lead.objects.create(phone=_get_random_phone_number())
+            for status in random.sample(LeadStatus.values, 3):
+                self._move(lead, status)
+        live_counters = self._snapshot()
+        LeadTransitionStat.objects.update(count=0)
+
+        stats.rebuild(workers=1, batch_size=2)
+
+        self.assertEqual(self._snapshot(), live_counters)
+        self.assertFalse(LeadTransitionStat.objects.exclude(slot=0).exists())
+
+    def test_repeated_status_does_not_restart_the_clock(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number())
+        self._move(lead, LeadStatus.SUBMITTED)
+        LeadEvent.objects.filter(lead=lead).update(created_at=timezone.now() - timedelta(hours=2))
+        self._move(lead, LeadStatus.SUBMITTED)  # Posted again: the lead has been submitted for two hours all the same
+        self._move(lead, LeadStatus.VERIFIED)
+        live_counters = self._snapshot()
+
+        stats.rebuild(workers=1)
+
+        two_hours = bisect_left(stats.DURATION_BUCKETS, 2 * 3600)
+        self.assertEqual(live_counters[1], {(LeadStatus.SUBMITTED, two_hours): 1})
+        self.assertEqual(self._snapshot(), live_counters)
+
+
+@override_settings(FOLLOWUP_REPEAT_THRESHOLD=120, FOLLOWUP_SEND_CONCURRENCY=1, SMS_SEND_DELAY=1200, SMS_GATEWAY_HOURLY_QUOTA=0)
+class FollowupForecastTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=30, is_enabled=True)
+        LeadFollowupRule.objects.create(text='off', status=LeadStatus.NEW, delay=5, is_enabled=False)
+        overdue = self._leads(LeadStatus.NEW, 3, timedelta(hours=2))
+        self._leads(LeadStatus.NEW, 2, timedelta(minutes=10))  # Due in 20 minutes
+        self._leads(LeadStatus.SUBMITTED, 1, timedelta(0))
+        # Sent half an hour ago: suppressed until the threshold runs out an hour and a half from now
+        followup = LeadFollowup.objects.create(lead=overdue[0], rule=self.rule)
+        LeadFollowup.objects.filter(pk=followup.pk).update(created_at=self.now - timedelta(minutes=30))
+
+    def _leads(self, status, count, age):
+        leads = [Lead.objects.create(phone=_get_random_phone_number(), status=status) for _ in range(count)]
+        Lead.objects.filter(pk__in=[lead.pk for lead in leads]).update(updated_at=self.now - age)
+        return leads
+
+    def test_sends_per_bucket(self):
+        with self.assertNumQueries(2):  # Enabled rules, then one histogram query however many leads there are
+            result = forecast.forecast(6, 60, now=self.now)
+
+        # Every pair comes back every 120 minutes; the suppressed one is shifted by 90 minutes
+        self.assertEqual([bucket['sends'] for bucket in result['buckets']], [4, 1, 4, 1, 4, 1])
+        self.assertEqual(result['rules'], {str(self.rule.id): 15})
+        self.assertEqual(result['capacity_per_bucket'], 3)
+        self.assertEqual([bucket['over_capacity'] for bucket in result['buckets']], [True, False] * 3)
+
+    def test_endpoint_includes_proposed_rule(self):
+        url = reverse('lead:lead-followup-forecast')
+
+        data = self.client.get(url, {'hours': 6, 'bucket': 60, 'status': LeadStatus.SUBMITTED, 'delay': 90}).json()
+
+        self.assertEqual(data['rules'][forecast.PROPOSED], 3)
+        self.assertEqual(data['total'], 18)
+        self.assertEqual(self.client.get(url, {'status': LeadStatus.SUBMITTED}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'status': LeadStatus.NEW, 'delay': 30}).status_code, 400)  # Already exists
+
+
+class ConditionalListTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lead = Lead.objects.create(phone=_get_random_phone_number())
+        LeadEvent.objects.create(lead=self.lead, status=LeadStatus.NEW)
+
+    def _get(self, name, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse(name), params, headers=headers)
+
+    def test_unchanged_page_is_not_modified(self):
+        for name in ('lead:lead-list', 'lead:lead-event-list'):
+            etag = self._get(name, limit=5)['ETag']
+
+            with self.assertNumQueries(0):  # A cache lookup alone
+                response = self._get(name, etag, limit=5)
+
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etag)
+            self.assertEqual(self._get(name, etag, limit=6).status_code, 200)  # Another page, another ETag
+
+    def test_writes_change_the_etag(self):
+        leads_etag = self._get('lead:lead-list')['ETag']
+        events_etag = self._get('lead:lead-event-list')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('lead:lead-event-create'),
+                {'lead_id': self.lead.id, 'status': LeadStatus.SUBMITTED},
+                content_type='application/json'
+            )
+
+        self.assertEqual(self._get('lead:lead-list', leads_etag).status_code, 200)
+        self.assertEqual(self._get('lead:lead-event-list', events_etag).status_code, 200)
+
+        events_etag = self._get('lead:lead-event-list')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lead.save()  # Events embed their lead
+        self.assertEqual(self._get('lead:lead-event-list', events_etag).status_code, 200)
+
+
+class DbPoolTest(TestCase):
+
+    def test_worker_pool_size_follows_concurrency(self):
+        from celery.concurrency import get_implementation
+
+        self.assertEqual(dbpool.worker_pool_size(get_implementation('threads'), 64), 64)
+        self.assertEqual(dbpool.worker_pool_size(get_implementation('prefork'), 8), 1)  # One per child
+        self.assertEqual(dbpool.worker_pool_size('solo', 4), 1)
+
+    @skipUnless(connection.settings_dict['OPTIONS'].get('pool'), 'Needs a pooled database connection')
+    def test_forked_child_drops_inherited_pool(self):
+        LeadFollowupRule.objects.exists()  # Make sure the pool is open and a connection is checked out
+        pools = type(connections[connection.alias])._connection_pools  # connection itself is a proxy
+        pool = pools[connection.alias]
+
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover - child
+            dropped = connection.alias not in pools and connection.connection is None
+            os._exit(0 if dropped and pool in dbpool._inherited_pools else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(pools[connection.alias], pool)  # The parent keeps its pool
+        self.assertFalse(LeadFollowupRule.objects.exists())
+
+
+@override_settings(REPLICA_ALIASES=['replica_0'])
+class ReplicaRouterTest(TestCase):
+
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+        replicas._freshness.clear()
+        # TestCase wraps every test in a transaction, which alone keeps reads on the primary
+        self.outside_transaction = patch.object(connections['default'], 'in_atomic_block', False)
+
+    def _read_alias(self):
+        return self.router.db_for_read(Lead)
+
+    @patch('app.replicas.replica_is_fresh', return_value=True)
+    def test_only_opted_in_reads_go_to_a_replica(self, fresh):
+        with self.outside_transaction:
+            self.assertIsNone(self._read_alias())
+            with replicas.replica_reads():
+                self.assertEqual(self._read_alias(), 'replica_0')
+                with replicas.replica_reads(False):
+                    self.assertIsNone(self._read_alias())
+        self.assertEqual(self.router.db_for_write(Lead), 'default')
+
+    @patch('app.replicas.replica_is_fresh', return_value=True)
+    def test_transactions_and_recent_writers_read_from_the_primary(self, fresh):
+        with replicas.replica_reads():
+            self.assertIsNone(self._read_alias())  # Inside the test transaction
+            with self.outside_transaction:
+                state = replicas._RequestState()
+                token = replicas._request_state.set(state)
+                try:
+                    self.assertEqual(self._read_alias(), 'replica_0')
+                    self.router.db_for_write(Lead)
+                    self.assertIsNone(self._read_alias())
+                    state.wrote, state.pinned = False, True
+                    self.assertIsNone(self._read_alias())
+                finally:
+                    replicas._request_state.reset(token)
+
+    def _lag_check(self, **cursor_options):
+        return patch.object(connections['default'], 'cursor', **cursor_options)
+
+    def test_stale_or_unreachable_replica_falls_back_to_the_primary(self):
+        with self.outside_transaction, replicas.replica_reads():
+            with patch('app.replicas.replica_is_fresh', return_value=False):
+                self.assertIsNone(self._read_alias())
+
+        # A primary is not in recovery: LAG_SQL reports no lag
+        self.assertTrue(replicas.replica_is_fresh('default'))
+
+    def test_lagging_replica_is_stale(self):
+        with self._lag_check() as cursor, self.assertLogs('app.replicas', level='WARNING'):
+            cursor.return_value.__enter__.return_value.fetchone.return_value = (settings.REPLICA_MAX_LAG + 1,)
+            self.assertFalse(replicas.replica_is_fresh('default'))
+
+    def test_unreachable_replica_is_remembered_until_the_next_check(self):
+        with self._lag_check(side_effect=OperationalError('connection refused')) as cursor:
+            with self.assertLogs('app.replicas', level='WARNING'):
+                self.assertFalse(replicas.replica_is_fresh('default'))
+            self.assertFalse(replicas.replica_is_fresh('default'))
+
+        cursor.assert_called_once()
+
+    def test_replicas_are_never_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'lead'))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'lead'))
+
+    def test_write_pins_the_client_to_the_primary(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number())
+        self.assertNotIn(replicas.PIN_COOKIE, self.client.get(reverse('lead:lead-list')).cookies)
+
+        response = self.client.post(
+            reverse('lead:lead-event-create'),
+            {'lead_id': lead.id, 'status': LeadStatus.SUBMITTED},
+            content_type='application/json'
+        )
+        cookie = response.cookies[replicas.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], settings.REPLICA_STICKY_SECONDS)
+        self.assertGreater(float(cookie.value), time.time())
+
+
+class CompactSerializerTest(TestCase):
+
+    def _round_trip(self, body):
+        content_type, content_encoding, data = dumps(body, serializer=codec.SERIALIZER)
+        return data, loads(data, content_type, content_encoding, accept=prepare_accept_content(celery_app.conf.accept_content))
+
+    def test_send_batches_round_trip_smaller_than_json(self):
+        pairs = [(random.randint(1, 5_000_000), random.randint(1, 20)) for _ in range(1000)]
+        body = ((), {'task': task_send_followup.s(), 'it': pairs}, {'callbacks': None})
+
+        data, decoded = self._round_trip(body)
+
+        args, kwargs, embed = decoded
+        self.assertEqual(kwargs['it'], [list(pair) for pair in pairs])
+        self.assertEqual(kwargs['task']['task'], 'lead.task.task_send_followup')
+        self.assertEqual(embed, {'callbacks': None})
+        self.assertLess(len(data), len(dumps(body, serializer='json')[2]) / 2)
+
+    def test_compresses_from_the_threshold(self):
+        lead_ids = list(range(10_000))
+        with override_settings(MESSAGE_COMPRESS_MIN_BYTES=10**9):
+            plain, decoded = self._round_trip(([lead_ids], {}, {}))
+        self.assertEqual(decoded[0], [lead_ids])
+
+        compressed, decoded = self._round_trip(([lead_ids], {}, {}))
+        self.assertEqual(decoded[0], [lead_ids])
+        self.assertLess(len(compressed), len(plain))
+
+    def test_unpackable_values_are_kept(self):
+        body = ([[2 ** 40] * 10, [True] * 10, list(range(3)), 'text'], {'mixed': [1, 'a'] * 5}, {})
+        self.assertEqual(self._round_trip(body)[1], [[[2 ** 40] * 10, [True] * 10, [0, 1, 2], 'text'], {'mixed': [1, 'a'] * 5}, {}])
+
+    def test_workers_accept_both_formats(self):
+        self.assertIn('json', celery_app.conf.accept_content)
+        self.assertIn(codec.SERIALIZER, celery_app.conf.accept_content)
+
+
+# The manifest only exists after collectstatic
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class LeadAdminTest(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'pass'))
+
+    def _leads(self, count):
+        return [Lead.objects.create(phone=f'+7900{index:07d}') for index in range(count)]
+
+    def test_changelists_load_related_rows_in_bulk(self):
+        rule = LeadFollowupRule.objects.create(status=LeadStatus.NEW, delay=1, text='Hi')
+        for name in ('admin:lead_leadevent_changelist', 'admin:lead_leadfollowup_changelist'):
+            queries = []
+            for leads in (self._leads(2), [Lead.objects.create(phone=_get_random_phone_number()) for _ in range(8)]):
+                for lead in leads:
+                    LeadEvent.objects.create(lead=lead, status=LeadStatus.NEW)
+                    LeadFollowup.objects.create(lead=lead, rule=rule)
+                with CaptureQueriesContext(connection) as captured:
+                    self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+                queries.append(len(captured))
+            self.assertEqual(queries[0], queries[1])  # Independent of the rows on the page
+            Lead.objects.all().delete()
+
+    def test_search_matches_phone_prefix(self):
+        lead, other = Lead.objects.create(phone='+79001234567'), Lead.objects.create(phone='+44123490012')
+        LeadEvent.objects.create(lead=lead, status=LeadStatus.NEW)
+        LeadEvent.objects.create(lead=other, status=LeadStatus.NEW)
+
+        response = self.client.get(reverse('admin:lead_lead_changelist'), {'q': ' +7900 '})
+        self.assertEqual(list(response.context['cl'].result_list), [lead])
+        response = self.client.get(reverse('admin:lead_leadevent_changelist'), {'q': '9001'})
+        self.assertEqual(list(response.context['cl'].result_list), [])  # Not a substring search
+
+    def test_count_stops_at_limit(self):
+        self._leads(5)
+        with patch.object(EstimatedCountPaginator, 'count_limit', 3):
+            response = self.client.get(reverse('admin:lead_lead_changelist'))
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_bulk_status_change(self):
+        cache.clear()
+        moved = self._leads(3)
+        done = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.SUBMITTED)
+        LeadEvent.objects.create(lead=moved[0], status=LeadStatus.NEW)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:lead_lead_changelist'), {
+                'action': 'move_to_submitted',
+                '_selected_action': [lead.pk for lead in moved] + [done.pk],
+            })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Lead.objects.filter(status=LeadStatus.SUBMITTED).count(), 4)
+        events = LeadEvent.objects.filter(status=LeadStatus.SUBMITTED)
+        self.assertEqual(sorted(event.lead_id for event in events), [lead.pk for lead in moved])
+        self.assertEqual(LeadEventOutbox.objects.filter(event__in=events).count(), 3)
+        self.assertFalse(LeadEvent.objects.filter(lead=done).exists())  # Already there: no event
+        self.assertEqual(
+            LeadTransitionStat.objects.filter(from_status=LeadStatus.NEW, to_status=LeadStatus.SUBMITTED).aggregate(
+                total=Sum('count')
+            )['total'],
+            3
+        )
+        self.assertEqual(LeadStatusDurationStat.objects.aggregate(total=Sum('count'))['total'], 1)  # One known entry time
+        for lead in moved:
+            lead.refresh_from_db()
+            self.assertGreater(lead.updated_at, done.updated_at)
+
+
+class PhoneSearchTest(TestCase):
+
+    def setUp(self):
+        self.url = reverse('lead:lead-phone-search')
+        self.numbers = ['+79001234567', '+79001234568', '+79005550000', '+79011234567', '+4412345678']
+        for phone in self.numbers:
+            Lead.objects.create(phone=phone)
+
+    def _phones(self, response):
+        return [lead['phone'] for lead in response.json()['results']]
+
+    def test_normalize(self):
+        self.assertEqual(phones.normalize('+7 (900) 123-45-67'), '+79001234567')
+        self.assertEqual(phones.normalize('0044 1234.5678'), '+4412345678')
+        self.assertEqual(phones.normalize('7900', phones.PREFIX), '+7900')
+        self.assertEqual(phones.normalize('+123-4', phones.CONTAINS), '1234')
+        for value, mode in (('+7900', phones.EXACT), ('+0123456', phones.EXACT), ('12', phones.CONTAINS), ('abc', phones.PREFIX)):
+            with self.assertRaises(ValueError):
+                phones.normalize(value, mode)
+
+    def test_exact_lookup(self):
+        response = self.client.get(self.url, {'q': '+7 900 123-45-67'})
+        self.assertEqual(self._phones(response), ['+79001234567'])
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(self.client.get(self.url, {'q': '+7900'}).status_code, 400)
+
+    def test_prefix_pages_in_number_order(self):
+        seen, cursor = [], None
+        while True:
+            params = {'q': '7900', 'mode': phones.PREFIX, 'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.client.get(self.url, params).json()
+            seen.extend(lead['phone'] for lead in page['results'])
+            cursor = page['next']
+            if cursor is None:
+                break
+        self.assertEqual(seen, ['+79001234567', '+79001234568', '+79005550000'])
+
+    def test_contains_matches_inner_digits(self):
+        response = self.client.get(self.url, {'q': '1234', 'mode': phones.CONTAINS})
+        self.assertEqual(self._phones(response), ['+4412345678', '+79001234567', '+79001234568', '+79011234567'])
+        self.assertEqual(self.client.get(self.url, {'q': '12', 'mode': phones.CONTAINS}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'q': '1234', 'cursor': '%%%'}).status_code, 400)
+
+
+_STUB = 'lead.sms.StubGateway'
+
+
+@override_settings(
+    SMS_GATEWAYS=[
+        {'name': 'primary', 'backend': _STUB, 'weight': 3, 'delay': 0},
+        {'name': 'backup', 'backend': _STUB, 'weight': 1, 'delay': 0},
+    ],
+    SMS_BREAKER_FAILURES=2,
+    SMS_GATEWAY_SLOW_SECONDS=5
+)
+class SmsGatewayTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        self.rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+
+    def test_traffic_follows_weights(self):
+        random.seed(0)
+        picks = [sms.acquire()[0].name for _ in range(2000)]
+        self.assertAlmostEqual(picks.count('primary') / len(picks), 0.75, delta=0.05)
+
+    def test_breaker_shifts_traffic_away(self):
+        primary = sms.gateways()['primary']
+        with override_settings(SMS_GATEWAY_SLOW_SECONDS=0):
+            sms.send(primary, self.lead.phone, 'slow')  # Answered, but too late
+        with self.assertRaises(ConnectionError):
+            sms.send(replace(primary, options={'delay': 0, 'failure_rate': 1}), self.lead.phone, 'lost')
+
+        self.assertEqual(sms.is_open(list(sms.gateways().values())), {'primary': True, 'backup': False})
+        self.assertEqual({sms.acquire()[0].name for _ in range(50)}, {'backup'})
+
+        sms.record_failure(sms.gateways()['backup'])
+        sms.record_failure(sms.gateways()['backup'])
+        # With every gateway out, all of them are used again
+        self.assertEqual({sms.acquire()[0].name for _ in range(50)}, {'primary', 'backup'})
+
+    def test_send_waits_for_token_off_thread(self):
+        backup = sms.gateways()['backup']
+        with patch('lead.sms.acquire', return_value=(backup, 2.5)), \
+                patch('lead.tasks.task_send_followup.apply_async') as apply_async:
+            task_send_followup(self.lead.id, self.rule.id)
+
+        self.assertFalse(LeadFollowup.objects.exists())
+        args, kwargs = apply_async.call_args
+        self.assertEqual(args, ((self.lead.id, self.rule.id), {'gateway': 'backup'}))
+        self.assertEqual(kwargs['countdown'], 2.5)
+        self.assertEqual(kwargs['queue'], settings.FOLLOWUP_SEND_QUEUE)
+
+        # Back at its ETA, the pair goes out through the reserved gateway without another token
+        with patch('lead.sms.acquire') as acquire, patch.object(backup, 'send') as send:
+            task_send_followup(self.lead.id, self.rule.id, gateway='backup')
+        acquire.assert_not_called()
+        send.assert_called_once_with(self.lead.phone, 'ping')
+        self.assertEqual(LeadFollowup.objects.filter(lead=self.lead, rule=self.rule).count(), 1)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_failed_send_moves_to_another_gateway(self):
+        leads = [self.lead] + [Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW) for _ in range(2)]
+        primary, backup = sms.gateways()['primary'], sms.gateways()['backup']
+
+        with patch('lead.sms._weighted_order', side_effect=list), \
+                patch.object(primary, 'send', side_effect=[None, ConnectionError('primary is down'), None]) as primary_send, \
+                patch.object(backup, 'send') as backup_send, \
+                self.assertLogs('app', level='WARNING'):
+            # The primary fails the second pair in the middle of the chunk
+            task_send_followup.chunks([(lead.id, self.rule.id) for lead in leads], 3).apply_async().get()
+
+        self.assertEqual([call.args[0] for call in primary_send.call_args_list], [lead.phone for lead in leads])
+        backup_send.assert_called_once_with(leads[1].phone, 'ping')
+        self.assertEqual(
+            sorted(LeadFollowup.objects.filter(rule=self.rule).values_list('lead_id', flat=True)),
+            [lead.id for lead in leads]
+        )
+
+    @override_settings(SMS_SEND_RETRIES=0)
+    def test_failed_send_leaves_no_followup(self):
+        with patch('lead.sms.acquire', return_value=(sms.gateways()['primary'], 0)), \
+                patch.object(sms.gateways()['primary'], 'send', side_effect=ConnectionError('down')), \
+                self.assertLogs('app', level='WARNING'):
+            task_send_followup(self.lead.id, self.rule.id)
+
+        self.assertFalse(LeadFollowup.objects.exists())  # Collected again by the next tick
+
+    def test_gateway_answers_outside_the_transaction(self):
+        primary = sms.gateways()['primary']
+        outer_blocks = len(connection.atomic_blocks)  # The test case's own
+        observed = []
+
+        def send(phone, text):
+            observed.append(len(connection.atomic_blocks))
+            task_send_followup(self.lead.id, self.rule.id)  # Redelivered meanwhile: the pair is reserved
+
+        with patch('lead.sms.acquire', return_value=(primary, 0)), \
+                patch.object(primary, 'send', side_effect=send) as primary_send:
+            task_send_followup(self.lead.id, self.rule.id)
+
+        self.assertEqual(observed, [outer_blocks])
+        primary_send.assert_called_once()
+        self.assertEqual(LeadFollowup.objects.filter(lead=self.lead, rule=self.rule).count(), 1)
+        self.assertIsNone(cache.get(lead_tasks.SENDING_CACHE_KEY.format(self.lead.id, self.rule.id)))
+
+    @override_settings(SMS_GATEWAYS=[{'name': 'metered', 'backend': _STUB, 'rate': 1, 'delay': 0}])
+    def test_rate_limiter_fails_open(self):
+        with patch('lead.sms.get_redis_connection', side_effect=ConnectionError), \
+                self.assertLogs('app', level='WARNING'):
+            gateway, wait = sms.acquire()
+        self.assertEqual((gateway.name, wait), ('metered', 0))
+
+    @skipUnless(settings.CACHES['default']['BACKEND'] == 'django_redis.cache.RedisCache', 'Needs Redis')
+    @override_settings(
+        SMS_GATEWAYS=[{'name': 'metered', 'backend': _STUB, 'rate': 2, 'burst': 2, 'delay': 0}],
+        SMS_RATE_MAX_WAIT=1
+    )
+    def test_token_bucket_is_shared(self):
+        from django_redis import get_redis_connection
+
+        get_redis_connection('default').delete(sms.BUCKET_KEY.format('metered'))
+        waits = [sms.acquire()[1] for _ in range(5)]
+        # Two from the burst, then reservations half a second apart up to a second ahead, then a retry
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.5, delta=0.1)
+        self.assertAlmostEqual(waits[3], 1.0, delta=0.1)
+        self.assertIsNone(sms.acquire()[0])
+
+
+class TaskLockTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.runs = []
+
+    def test_lock_name_follows_arguments(self):
+        @singleton_task('test.lead-{lead_id}')
+        def touch(lead_id, note='default'):
+            self.runs.append((lead_id, note))
+
+        touch(7)
+        touch(lead_id=8, note='kw')
+
+        self.assertEqual(self.runs, [(7, 'default'), (8, 'kw')])
+        self.assertEqual(
+            set(TaskExecutionLock.objects.filter(name__startswith='test.').values_list('name', flat=True)),
+            {'test.lead-7', 'test.lead-8'}
+        )
+        self.assertEqual(lock_stats(['test.lead-{lead_id}'])['test.lead-{lead_id}']['acquired'], 2)
+
+    @staticmethod
+    @contextmanager
+    def _in_process_lock(held: Lock):
+        @contextmanager
+        def lock(name, timeout, wait=True):
+            acquired = held.acquire(blocking=False)  # Stands in for SKIP LOCKED on another connection
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    held.release()
+
+        with patch('app.lockers._db_task_lock', lock):
+            yield
+
+    def test_held_lock_coalesces_into_one_rerun(self):
+        @singleton_task('test.coalesced', coalesce=True)
+        def tick():
+            self.runs.append(len(self.runs))
+            if len(self.runs) == 1:
+                # Two more ticks arrive while the first one runs
+                self.assertIsNone(tick())
+                self.assertIsNone(tick())
+            return len(self.runs)
+
+        with self._in_process_lock(Lock()):
+            self.assertEqual(tick(), 2)
+            self.assertEqual(tick(), 3)  # No request pending: runs once
+
+        self.assertEqual(self.runs, [0, 1, 2])
+        self.assertEqual(lock_stats(['test.coalesced']), {'test.coalesced': {'acquired': 3, 'skipped': 0, 'coalesced': 2}})
+
+    def test_rerun_request_outlives_the_lock_timeout(self):
+        @singleton_task('test.slow', timeout=timedelta(seconds=1), coalesce=True)
+        def tick():
+            self.runs.append(len(self.runs))
+            if len(self.runs) == 1:
+                self.assertIsNone(tick())
+                time.sleep(1.2)  # Runs past the lock timeout after the rerun was requested
+            return len(self.runs)
+
+        with self._in_process_lock(Lock()):
+            self.assertEqual(tick(), 2)
+
+        self.assertEqual(self.runs, [0, 1])
+
+
+class CollectorDryRunTest(TestCase):
+
+    def setUp(self):
+        self.rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=30, is_enabled=True)
+        self.disabled = LeadFollowupRule.objects.create(text='off', status=LeadStatus.NEW, delay=5, is_enabled=False)
+        leads = [Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW) for _ in range(4)]
+        Lead.objects.filter(pk__in=[lead.pk for lead in leads[:3]]).update(updated_at=timezone.now() - timedelta(hours=2))
+        LeadFollowup.objects.create(lead=leads[0], rule=self.rule)  # Held back by the repeat threshold
+
+    def test_reports_without_sending(self):
+        with patch('lead.tasks._enqueue_followups') as enqueue, patch('lead.sms.acquire') as acquire:
+            report = collector_report.dry_run(save=False)
+
+        enqueue.assert_not_called()
+        acquire.assert_not_called()
+        self.assertEqual(LeadFollowup.objects.count(), 1)
+        self.assertEqual(
+            [(rule.rule_id, rule.candidates, rule.suppressed, rule.pairs) for rule in report.rules],
+            [(self.rule.pk, 3, 1, 2)]
+        )
+        self.assertEqual(
+            [(query.query, query.rule_id) for query in report.queries],
+            [(collector_report.ELIGIBLE_RULES, None), (collector_report.STALLED_LEADS, self.rule.pk)]
+        )
+        if connection.vendor == 'postgresql':
+            self.assertIn('Buffers', report.queries[1].plan)
+
+    @override_settings(FOLLOWUP_SLOW_QUERY_MS=0)
+    def test_slow_plans_are_saved(self):
+        out = StringIO()
+        call_command('collector_dry_run', '--rule', str(self.disabled.pk), stdout=out)
+
+        self.assertIn(f'| {self.disabled.pk} (disabled) | new | 5 | 3 | 0 | 3 |', out.getvalue())
+        self.assertEqual(
+            sorted(CollectorQueryPlan.objects.values_list('query', 'rule_id')),
+            [(collector_report.ELIGIBLE_RULES, None), (collector_report.STALLED_LEADS, self.disabled.pk)]
+        )
+
+
+class StartupTest(TestCase):
+
+    def test_precomputed_schema_is_served_as_is(self):
+        request_factory = APIRequestFactory()
+        with tempfile.NamedTemporaryFile(suffix='.yaml') as schema_file:
+            schema_file.write(b'openapi: 3.0.3\ninfo:\n  title: precomputed\n')
+            schema_file.flush()
+            schema._read.cache_clear()
+            with override_settings(OPENAPI_SCHEMA_FILE=schema_file.name):
+                response = schema.PrecomputedSchemaView.as_view()(request_factory.get('/schema/'))
+                self.assertEqual(response.content, b'openapi: 3.0.3\ninfo:\n  title: precomputed\n')
+                self.assertEqual(response['Content-Type'], 'application/vnd.oai.openapi')
+
+                # JSON is generated on demand
+                response = schema.PrecomputedSchemaView.as_view()(request_factory.get('/schema/', {'format': 'json'}))
+                response.render()
+                self.assertEqual(json.loads(response.content)['info']['title'], settings.SPECTACULAR_SETTINGS['TITLE'])
+        schema._read.cache_clear()
+
+    def test_worker_role_skips_web_tooling(self):
+        code = (
+            'import sys, django; django.setup(); from app.celery import app; app.loader.import_default_modules(); '
+            'print(sorted(m for m in ("django.contrib.admin", "drf_spectacular", "corsheaders", "lead.views", "rest_framework") if m in sys.modules))'
+        )
+        process = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, APP_ROLE='worker'),
+            capture_output=True,
+            text=True
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        self.assertEqual(process.stdout.strip().splitlines()[-1], '[]')
+
+
+class PriorityLaneTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pairs_are_enqueued_on_the_lane_of_their_rule(self):
+        high = LeadFollowupRule.objects.create(text='pay', status=LeadStatus.VERIFIED, delay=5, priority=FollowupPriority.HIGH)
+        low = LeadFollowupRule.objects.create(text='hi', status=LeadStatus.NEW, delay=5, priority=FollowupPriority.LOW)
+
+        with patch.object(lead_tasks.task_send_followup, 'chunks') as chunks:
+            lead_tasks._enqueue_followups([(1, low.pk), (2, high.pk), (3, low.pk)])
+
+        queues = {
+            call.args[0][0][1]: (call.args[0], chunks.return_value.apply_async.call_args_list[index].kwargs['queue'])
+            for index, call in enumerate(chunks.call_args_list)
+        }
+        self.assertEqual(queues[high.pk], ([(2, high.pk)], 'followups.send.high'))
+        self.assertEqual(queues[low.pk], ([(1, low.pk), (3, low.pk)], 'followups.send.low'))
+
+    def test_weighted_cycle_shares_pops_by_weight(self):
+        cycle = lanes.WeightedLaneCycle()
+        cycle.update(list(settings.FOLLOWUP_SEND_LANES.values()))
+        random.seed(1)
+        firsts = [cycle.consume(3)[0] for _ in range(6000)]
+
+        # Weights 8:3:1 while every lane is backed up; the low lane still gets its turn
+        self.assertAlmostEqual(firsts.count('followups.send.high') / 6000, 8 / 12, delta=0.03)
+        self.assertAlmostEqual(firsts.count('followups.send.low') / 6000, 1 / 12, delta=0.02)
+
+        # Consumers without lanes keep kombu's round robin
+        cycle.update(['celery', 'followups.collect'])
+        self.assertEqual(cycle.consume(2), ['celery', 'followups.collect'])
+
+    def test_queue_latency_is_recorded_per_lane(self):
+        headers = {}
+        lanes._stamp_lane(headers=headers, routing_key='followups.send.high')
+        self.assertEqual(headers[lanes.LANE_HEADER], 'high')
+
+        task = SimpleNamespace(request={**headers, lanes.DUE_AT_HEADER: headers[lanes.DUE_AT_HEADER] - 3})
+        lanes._record_lane_wait(task=task)
+        lanes._record_lane_wait(task=SimpleNamespace(request={}))  # Eager runs carry no lane
+        lanes.record_wait('high', 0.5)
+
+        with patch('lead.lanes.queue_depths', return_value={'followups.send.high': 7, 'followups.send.low': 0}):
+            stats = lanes.lane_stats(['high', 'low'])
+        self.assertEqual(stats['high']['messages'], 2)
+        self.assertEqual(stats['high']['depth'], 7)
+        self.assertEqual(stats['high']['p50_wait'], 1)
+        self.assertEqual(stats['high']['p95_wait'], 5)
+        self.assertIsNone(stats['low']['mean_wait'])
+
+    def test_depth_probe_gives_up_at_once_without_a_broker(self):
+        connection_for_read = celery_app.connection_for_read
+        started = time.monotonic()
+        with patch.object(
+            celery_app, 'connection_for_read', lambda **kwargs: connection_for_read('redis://127.0.0.1:1/0', **kwargs)
+        ), \
+                self.assertLogs('app', level='WARNING'):
+            depths = lanes.queue_depths(['followups.send.high'])
+
+        self.assertEqual(depths, {'followups.send.high': None})
+        self.assertLess(time.monotonic() - started, 1)  # No retry: the collector reads it under its lock
+
+
+@override_settings(TRACING_SAMPLE_RATE=1.0, TRACING_EXPORTER='lead.tests._CollectingExporter')
+class TracingTest(TestCase):
+
+    def setUp(self):
+        _CollectingExporter.spans.clear()
+
+    def test_http_request_starts_trace_with_db_spans(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+
+        response = self.client.post(
+            reverse('lead:lead-event-create'),
+            {'lead_id': lead.id, 'status': LeadStatus.SUBMITTED},
+            content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 201)
+        root = next(span for span in _CollectingExporter.spans if span.name == 'http.request')
+        self.assertIsNone(root.parent_id)
+        self.assertEqual(root.attributes['lead_id'], lead.id)
+        self.assertEqual(response[tracing.TRACEPARENT_HEADER], root.context.traceparent)
+        db_spans = [span for span in _CollectingExporter.spans if span.name == 'db.query']
+        self.assertTrue(db_spans)
+        self.assertTrue(all(span.context.trace_id == root.context.trace_id for span in db_spans))
+
+    def test_incoming_unsampled_traceparent_is_respected(self):
+        parent = '00-' + 'a' * 32 + '-' + 'b' * 16 + '-00'
+
+        response = self.client.get(reverse('lead:lead-list'), HTTP_TRACEPARENT=parent)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(_CollectingExporter.spans, [])
+        self.assertTrue(response[tracing.TRACEPARENT_HEADER].startswith('00-' + 'a' * 32))
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_collector_trace_reaches_send_tasks(self):
+        lead = Lead.objects.create(phone=_get_random_phone_number(), status=LeadStatus.NEW)
+        rule = LeadFollowupRule.objects.create(text='ping', status=LeadStatus.NEW, delay=1, is_enabled=True)
+        Lead.objects.filter(pk=lead.pk).update(updated_at=timezone.now() - timedelta(minutes=2))
+
+        with patch('lead.sms.sleep'):
+            task_collect_followups.delay().get(timeout=2)
+
+        collector = next(
+            span for span in _CollectingExporter.spans
+            if span.name == 'celery.task lead.task.task_collect_followups'
+        )
+        send = next(span for span in _CollectingExporter.spans if span.name == 'lead.send_followup')
+        sms = next(span for span in _CollectingExporter.spans if span.name == 'sms.send')
+        self.assertIsNone(collector.parent_id)
+        self.assertEqual(send.context.trace_id, collector.context.trace_id)
+        self.assertEqual(send.attributes, {'lead_id': lead.id, 'rule_id': rule.id})
+        self.assertEqual(sms.parent_id, send.context.span_id)
+        self.assertNotIn(lead.phone, json.dumps([span.attributes for span in _CollectingExporter.spans]))
@@ -1,7 +1,9 @@
 from django.urls import path
 from lead.views import (LeadEventCreateView, LeadEventListView,
-                        LeadFollowupListView, LeadFollowupRuleListView,
-                        LeadListView)
+                        LeadFollowupForecastView, LeadFollowupListView,
+                        LeadFollowupRuleListView, LeadListView,
+                        LeadLiveFeedView, LeadPhoneSearchView, LeadStatsView,
+                        LeadTimelineView)
 
 app_name = 'lead'
 
@@ -10,5 +12,10 @@ urlpatterns = [
     path('leads_followups/', LeadFollowupListView.as_view(), name='lead-followup-list'),
     path('leads_followup_rules/', LeadFollowupRuleListView.as_view(), name='lead-followup-rule-list'),
     path('leads/', LeadListView.as_view(), name='lead-list'),
-    path('lead_event_create/', LeadEventCreateView.as_view(), name='lead-event-create')
+    path('lead_event_create/', LeadEventCreateView.as_view(), name='lead-event-create'),
+    path('live/', LeadLiveFeedView.as_view(), name='lead-live-feed'),
+    path('<int:lead_id>/timeline/', LeadTimelineView.as_view(), name='lead-timeline'),
+    path('phone_search/', LeadPhoneSearchView.as_view(), name='lead-phone-search'),
+    path('stats/', LeadStatsView.as_view(), name='lead-stats'),
+    path('forecast/', LeadFollowupForecastView.as_view(), name='lead-followup-forecast')
 ]
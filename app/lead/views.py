@@ -1,23 +1,97 @@
+import asyncio
 import logging
+from typing import Any, Dict, List, Set, Tuple
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.db import transaction
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.views import View
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import (OpenApiExample, OpenApiParameter,
                                    extend_schema)
-from lead.models import Lead, LeadEvent, LeadFollowup, LeadFollowupRule
+from lead import live, outbox, phones, stats, timeline, wakeup
+from lead.conditional import ConditionalListMixin
+from lead.models import (Lead, LeadEvent, LeadFollowup, LeadFollowupRule,
+                         LeadStatus)
 from lead.pagination import CommonPagination
-from lead.serializers import (LeadEventSerializer, LeadFollowupRuleSerializer,
-                              LeadFollowupSerializer, LeadSerializer,
-                              NewLeadStatusValidator)
+from lead.serializers import (ForecastValidator, LeadEventSerializer,
+                              LeadFollowupRuleSerializer,
+                              LeadFollowupSerializer,
+                              LeadPhoneSearchPageSerializer, LeadSerializer,
+                              LeadTimelinePageSerializer, ListFilterValidator,
+                              NewLeadStatusValidator, PhoneSearchValidator)
 from rest_framework import status as http_status
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import CreateAPIView, ListAPIView
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from app import tracing
+from app.replicas import ReplicaReadMixin
 
 logger = logging.getLogger('app')
 
 
+def _filter_parameters(time_field: str, *fields: str) -> List[OpenApiParameter]:
+    descriptions = {
+        'status': 'Only rows with this status.',
+        'lead_id': 'Only rows of this lead.',
+    }
+    return [
+        OpenApiParameter(
+            name=field,
+            description=descriptions[field],
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.INT if field == 'lead_id' else OpenApiTypes.STR,
+            enum=LeadStatus.values if field == 'status' else None
+        )
+        for field in fields
+    ] + [
+        OpenApiParameter(
+            name=name,
+            description=f'Only rows with {time_field} {relation} this moment (ISO 8601).',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.DATETIME
+        )
+        for name, relation in (('since', 'at or after'), ('until', 'before'))
+    ]
+
+
+class IndexedFilterMixin:
+    '''
+    Server-side filters for list views, restricted to what an index serves: every filter combination is backed
+    by an index that ends with ``time_field``, so filtered results may only be ordered by that field.
+    '''
+    filter_fields: Tuple[str, ...] = ()
+    time_field: str
+
+    def get_filters(self) -> Dict[str, Any]:
+        validator = ListFilterValidator(data=self.request.query_params)
+        validator.is_valid(raise_exception=True)
+        data = validator.validated_data
+        filters = {field: data[field] for field in self.filter_fields if field in data}
+        if 'since' in data:
+            filters[f'{self.time_field}__gte'] = data['since']
+        if 'until' in data:
+            filters[f'{self.time_field}__lt'] = data['until']
+        return filters
+
+    def indexed_order_by(self, order_by: str, filters: Dict[str, Any]) -> str:
+        if filters and order_by != self.time_field:
+            logger.warning('order_by=%s has no index together with filters, using %s', order_by, self.time_field)
+            return self.time_field
+        return order_by
+
+
 @extend_schema(
-    description='Retrieve a paginated list of leads.',
+    description=(
+        'Retrieve a paginated list of leads. Send the returned ETag back as If-None-Match '
+        'to get an empty 304 response while nothing has changed.'
+    ),
     parameters=[
         OpenApiParameter(
             name='limit',
@@ -50,13 +124,17 @@ logger = logging.getLogger('app')
             type=OpenApiTypes.STR,
             enum=['asc', 'desc'],
             default='desc'
-        )
+        ),
+        *_filter_parameters('updated_at', 'status')
     ],
     responses={200: LeadSerializer(many=True)},
 )
-class LeadListView(ListAPIView):
+class LeadListView(ReplicaReadMixin, ConditionalListMixin, IndexedFilterMixin, ListAPIView):
     serializer_class = LeadSerializer
     pagination_class = CommonPagination
+    watermark_models = (Lead,)
+    filter_fields = ('status',)  # lead_status_updated_idx; lead_updated_idx for time ranges alone
+    time_field = 'updated_at'
 
     def get_queryset(self):
         default_order_field = 'updated_at'
@@ -72,8 +150,10 @@ class LeadListView(ListAPIView):
             logger.debug('Invalid order_dir=%s supplied, using desc', order_dir)
             order_dir = 'desc'
 
+        filters = self.get_filters()
+        order_by = self.indexed_order_by(order_by, filters)
         ordering = f'-{order_by}' if order_dir == 'desc' else order_by
-        return Lead.objects.order_by(ordering)
+        return Lead.objects.filter(**filters).order_by(ordering)
 
 
 @extend_schema(
@@ -110,13 +190,16 @@ class LeadListView(ListAPIView):
             type=OpenApiTypes.STR,
             enum=['asc', 'desc'],
             default='desc'
-        )
+        ),
+        *_filter_parameters('created_at', 'lead_id')
     ],
     responses={200: LeadFollowupSerializer(many=True)},
 )
-class LeadFollowupListView(ListAPIView):
+class LeadFollowupListView(ReplicaReadMixin, IndexedFilterMixin, ListAPIView):
     serializer_class = LeadFollowupSerializer
     pagination_class = CommonPagination
+    filter_fields = ('lead_id',)  # lead_followup_history_idx; lead_followup_created_idx for time ranges alone
+    time_field = 'created_at'
 
     def get_queryset(self):
         default_order_field = 'created_at'
@@ -132,12 +215,17 @@ class LeadFollowupListView(ListAPIView):
             logger.debug('Invalid order_dir=%s supplied, using desc', order_dir)
             order_dir = 'desc'
 
+        filters = self.get_filters()
+        order_by = self.indexed_order_by(order_by, filters)
         ordering = f'-{order_by}' if order_dir == 'desc' else order_by
-        return LeadFollowup.objects.order_by(ordering)
+        return LeadFollowup.objects.filter(**filters).order_by(ordering)
 
 
 @extend_schema(
-    description='Retrieve a paginated list of lead events.',
+    description=(
+        'Retrieve a paginated list of lead events. Send the returned ETag back as If-None-Match '
+        'to get an empty 304 response while nothing has changed.'
+    ),
     parameters=[
         OpenApiParameter(
             name='limit',
@@ -170,13 +258,18 @@ class LeadFollowupListView(ListAPIView):
             type=OpenApiTypes.STR,
             enum=['asc', 'desc'],
             default='desc'
-        )
+        ),
+        *_filter_parameters('created_at', 'status', 'lead_id')
     ],
     responses={200: LeadEventSerializer(many=True)},
 )
-class LeadEventListView(ListAPIView):
+class LeadEventListView(ReplicaReadMixin, ConditionalListMixin, IndexedFilterMixin, ListAPIView):
     serializer_class = LeadEventSerializer
     pagination_class = CommonPagination
+    watermark_models = (LeadEvent, Lead)  # Events embed their lead
+    # lead_event_latest_idx for lead_id, lead_event_status_created_idx for status, lead_event_created_idx for time ranges alone
+    filter_fields = ('status', 'lead_id')
+    time_field = 'created_at'
 
     def get_queryset(self):
         default_order_field = 'created_at'
@@ -192,8 +285,10 @@ class LeadEventListView(ListAPIView):
             logger.debug('Invalid order_dir=%s supplied, using desc', order_dir)
             order_dir = 'desc'
 
+        filters = self.get_filters()
+        order_by = self.indexed_order_by(order_by, filters)
         ordering = f'-{order_by}' if order_dir == 'desc' else order_by
-        return LeadEvent.objects.order_by(ordering)
+        return LeadEvent.objects.filter(**filters).order_by(ordering)
 
 
 @extend_schema(
@@ -234,7 +329,7 @@ class LeadEventListView(ListAPIView):
     ],
     responses={200: LeadFollowupRuleSerializer(many=True)},
 )
-class LeadFollowupRuleListView(ListAPIView):
+class LeadFollowupRuleListView(ReplicaReadMixin, ListAPIView):
     serializer_class = LeadFollowupRuleSerializer
     pagination_class = CommonPagination
 
@@ -281,17 +376,239 @@ class LeadEventCreateView(CreateAPIView):
 
         lead_id = in_ser.validated_data['lead_id']
         new_status = in_ser.validated_data['status']
+        # Lets the status change be joined with the follow-up spans it later causes
+        tracing.set_attribute('lead_id', lead_id)
 
         with transaction.atomic():
             lead = Lead.objects.select_for_update().get(pk=lead_id)
             if lead.status != new_status:
+                # Same reading of the history as stats.rebuild(): the time in a status runs from the start of its run
+                entered_at = stats.status_entered_at(lead, lead.status).values_list('created_at', flat=True).first()
+                stats.record_transition(lead.status, new_status, entered_at, timezone.now())
                 lead.status = new_status
                 lead.save(update_fields=['status', 'updated_at'])
+                wakeup.notify_lead_changed(lead.pk)  # Delivered on commit
 
             event = LeadEvent.objects.create(
                 lead=lead,
                 status=new_status
             )
+            outbox.record_event(event)  # Published by relay_lead_events only if this transaction commits
+            live.publish_on_commit(live.event_message(event))
 
         out_ser = LeadEventSerializer(event, context={'request': request})
         return Response(out_ser.data, status=http_status.HTTP_201_CREATED)
+
+
+@extend_schema(
+    description=(
+        "Retrieve a lead's events and followups merged into one stream, newest first. "
+        'Pass the returned "next" value as "cursor" to get the following page.'
+    ),
+    parameters=[
+        OpenApiParameter(
+            name='limit',
+            description='Maximum number of entries to return.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.INT,
+            default=CommonPagination.default_limit
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='Position returned as "next" by the previous page.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.STR
+        )
+    ],
+    responses={200: LeadTimelinePageSerializer()},
+)
+class LeadTimelineView(ReplicaReadMixin, APIView):
+
+    def get(self, request, lead_id: int):
+        params = request.query_params
+        try:
+            limit = min(int(params.get('limit', CommonPagination.default_limit)), CommonPagination.max_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+        if limit < 1:
+            raise ValidationError({'limit': 'Must be positive'})
+        try:
+            cursor = timeline.TimelineCursor.decode(params['cursor']) if 'cursor' in params else None
+        except ValueError:
+            raise ValidationError({'cursor': 'Invalid cursor'})
+        if not Lead.objects.filter(pk=lead_id).exists():
+            raise NotFound('Lead not found')
+
+        entries, next_cursor = timeline.timeline_page(lead_id, cursor, limit)
+        return Response(LeadTimelinePageSerializer({
+            'results': entries,
+            'next': next_cursor.encode() if next_cursor else None
+        }).data)
+
+
+@extend_schema(
+    description=(
+        'Find leads by phone number. "exact" looks up one E.164 number, "prefix" lists the numbers starting with '
+        '"q", "contains" the numbers containing its digits (at least 3). Spaces, dashes, dots and parentheses are '
+        'ignored and a leading 00 reads as +. Results are ordered by number; pass "next" back as "cursor" for the '
+        'following page.'
+    ),
+    parameters=[
+        OpenApiParameter(
+            name='q',
+            description='Phone number or part of it.',
+            required=True,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.STR
+        ),
+        OpenApiParameter(
+            name='mode',
+            description='How "q" is matched.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.STR,
+            enum=phones.MODES,
+            default=phones.EXACT
+        ),
+        OpenApiParameter(
+            name='limit',
+            description='Page size.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.INT,
+            default=CommonPagination.default_limit
+        ),
+        OpenApiParameter(
+            name='cursor',
+            description='"next" of the previous page.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.STR
+        )
+    ],
+    responses={200: LeadPhoneSearchPageSerializer()},
+)
+class LeadPhoneSearchView(ReplicaReadMixin, APIView):
+
+    def get(self, request):
+        params = PhoneSearchValidator(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        leads, next_cursor = phones.search(data['q'], data['mode'], data['limit'], data.get('cursor'))
+        return Response(LeadPhoneSearchPageSerializer({'results': leads, 'next': next_cursor}).data)
+
+
+@extend_schema(
+    description=(
+        'Retrieve funnel statistics: how many leads moved between each pair of statuses, the share of the leads '
+        'leaving a status that went to each next one, and a histogram of the time spent in each status '
+        '("le" is the upper bound of a bucket in seconds, null for the last one).'
+    ),
+    responses={200: OpenApiTypes.OBJECT},
+)
+class LeadStatsView(APIView):
+
+    def get(self, request):
+        return Response(stats.get_stats())
+
+
+@extend_schema(
+    description=(
+        'Forecast the follow-up SMS sent per time bucket over the next hours, assuming no lead changes status, '
+        'and compare it with the sending capacity. Pass "status" and "delay" to include a rule that is not saved yet.'
+    ),
+    parameters=[
+        OpenApiParameter(
+            name='hours',
+            description='Forecast horizon.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.INT,
+            default=24
+        ),
+        OpenApiParameter(
+            name='bucket',
+            description='Bucket width in minutes.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.INT,
+            default=60
+        ),
+        OpenApiParameter(
+            name='status',
+            description='Status of the proposed rule.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.STR,
+            enum=LeadStatus.values
+        ),
+        OpenApiParameter(
+            name='delay',
+            description='Delay of the proposed rule in minutes.',
+            required=False,
+            location=OpenApiParameter.QUERY,
+            type=OpenApiTypes.INT
+        )
+    ],
+    responses={200: OpenApiTypes.OBJECT},
+)
+class LeadFollowupForecastView(APIView):
+
+    def get(self, request):
+        from lead import forecast  # Keeps NumPy out of the web process until a forecast is asked for
+
+        params = ForecastValidator(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        proposed = None
+        if 'status' in data:
+            proposed = forecast.ForecastRule(forecast.PROPOSED, data['status'], data['delay'])
+        return Response(forecast.forecast(data['hours'], data['bucket'], proposed))
+
+
+async def _live_feed(cursor: live.Cursor | None, statuses: Set[str]):
+    queue = live.hub.subscribe()  # Subscribe before the backfill so nothing falls in between
+    try:
+        if cursor is None:
+            cursor = await sync_to_async(live.current_cursor)()
+        else:
+            for message in await sync_to_async(live.backfill)(cursor, statuses, settings.LIVE_FEED_BACKFILL_LIMIT):
+                cursor = cursor.advance(message)
+                yield live.format_message(message, cursor)
+
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=settings.LIVE_FEED_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'  # SSE comment: keeps proxies from closing an idle connection
+                continue
+            if message is None:
+                return  # Dropped as a slow consumer, the client reconnects with Last-Event-ID
+            if cursor.seen(message):
+                continue  # Already sent by the backfill
+            cursor = cursor.advance(message)
+            if not statuses or message['status'] in statuses:
+                yield live.format_message(message, cursor)
+    finally:
+        live.hub.unsubscribe(queue)
+
+
+class LeadLiveFeedView(View):
+    '''
+    Server-Sent Events stream of new lead events and followups, optionally filtered by ``status`` (repeatable).
+    Reconnecting clients send Last-Event-ID and first receive what they missed, up to LIVE_FEED_BACKFILL_LIMIT rows of each kind.
+    '''
+
+    async def get(self, request):
+        statuses = set(request.GET.getlist('status'))
+        unknown = statuses - set(LeadStatus.values)
+        if unknown:
+            return HttpResponseBadRequest(f'Unknown status: {", ".join(sorted(unknown))}')
+
+        cursor = live.Cursor.parse(request.headers.get('Last-Event-ID'))
+        response = StreamingHttpResponse(_live_feed(cursor, statuses), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Keep reverse proxies from buffering the stream
+        return response
@@ -0,0 +1,127 @@
+'''
+Low-latency wake-ups for the follow-up collector.
+
+Status changes and rule edits publish a notification on the WAKEUP_CHANNEL with pg_notify. PostgreSQL only
+delivers it once the surrounding transaction commits, so the listener never sees uncommitted state.
+The listener (``manage.py listen_followup_wakeups``) keeps the due times of the (lead, rule) pairs falling due
+within FOLLOWUP_WAKEUP_HORIZON and, when they come due, runs the collector for just those leads. The regular
+collector stays responsible for everything else, so a missed notification only costs latency.
+'''
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.db import connection
+from lead.models import Lead, LeadFollowupRule
+
+logger = logging.getLogger('app')
+
+WAKEUP_CHANNEL = 'lead_followups'
+RULES_CHANGED = 'rules'
+# Fire a little after the due time: the collector compares against the database clock
+FIRE_LAG = timedelta(milliseconds=200)
+
+
+def _notify(payload: str):
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [WAKEUP_CHANNEL, payload])
+
+
+def notify_lead_changed(lead_id: int):
+    _notify(f'lead:{lead_id}')
+
+
+def notify_leads_changed(lead_ids: Iterable[int]):
+    '''notify_lead_changed() for many leads, in a single statement.'''
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload',
+            [WAKEUP_CHANNEL, [f'lead:{lead_id}' for lead_id in lead_ids]]
+        )
+
+
+def notify_rules_changed():
+    _notify(RULES_CHANGED)
+
+
+class WakeupScheduler:
+    '''Due times of the (lead, rule) pairs that fall due within the horizon.'''
+
+    def __init__(self):
+        self.rules: Dict[str, List[Tuple[int, timedelta]]] = {}  # status -> [(rule_id, delay)]
+        self._heap: List[Tuple[datetime, int, int]] = []
+        self._pending: Dict[Tuple[int, int], datetime] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _track(self, lead_id: int, rule_id: int, due_at: datetime):
+        self._pending[(lead_id, rule_id)] = due_at
+        heapq.heappush(self._heap, (due_at, lead_id, rule_id))
+
+    def reload(self, now: datetime):
+        '''Reread the rules and every pair due within the horizon.'''
+        horizon = timedelta(seconds=settings.FOLLOWUP_WAKEUP_HORIZON)
+        self.rules = {}
+        for rule_id, status, delay in LeadFollowupRule.objects.filter(is_enabled=True).values_list('id', 'status', 'delay'):
+            self.rules.setdefault(status, []).append((rule_id, timedelta(minutes=delay)))
+
+        self._heap, self._pending = [], {}
+        for status, rules in self.rules.items():
+            for rule_id, delay in rules:
+                # Not overdue yet, but will be within the horizon: one range scan on lead_status_updated_idx
+                leads = Lead.objects.filter(
+                    status=status,
+                    updated_at__gt=now - delay,
+                    updated_at__lte=now - delay + horizon
+                ).values_list('id', 'updated_at')
+                for lead_id, updated_at in leads:
+                    self._track(lead_id, rule_id, updated_at + delay + FIRE_LAG)
+
+    def leads_changed(self, lead_ids: Iterable[int], now: datetime):
+        horizon_end = now + timedelta(seconds=settings.FOLLOWUP_WAKEUP_HORIZON)
+        for lead_id, status, updated_at in Lead.objects.filter(pk__in=lead_ids).values_list('id', 'status', 'updated_at'):
+            # Entries left from the previous status just fire a collection that finds nothing
+            for rule_id, delay in self.rules.get(status, ()):
+                due_at = updated_at + delay + FIRE_LAG
+                if due_at <= horizon_end:
+                    self._track(lead_id, rule_id, due_at)
+
+    def handle(self, payloads: Iterable[str], now: datetime):
+        '''Apply a batch of notifications; duplicates within the batch collapse into one lookup.'''
+        lead_ids = set()
+        for payload in payloads:
+            if payload == RULES_CHANGED:
+                self.reload(now)  # Covers every lead as well
+                return
+            kind, _, value = payload.partition(':')
+            if kind == 'lead' and value.isdigit():
+                lead_ids.add(int(value))
+            else:
+                logger.warning('Ignoring unknown wake-up notification %r', payload)
+        if lead_ids:
+            self.leads_changed(lead_ids, now)
+
+    def next_due_at(self) -> datetime | None:
+        while self._heap:
+            due_at, lead_id, rule_id = self._heap[0]
+            if self._pending.get((lead_id, rule_id)) == due_at:
+                return due_at
+            heapq.heappop(self._heap)  # Superseded by a later notification
+        return None
+
+    def pop_due(self, now: datetime) -> List[int]:
+        '''Ids of the leads with at least one pair due by ``now``.'''
+        lead_ids = set()
+        while self._heap and self._heap[0][0] <= now:
+            due_at, lead_id, rule_id = heapq.heappop(self._heap)
+            if self._pending.get((lead_id, rule_id)) == due_at:
+                del self._pending[(lead_id, rule_id)]
+                lead_ids.add(lead_id)
+        return sorted(lead_ids)
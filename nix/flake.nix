@@ -162,6 +162,10 @@
                   "app"
                   "worker"
                   "--loglevel=info"
+                  "-Q"
+                  "celery,followups.collect"
+                  "-n"
+                  "worker@%h"
                 ];
                 availability = { restart = "always"; };
                 depends_on = {
@@ -172,6 +176,88 @@
                 };
                 environment = [
                   "DJANGO_SETTINGS_MODULE=app.settings"
+                  "APP_ROLE=worker"
+                  "POSTGRES_HOST=127.0.0.1"
+                  "CELERY_BROKER_URL=redis://127.0.0.1:${toString redisPort}/0"
+                  "CELERY_RESULT_BACKEND=redis://127.0.0.1:${toString redisPort}/1"
+                  "CACHE_URL=redis://127.0.0.1:${toString redisPort}/2"
+                ];
+                working_dir = ".";
+              };
+
+              sender = {
+                command = lib.concatStringsSep " " [
+                  "celery"
+                  "-A"
+                  "app"
+                  "worker"
+                  "--loglevel=info"
+                  "-Q"
+                  "followups.send.high,followups.send,followups.send.low"
+                  "-P"
+                  "threads"
+                  "-c"
+                  "64"
+                  "--prefetch-multiplier=1"
+                  "-n"
+                  "sender@%h"
+                ];
+                availability = { restart = "always"; };
+                depends_on = {
+                  postgres = { condition = "process_healthy"; };
+                  redis = { condition = "process_healthy"; };
+                  migrate = { condition = "process_completed_successfully"; };
+                  app = { condition = "process_started"; };
+                };
+                environment = [
+                  "DJANGO_SETTINGS_MODULE=app.settings"
+                  "APP_ROLE=worker"
+                  "POSTGRES_HOST=127.0.0.1"
+                  "CELERY_BROKER_URL=redis://127.0.0.1:${toString redisPort}/0"
+                  "CELERY_RESULT_BACKEND=redis://127.0.0.1:${toString redisPort}/1"
+                  "CACHE_URL=redis://127.0.0.1:${toString redisPort}/2"
+                ];
+                working_dir = ".";
+              };
+
+              wakeup = {
+                command = lib.concatStringsSep " " [
+                  "python"
+                  "manage.py"
+                  "listen_followup_wakeups"
+                ];
+                availability = { restart = "always"; };
+                depends_on = {
+                  postgres = { condition = "process_healthy"; };
+                  redis = { condition = "process_healthy"; };
+                  migrate = { condition = "process_completed_successfully"; };
+                };
+                environment = [
+                  "DJANGO_SETTINGS_MODULE=app.settings"
+                  "APP_ROLE=worker"
+                  "POSTGRES_HOST=127.0.0.1"
+                  "CELERY_BROKER_URL=redis://127.0.0.1:${toString redisPort}/0"
+                  "CELERY_RESULT_BACKEND=redis://127.0.0.1:${toString redisPort}/1"
+                  "CACHE_URL=redis://127.0.0.1:${toString redisPort}/2"
+                ];
+                working_dir = ".";
+              };
+
+              relay = {
+                command = lib.concatStringsSep " " [
+                  "python"
+                  "manage.py"
+                  "relay_lead_events"
+                ];
+                availability = { restart = "always"; };
+                depends_on = {
+                  postgres = { condition = "process_healthy"; };
+                  redis = { condition = "process_healthy"; };
+                  migrate = { condition = "process_completed_successfully"; };
+                };
+                environment = [
+                  "DJANGO_SETTINGS_MODULE=app.settings"
+                  "APP_ROLE=worker"
                   "POSTGRES_HOST=127.0.0.1"
                   "CELERY_BROKER_URL=redis://127.0.0.1:${toString redisPort}/0"
                   "CELERY_RESULT_BACKEND=redis://127.0.0.1:${toString redisPort}/1"
@@ -198,6 +284,7 @@
                 };
                 environment = [
                   "DJANGO_SETTINGS_MODULE=app.settings"
+                  "APP_ROLE=worker"
                   "POSTGRES_HOST=127.0.0.1"
                   "CELERY_BROKER_URL=redis://127.0.0.1:${toString redisPort}/0"
                   "CELERY_RESULT_BACKEND=redis://127.0.0.1:${toString redisPort}/1"